@@ -1,21 +1,116 @@
-from flask import Flask, request, jsonify, Response, send_file
+from flask import Flask, request, jsonify, Response, send_file, g, has_request_context
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 import requests
 import os
 from dotenv import load_dotenv
 import uuid
 from datetime import datetime
 import json
-from elevenlabs import ElevenLabs, VoiceSettings, DialogueInput
 import io
+import gzip
+import base64
+import zlib
 import re
 import threading
+import time
+import hashlib
+import bisect
+import functools
+import heapq
+import hmac
+import math
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import atexit
+from contextlib import contextmanager, ExitStack
+from urllib.parse import urlsplit
+from collections import namedtuple, OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeoutError
 
 # Load .env from parent directory (root of project)
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env'))
 
 app = Flask(__name__)
 
+# Logging: request threads only enqueue records; a listener thread formats
+# and writes them, so slow stdout never stalls a request. Verbose upstream
+# payloads are sampled and every field is truncated.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')  # json | text
+LOG_MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', 500))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.01))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+def truncate(value, limit=None):
+    """Cut long strings to limit characters, noting how much was dropped"""
+    limit = limit or LOG_MAX_FIELD_CHARS
+    if len(value) <= limit:
+        return value
+    return f"{value[:limit]}...[{len(value) - limit} more chars]"
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object (or key=value line) per record with truncated fields"""
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': truncate(record.getMessage()),
+        }
+        for key, value in getattr(record, 'fields', {}).items():
+            entry[key] = truncate(value) if isinstance(value, str) else value
+        if record.exc_info:
+            entry['exc'] = truncate(self.formatException(record.exc_info), LOG_MAX_FIELD_CHARS * 8)
+        if LOG_FORMAT == 'text':
+            extras = ' '.join(f"{key}={value!r}" for key, value in entry.items() if key not in ('ts', 'level', 'logger', 'msg', 'exc'))
+            line = f"{entry['ts']} {entry['level']:<7} {entry['logger']}: {entry['msg']} {extras}".rstrip()
+            return f"{line}\n{entry['exc']}" if 'exc' in entry else line
+        return json.dumps(entry, default=str)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener without formatting them; drops them when the queue is full"""
+    def prepare(self, record):
+        # Merge args now so later mutation can't change the message, but leave
+        # formatting and traceback rendering to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if has_request_context():
+            record.fields = {'request': f"{request.method} {request.path}", **getattr(record, 'fields', {})}
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc('dungeonforge_log_dropped_total')
+
+def log_payload(logger, message, payload):
+    """Log a verbose upstream payload at DEBUG for a sampled fraction of calls"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.debug("%s: %s", message, payload)
+
+log_queue = queue.Queue(LOG_QUEUE_SIZE)
+log_output = logging.StreamHandler(sys.stdout)
+log_output.setFormatter(StructuredFormatter())
+log_listener = logging.handlers.QueueListener(log_queue, log_output)
+logging.root.handlers = [NonBlockingQueueHandler(log_queue)]
+logging.root.setLevel(LOG_LEVEL)
+# The ElevenLabs SDK's HTTP client logs every request at INFO
+logging.getLogger('httpx').setLevel(logging.WARNING)
+log_listener.start()
+atexit.register(log_listener.stop)
+
+log = logging.getLogger('dungeonforge')
+airia_log = log.getChild('airia')
+cassette_log = log.getChild('cassette')
+stackai_log = log.getChild('stackai')
+images_log = log.getChild('images')
+tts_log = log.getChild('tts')
+
 # CORS configuration - allow frontend URL from environment or localhost
 FRONTEND_URL = os.getenv('FRONTEND_URL', 'http://localhost:3000').rstrip('/')
 # Allow both the configured frontend and localhost, plus Render domains
@@ -32,25 +127,69 @@ CORS(app,
      resources={r"/*": {
          "origins": allowed_origins,
          "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-         "allow_headers": ["Content-Type"]
+         "allow_headers": ["Content-Type", "Idempotency-Key"],
+         "expose_headers": ["Retry-After", "X-Audio-Quality", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset"]
      }},
      supports_credentials=True)
 
+# Behind TRUSTED_PROXY_HOPS reverse proxies, take the client address from X-Forwarded-For.
+# Required behind a proxy (1 on Render): otherwise all players share one per-IP rate limit.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
 # Initialize Airia configuration
 AIRIA_API_KEY = os.getenv('AIRIA_API_KEY')
 AIRIA_USER_ID = os.getenv('AIRIA_USER_ID', str(uuid.uuid4()))
-AIRIA_PIPELINE_URL = "https://api.airia.ai/v2/PipelineExecution/74d3e775-1b60-42f2-be75-e3fb963a5e02"
+AIRIA_PIPELINE_URL = os.getenv('AIRIA_PIPELINE_URL', "https://api.airia.ai/v2/PipelineExecution/74d3e775-1b60-42f2-be75-e3fb963a5e02")
+# asyncOutput mode: the pipeline answers with an execution id at once and a
+# shared poller fetches the result, so no connection is held open per generation
+AIRIA_ASYNC_OUTPUT = os.getenv('AIRIA_ASYNC_OUTPUT', 'false').lower() == 'true'
+AIRIA_EXECUTION_URL = os.getenv('AIRIA_EXECUTION_URL', AIRIA_PIPELINE_URL.rsplit('/', 1)[0] + '/{execution_id}')
+AIRIA_POLL_INTERVAL_SECONDS = float(os.getenv('AIRIA_POLL_INTERVAL_SECONDS', '1'))
+AIRIA_POLL_MAX_INTERVAL_SECONDS = 5
+AIRIA_TIMEOUT_SECONDS = 90
+# After AIRIA_BREAKER_FAILURES failed calls in a row, skip Airia for the cooldown
+# and tell stories with the local procedural engine instead of waiting out timeouts.
+# STORY_ENGINE=procedural never calls Airia (offline play and load tests).
+AIRIA_BREAKER_FAILURES = int(os.getenv('AIRIA_BREAKER_FAILURES', 3))
+AIRIA_BREAKER_COOLDOWN_SECONDS = int(os.getenv('AIRIA_BREAKER_COOLDOWN_SECONDS', 30))
+STORY_ENGINE = os.getenv('STORY_ENGINE', 'airia')  # airia | procedural
 
 # Initialize ElevenLabs configuration
 ELEVENLABS_API_KEY = os.getenv('ELEVENLABS_API_KEY')
+ELEVENLABS_BASE_URL = os.getenv('ELEVENLABS_BASE_URL')  # only set to point at a local mock
+# The SDK is the slowest import in the app, so it is loaded with the client on
+# first use (or by the warm-up hook) rather than on every cold start
 elevenlabs_client = None
-if ELEVENLABS_API_KEY:
-    elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY)
+elevenlabs_http = None
+elevenlabs_client_lock = threading.Lock()
+
+# Warm-up: once the server answers /health, import deferred dependencies and
+# open pooled connections to the upstreams before the first player request
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'false').lower() == 'true'
 
 # Stack-AI Image Generation Configuration
 STACK_AI_API_URL = os.getenv('STACK_AI_API_URL')
 STACK_AI_API_KEY = os.getenv('STACK_AI_API_KEY')
 
+# Scene image proxy: renders are fetched once into a bounded local
+# content-addressed store and served from /images with long-lived caching
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_cache'))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+IMAGE_FETCH_MAX_BYTES = 20 * 1024 * 1024
+IMAGE_VARIANT_WIDTHS = (256, 512, 1024)
+IMAGE_CONTENT_TYPES = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp', 'image/gif': 'gif'}
+IMAGE_NAME_RE = re.compile(r'[0-9a-f]{32}\.(?:png|jpg|webp|gif)')
+
+# Progressive scene images: story messages go out at once with scene_preview, a
+# small SVG placeholder drawn locally from summary50, and the Stack-AI render
+# replaces it in the background. Solo stories collect their render from
+# /scene-image/<id>; lobby messages are patched in place.
+SCENE_RENDER_WORKERS = int(os.getenv('SCENE_RENDER_WORKERS', 4))
+SCENE_RENDER_WAIT_SECONDS = 120  # longest /scene-image/<id> waits on a render
+scene_render_executor = ThreadPoolExecutor(max_workers=SCENE_RENDER_WORKERS, thread_name_prefix='scene-render')
+
 # Voice IDs for different characters/roles
 VOICE_ROLES = {
     'narrator': 'JBFqnCBsd6RMkjVDRZzb',  # George - British narrator
@@ -60,59 +199,868 @@ VOICE_ROLES = {
     'monster': '21m00Tcm4TlvDq8ikWAM',  # Josh - Deep male voice for monsters
 }
 
+# Text-to-speech synthesis: segments are voiced in parallel on a bounded pool
+TTS_MODEL_ID = "eleven_turbo_v2_5"
+# Quality tiers: {name: (ElevenLabs output format, Content-Type)}. Clients pick one
+# with ?quality=, Accept: audio/ogg for Opus, or the Save-Data/ECT hints; each
+# tier has its own cache entries. Only MP3 segments concatenate into one stream,
+# so the Opus tier is voiced by the narrator alone (see speech_segments).
+TTS_TIERS = {
+    'high': ('mp3_44100_128', 'audio/mpeg'),
+    'standard': ('mp3_44100_64', 'audio/mpeg'),
+    'low': ('mp3_22050_32', 'audio/mpeg'),
+    'opus': ('opus_48000_32', 'audio/ogg'),
+}
+TTS_DEFAULT_TIER = os.getenv('TTS_DEFAULT_TIER', 'high')
+if TTS_DEFAULT_TIER not in TTS_TIERS:
+    TTS_DEFAULT_TIER = 'high'
+TTS_MAX_WORKERS = int(os.getenv('TTS_MAX_WORKERS', 4))
+TTS_SEGMENT_CACHE_MAX_BYTES = int(os.getenv('TTS_SEGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+tts_executor = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix='tts')
+
+# Background narration: synthesize each committed story before anyone presses play.
+# Off by default since it spends ElevenLabs characters speculatively.
+TTS_PRESYNTH_ENABLED = os.getenv('TTS_PRESYNTH_ENABLED', 'false').lower() == 'true'
+TTS_PRESYNTH_CHAR_BUDGET = int(os.getenv('TTS_PRESYNTH_CHAR_BUDGET', 50000))  # characters per window
+TTS_PRESYNTH_BUDGET_WINDOW = int(os.getenv('TTS_PRESYNTH_BUDGET_WINDOW', 3600))  # seconds
+TTS_AUDIO_CACHE_MAX_BYTES = int(os.getenv('TTS_AUDIO_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Separate pool: narration jobs wait on segment futures from tts_executor
+narration_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='tts-presynth')
+
+# Solo /story response cache (opt-in). Continuations are keyed by the normalized
+# message, events remaining and prompt version; each key collects up to
+# STORY_CACHE_VARIANTS generations before hits start, then serves one at random.
+STORY_CACHE_ENABLED = os.getenv('STORY_CACHE_ENABLED', 'false').lower() == 'true'
+STORY_CACHE_TTL_SECONDS = int(os.getenv('STORY_CACHE_TTL_SECONDS', 3600))
+STORY_CACHE_MAX_KEYS = int(os.getenv('STORY_CACHE_MAX_KEYS', 2000))
+STORY_CACHE_VARIANTS = max(1, int(os.getenv('STORY_CACHE_VARIANTS', 3)))
+
+# Campaign archive: finished lobbies are appended to compressed NDJSON segments
+# and, after a grace period for the final screen, evicted from memory. Their
+# transcripts stay available from /lobby/<id>/export.
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'campaign_archive'))
+ARCHIVE_SEGMENT_MAX_BYTES = int(os.getenv('ARCHIVE_SEGMENT_MAX_BYTES', 64 * 1024 * 1024))
+ARCHIVE_EVICT_AFTER_SECONDS = int(os.getenv('ARCHIVE_EVICT_AFTER_SECONDS', 900))
+# One writer keeps segment appends ordered without file locking
+archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='archive')
+
 # Lobby management
 lobbies = {}  # {lobby_id: lobby_data}
 user_sessions = {}  # {user_id: lobby_id}
 starting_lobbies = set()  # Track lobbies currently starting
 
-# Image generation cache
-image_cache = {}  # {request_id: image_url}
+# Lobby size: lobbies hold 3 players unless created with max_players, up to the
+# limit. Spectators follow along read-only and are only counted in lobby state.
+LOBBY_DEFAULT_PLAYERS = 3
+LOBBY_MAX_PLAYERS = int(os.getenv('LOBBY_MAX_PLAYERS', 64))
+LOBBY_MAX_SPECTATORS = int(os.getenv('LOBBY_MAX_SPECTATORS', 1000))
+LOBBY_LONG_POLL_MAX_SECONDS = 25
+# Round prompts name every player's choice up to this many players; larger
+# lobbies get the vote distribution instead, so prompt size stays bounded
+ROUND_PROMPT_VERBATIM_PLAYERS = 6
+ROUND_PROMPT_TOP_VOTES = 5
+ROUND_PROMPT_CHOICE_CHARS = 160
 
-def call_airia_agent(user_input):
-    """Call Airia agent and return the response"""
+# Sharding: with several nodes, each lobby lives on the node its id hashes to on
+# a consistent-hash ring. Other nodes forward (or redirect) its requests there.
+NODE_URL = os.getenv('NODE_URL', '').rstrip('/')  # this node, as listed in CLUSTER_NODES
+CLUSTER_NODES = [node.strip().rstrip('/') for node in os.getenv('CLUSTER_NODES', '').split(',') if node.strip()]
+CLUSTER_ROUTING = os.getenv('CLUSTER_ROUTING', 'proxy')  # proxy | redirect
+CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')  # shared by nodes for handoff and membership calls
+CLUSTER_VNODES = 64  # ring points per node; more points spread lobbies more evenly
+moving_lobbies = set()  # lobbies being handed off to another node
+
+# Admin diagnostics (/admin/profile, /admin/slow-requests), enabled by setting
+# ADMIN_TOKEN and sent as "Authorization: Bearer <token>". Requests slower than
+# SLOW_REQUEST_THRESHOLD_SECONDS (0 disables) keep their stage timings and a few
+# stack snapshots taken while they ran; the newest SLOW_REQUEST_MAX_ENTRIES are kept.
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+PROFILE_MAX_SECONDS = 60
+SLOW_REQUEST_THRESHOLD_SECONDS = float(os.getenv('SLOW_REQUEST_THRESHOLD_SECONDS', 5))
+SLOW_REQUEST_MAX_ENTRIES = int(os.getenv('SLOW_REQUEST_MAX_ENTRIES', 100))
+SLOW_REQUEST_MAX_STACKS = 5  # snapshots per request, one per threshold elapsed
+
+# Idempotency keys: a retried POST carrying the same Idempotency-Key attaches to
+# the first submission's in-flight or finished response instead of generating again
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 600))
+IDEMPOTENCY_WAIT_SECONDS = 120  # longest a duplicate waits on the original
+IDEMPOTENCY_MAX_KEYS = 10000
+IdempotencyRecord = namedtuple('IdempotencyRecord', ['fingerprint', 'future', 'created'])
+idempotency_records = OrderedDict()  # {(path, key): IdempotencyRecord}, oldest first
+idempotency_lock = threading.Lock()
+
+# Rate limits: token buckets per client IP, user_id and lobby_id, charged by the
+# endpoints that spend upstream quota (see the rate_limited costs). BURST is a
+# bucket's size and PER_MINUTE its refill rate; a PER_MINUTE of 0 disables the key.
+RATE_LIMITS = {  # {scope: (tokens per minute, burst)}
+    'ip': (int(os.getenv('RATE_LIMIT_IP_PER_MINUTE', 120)), int(os.getenv('RATE_LIMIT_IP_BURST', 240))),
+    'user': (int(os.getenv('RATE_LIMIT_USER_PER_MINUTE', 60)), int(os.getenv('RATE_LIMIT_USER_BURST', 120))),
+    'lobby': (int(os.getenv('RATE_LIMIT_LOBBY_PER_MINUTE', 300)), int(os.getenv('RATE_LIMIT_LOBBY_BURST', 600))),
+}
+RATE_LIMIT_TTS_CHARS_PER_TOKEN = 100
+RATE_LIMIT_MAX_KEYS = 100000
+
+# Round deadlines: when a round is open this long, it resolves with the choices
+# received so far and idle players take ROUND_DEFAULT_CHOICE. A round nobody has
+# chosen in is parked instead (no deadline) until the next choice arrives, so an
+# abandoned lobby does not play itself out. 0 disables.
+ROUND_DEADLINE_SECONDS = int(os.getenv('ROUND_DEADLINE_SECONDS', 120))
+ROUND_DEFAULT_CHOICE = "Hesitates, then follows the party's lead."
+# Deadline-triggered rounds generate here, off the scheduler thread
+round_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='round')
+
+# Admission control for story generation (/story, /lobby/start, lobby rounds).
+# At most GENERATION_MAX_IN_FLIGHT run at once; past GENERATION_DEGRADE_IN_FLIGHT
+# new ones are text-only (no scene image or narration). Requests that would wait
+# longer than GENERATION_MAX_QUEUE_WAIT_SECONDS for a slot get 503 + Retry-After.
+GENERATION_MAX_IN_FLIGHT = int(os.getenv('GENERATION_MAX_IN_FLIGHT', 32))
+GENERATION_DEGRADE_IN_FLIGHT = int(os.getenv('GENERATION_DEGRADE_IN_FLIGHT', GENERATION_MAX_IN_FLIGHT * 3 // 4))
+GENERATION_MAX_QUEUE_WAIT_SECONDS = float(os.getenv('GENERATION_MAX_QUEUE_WAIT_SECONDS', 5))
+
+# Fallback option pools for lobby rounds, used when the model returns no options.
+# Each round stores its options once; players get index assignments into the list.
+OPTIONS_PER_PLAYER = 4
+OPENING_OPTION_TEMPLATES = [
+    "Approach the hooded figure and examine the map.", "Order drinks and listen for rumors.", "Investigate the tavern's back rooms.", "Leave and explore the town.",
+    "Challenge the hooded figure to a game of dice.", "Search for hidden passages in the walls.", "Buy information from the bartender.", "Follow a suspicious patron outside.",
+    "Cast a detection spell to reveal secrets.", "Use stealth to eavesdrop on conversations.", "Offer to help the tavern keeper.", "Examine the map for magical properties."
+]
+ROUND_OPTION_TEMPLATES = [
+    "Investigate the mysterious sounds coming from below.", "Search for hidden treasure in the room.", "Attempt to communicate with the spirits.", "Look for secret passages in the walls.",
+    "Cast a protective spell around the group.", "Use magic to illuminate the dark corners.", "Try to dispel any curses in the area.", "Summon a familiar to scout ahead.",
+    "Draw your weapon and prepare for combat.", "Use stealth to avoid detection.", "Set up traps for potential enemies.", "Call out to announce your presence."
+]
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and, optionally, total value size in bytes"""
+    def __init__(self, max_entries=1024, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # {key: (value, size)}
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key, value, size=0):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+    
+    def __len__(self):
+        return len(self._entries)
+
+class DeadlineScheduler:
+    """
+    One timer thread for every pending deadline, kept in a heap by due time.
+    Scheduling a key again replaces its deadline; superseded and cancelled
+    entries are skipped when they surface. Callbacks run on an executor so a
+    slow one never delays the next deadline.
+    """
+    def __init__(self, executor):
+        self.executor = executor
+        self._heap = []  # [(due, sequence, key)]
+        self._pending = {}  # {key: (sequence, callback)}
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def schedule(self, key, delay, callback):
+        with self._condition:
+            self._sequence += 1
+            self._pending[key] = (self._sequence, callback)
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._sequence, key))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='deadlines', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+    
+    def cancel(self, key):
+        with self._condition:
+            self._pending.pop(key, None)
+    
+    def __len__(self):
+        return len(self._pending)
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._condition.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, sequence, key = heapq.heappop(self._heap)
+                pending = self._pending.get(key)
+                if pending is None or pending[0] != sequence:
+                    continue
+                del self._pending[key]
+            self.executor.submit(pending[1])
+
+round_deadlines = DeadlineScheduler(round_executor)
+
+class GenerationOverloaded(Exception):
+    """No generation slot within the queue-wait budget; retry_after is in seconds"""
+    def __init__(self, retry_after):
+        super().__init__(f"Generation capacity exhausted, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Bounds concurrent generations. A request queues for a slot for up to
+    max_wait seconds, but is turned away at once when its expected wait (queue
+    position x recent generation time / slots) is already longer. Generations
+    admitted while more than degrade_at are running, or while queue waits run
+    past half of max_wait, are flagged degraded and skip images and narration.
+    Everything outside admission (lobby reads, /health, media) never queues here.
+    """
+    def __init__(self, max_in_flight, degrade_at, max_wait):
+        self.max_in_flight = max_in_flight
+        self.degrade_at = degrade_at
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        self._generation_seconds = 10.0  # moving average; a first guess until generations finish
+        self._wait_seconds = 0.0  # moving average of queue waits
+        self._condition = threading.Condition()
+    
+    def _retry_after(self):
+        expected = (self.waiting + 1) * self._generation_seconds / self.max_in_flight
+        return max(1, min(30, math.ceil(expected)))
+    
+    def _reject(self, endpoint):
+        metrics.inc('dungeonforge_admission_total', endpoint=endpoint, outcome='rejected')
+        raise GenerationOverloaded(self._retry_after())
+    
+    @contextmanager
+    def slot(self, endpoint):
+        """Hold a generation slot; yields True when the generation should be text-only"""
+        enqueued = time.monotonic()
+        with self._condition:
+            if self.in_flight >= self.max_in_flight:
+                if (self.waiting + 1) * self._generation_seconds / self.max_in_flight > self.max_wait:
+                    self._reject(endpoint)
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = enqueued + self.max_wait - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(endpoint)
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            waited = time.monotonic() - enqueued
+            self._wait_seconds = 0.8 * self._wait_seconds + 0.2 * waited
+            degraded = self.in_flight > self.degrade_at or self._wait_seconds > self.max_wait / 2
+        metrics.observe('dungeonforge_admission_wait_seconds', waited)
+        metrics.inc('dungeonforge_admission_total', endpoint=endpoint, outcome='degraded' if degraded else 'admitted')
+        started = time.monotonic()
+        try:
+            yield degraded
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._generation_seconds = 0.8 * self._generation_seconds + 0.2 * (time.monotonic() - started)
+                self._condition.notify()
+
+generation_admission = AdmissionController(GENERATION_MAX_IN_FLIGHT, GENERATION_DEGRADE_IN_FLIGHT,
+                                           GENERATION_MAX_QUEUE_WAIT_SECONDS)
+
+def overloaded_response(e):
+    response = pretty_json({'error': 'The storytellers are busy, please try again shortly', 'retry_after': e.retry_after}, 503)
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+# Synthesized audio per (voice, model, format, text) so repeated lines skip ElevenLabs
+tts_segment_cache = LRUCache(max_entries=4096, max_bytes=TTS_SEGMENT_CACHE_MAX_BYTES)
+
+# Local /images path per remote scene image URL
+image_cache = LRUCache(max_entries=4096)
+# {render id: Future of a solo story's scene image URL}
+scene_renders = LRUCache(max_entries=1024)
+# {(prompt version, message, events remaining): ((created, story, summary50, options, scene_image), ...)}
+story_cache = LRUCache(max_entries=STORY_CACHE_MAX_KEYS)
+story_cache_lock = threading.Lock()  # serializes adding variants to a key
+# Files in IMAGE_CACHE_DIR in least-recently-used order
+image_store = OrderedDict()  # {filename: size}
+image_store_state = {'total_bytes': 0}
+image_store_lock = threading.Lock()
+
+# Full narration audio by audio_id, plus jobs still being synthesized
+narration_audio_cache = LRUCache(max_entries=512, max_bytes=TTS_AUDIO_CACHE_MAX_BYTES)
+narration_jobs = {}  # {audio_id: Future}
+narration_jobs_lock = threading.Lock()
+presynth_budget = {'window_start': time.time(), 'chars_used': 0}
+
+# Stage and upstream latency buckets in seconds; generations run for tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 90.0)
+
+METRIC_HELP = {
+    'dungeonforge_http_requests_total': 'HTTP requests by endpoint, method and status',
+    'dungeonforge_http_request_seconds': 'HTTP request handling time by endpoint',
+    'dungeonforge_stage_seconds': 'Time spent in each request stage',
+    'dungeonforge_upstream_seconds': 'Upstream API call latency by service and outcome',
+    'dungeonforge_parse_failures_total': 'Model replies that were not valid JSON',
+    'dungeonforge_tts_responses_total': 'Narration audio responses by quality tier',
+    'dungeonforge_tts_bytes_total': 'Narration audio bytes sent by quality tier',
+    'dungeonforge_tts_first_byte_seconds': 'Time from request to the first narration audio byte by quality tier',
+    'dungeonforge_rate_limited_total': 'Requests refused with 429 by endpoint and the bucket scope that ran out',
+    'dungeonforge_slow_requests_total': 'Requests that ran past SLOW_REQUEST_THRESHOLD_SECONDS',
+    'dungeonforge_story_fallbacks_total': 'Rounds told by the procedural engine because Airia gave no story',
+    'dungeonforge_airia_skipped_total': 'Airia calls skipped for the procedural engine or an open circuit',
+    'dungeonforge_circuit_opened_total': 'Times an upstream circuit breaker opened',
+    'dungeonforge_lobby_polls_total': 'Lobby state polls',
+    'dungeonforge_log_dropped_total': 'Log records dropped because the log queue was full',
+    'dungeonforge_idempotent_replays_total': 'Duplicate submissions answered from an earlier request',
+    'dungeonforge_rounds_auto_resolved_total': 'Lobby rounds resolved by their deadline',
+    'dungeonforge_rounds_parked_total': 'Lobby rounds whose deadline passed with no choices',
+    'dungeonforge_admission_total': 'Generation admission decisions by endpoint and outcome',
+    'dungeonforge_admission_wait_seconds': 'Time generations queued for an admission slot',
+    'dungeonforge_story_cache_total': 'Solo story cache lookups by outcome',
+    'dungeonforge_quickmatch_total': 'Quick-match placements into an open lobby or a new one',
+    'dungeonforge_campaigns_archived_total': 'Finished campaigns written to the archive',
+    'dungeonforge_archive_bytes_total': 'Compressed bytes appended to archive segments',
+    'dungeonforge_cassette_exchanges_total': 'Upstream exchanges recorded, replayed or missing from the cassette',
+    'dungeonforge_airia_polls_total': 'Status polls for asyncOutput Airia executions',
+    'dungeonforge_cluster_routed_total': 'Lobby requests sent on to the node that owns the lobby',
+    'dungeonforge_lobby_handoffs_total': 'Lobbies moved between nodes by direction',
+}
+
+class Metrics:
+    """In-process counters and fixed-bucket histograms, rendered in Prometheus text format"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}  # {(name, labels): value}
+        self._histograms = {}  # {(name, labels): [bucket counts..., +Inf count, sum]}
+        self._lock = threading.Lock()
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += seconds
+    
+    def render(self, gauges=()):
+        """Prometheus exposition text; gauges are (name, help, labels, value) read at scrape time"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(series)) for key, series in self._histograms.items())
+        lines = []
+        seen = set()
+        
+        def header(name, kind, help_text=None):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_text or METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), series in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {series[-1]:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        for name, help_text, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+            header(name, 'gauge', help_text)
+            lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"' for k, v in labels)
+    return '{' + ','.join(escaped) + '}'
+
+metrics = Metrics()
+
+@contextmanager
+def stage(name):
+    """Time a unit of work into the stage histogram and the current request's trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+def record_stage(name, elapsed):
+    """Record a stage timed across threads or callbacks, where stage() can't wrap it"""
+    metrics.observe('dungeonforge_stage_seconds', elapsed, stage=name)
+    if has_request_context():
+        stages = g.get('stages')
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+def record_upstream(service, start, ok):
+    """Record one upstream call that began at perf_counter() value start"""
+    metrics.observe('dungeonforge_upstream_seconds', time.perf_counter() - start,
+                    service=service, outcome='ok' if ok else 'error')
+
+# Upstream cassette: record every Airia, Stack-AI, image and ElevenLabs exchange
+# with its timing, or replay a recording offline so load tests see identical
+# upstream behavior run to run. Replay timing is scaled by UPSTREAM_REPLAY_SPEED
+# (1 = as recorded, 0.1 = ten times faster, 0 = instant).
+UPSTREAM_CASSETTE = os.getenv('UPSTREAM_CASSETTE')
+UPSTREAM_CASSETTE_MODE = os.getenv('UPSTREAM_CASSETTE_MODE', 'replay')  # record | replay
+UPSTREAM_REPLAY_SPEED = float(os.getenv('UPSTREAM_REPLAY_SPEED', 1.0))
+
+class UpstreamCassette:
+    """
+    Gzipped NDJSON of upstream exchanges: service, method, URL, request body hash,
+    status, content headers, base64 body, and seconds to first byte and to the
+    last. Replay answers a request with the next unused recording for the same
+    method, path and body; prompts carry lobby ids and usernames that differ per
+    run, so failing that it takes the next recording for the same path, then
+    for the same service and method, cycling when they run out. Requests with
+    no recording get a 503 so the app's fallbacks run. Cluster traffic between
+    nodes is never recorded.
+    """
+    CONTENT_HEADERS = ('content-type', 'content-encoding')
+    
+    def __init__(self, path, mode, speed):
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._queues = {}  # {match key: [exchange, ...]}
+        self._cursors = Counter()  # {match key: exchanges served}
+        self._file = None
+        if mode == 'replay':
+            with gzip.open(path, 'rt') as cassette:
+                for line in cassette:
+                    self._file_exchange(json.loads(line))
+        else:
+            self._file = gzip.open(path, 'at')
+            atexit.register(self._file.close)
+    
+    def service(self, method, url):
+        """Which upstream a request goes to, or None for traffic that is not recorded"""
+        netloc = urlsplit(url).netloc
+        if any(urlsplit(node).netloc == netloc for node in CLUSTER_NODES):
+            return None
+        for name, configured in (('airia', AIRIA_PIPELINE_URL), ('elevenlabs', ELEVENLABS_BASE_URL or 'https://api.elevenlabs.io')):
+            if configured and urlsplit(configured).netloc == netloc:
+                return name
+        # Stack-AI only takes POSTs; GETs anywhere else fetch generated scene images,
+        # whose host may or may not be Stack-AI's
+        return 'stackai' if method == 'POST' else 'image'
+    
+    @staticmethod
+    def _keys(service, method, url, body_sha1):
+        """Match keys from most to least specific"""
+        path = urlsplit(url).path
+        return [(service, method, path, body_sha1), (service, method, path), (service, method)]
+    
+    def _file_exchange(self, exchange):
+        for key in self._keys(exchange['service'], exchange['method'], exchange['url'], exchange['body_sha1']):
+            self._queues.setdefault(key, []).append(exchange)
+    
+    def record(self, service, method, url, body, status, headers, content, ttfb, total):
+        exchange = {
+            'service': service, 'method': method, 'url': url,
+            'body_sha1': hashlib.sha1(body or b'').hexdigest(),
+            'status': status,
+            'headers': {k: v for k, v in headers.items() if k.lower() in self.CONTENT_HEADERS},
+            'body': base64.b64encode(content).decode('ascii'),
+            'ttfb': round(ttfb, 4), 'total': round(total, 4)
+        }
+        line = json.dumps(exchange, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+        metrics.inc('dungeonforge_cassette_exchanges_total', mode='record', service=service)
+    
+    def replay(self, service, method, url, body):
+        """The recorded exchange to answer this request with, or None"""
+        with self._lock:
+            for key in self._keys(service, method, url, hashlib.sha1(body or b'').hexdigest()):
+                recorded = self._queues.get(key)
+                if recorded:
+                    exchange = recorded[self._cursors[key] % len(recorded)]
+                    self._cursors[key] += 1
+                    metrics.inc('dungeonforge_cassette_exchanges_total', mode='replay', service=service)
+                    return exchange
+        metrics.inc('dungeonforge_cassette_exchanges_total', mode='miss', service=service)
+        cassette_log.warning("No recorded %s exchange for %s %s", service, method, url)
+        return None
+    
+    def delay(self, seconds):
+        if self.speed > 0 and seconds > 0:
+            time.sleep(seconds * self.speed)
+
+upstream_cassette = UpstreamCassette(UPSTREAM_CASSETTE, UPSTREAM_CASSETTE_MODE, UPSTREAM_REPLAY_SPEED) if UPSTREAM_CASSETTE else None
+
+def request_body_bytes(body):
+    return body.encode() if isinstance(body, str) else body
+
+class CassetteAdapter(requests.adapters.HTTPAdapter):
+    """requests transport for upstream_session that records to or replays from upstream_cassette"""
+    def send(self, request, **kwargs):
+        service = upstream_cassette.service(request.method, request.url)
+        if service is None:
+            return super().send(request, **kwargs)
+        body = request_body_bytes(request.body)
+        if upstream_cassette.mode == 'replay':
+            exchange = upstream_cassette.replay(service, request.method, request.url, body)
+            response = requests.Response()
+            response.request = request
+            response.url = request.url
+            response.reason = 'Replayed'
+            if exchange is None:
+                response.status_code = 503
+                response.headers['Content-Type'] = 'application/json'
+                response._content = b'{"error": "not in cassette"}'
+            else:
+                upstream_cassette.delay(exchange['total'])
+                response.status_code = exchange['status']
+                response.headers.update(exchange['headers'])
+                response._content = base64.b64decode(exchange['body'])
+            response._content_consumed = True
+            response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+            return response
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        ttfb = time.perf_counter() - start
+        content = response.content  # requests has already undone any content-encoding
+        headers = {k: v for k, v in response.headers.items() if k.lower() != 'content-encoding'}
+        upstream_cassette.record(service, request.method, request.url, body, response.status_code, headers,
+                                 content, ttfb, time.perf_counter() - start)
+        return response
+
+def cassette_httpx_transport(httpx):
+    """httpx transport for the ElevenLabs client, built once the SDK's httpx is imported"""
+    class ReplayStream(httpx.SyncByteStream):
+        # Streamed audio arrives in pieces spread between first and last byte, as recorded
+        def __init__(self, content, ttfb, total, chunk_size=16 * 1024):
+            self.chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)] or [b'']
+            self.ttfb = ttfb
+            self.gap = max(0.0, total - ttfb) / len(self.chunks)
+        
+        def __iter__(self):
+            upstream_cassette.delay(self.ttfb)
+            for index, chunk in enumerate(self.chunks):
+                if index:
+                    upstream_cassette.delay(self.gap)
+                yield chunk
+    
+    class CassetteTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            service = upstream_cassette.service(request.method, str(request.url))
+            if service is None:
+                return super().handle_request(request)
+            body = request.read()
+            if upstream_cassette.mode == 'replay':
+                exchange = upstream_cassette.replay(service, request.method, str(request.url), body)
+                if exchange is None:
+                    return httpx.Response(503, json={'error': 'not in cassette'})
+                return httpx.Response(exchange['status'], headers=exchange['headers'],
+                                      stream=ReplayStream(base64.b64decode(exchange['body']), exchange['ttfb'], exchange['total']))
+            start = time.perf_counter()
+            response = super().handle_request(request)
+            ttfb = time.perf_counter() - start
+            content = response.read()  # still content-encoded at the transport, so the header is kept
+            upstream_cassette.record(service, request.method, str(request.url), body, response.status_code,
+                                     response.headers, content, ttfb, time.perf_counter() - start)
+            return httpx.Response(response.status_code, headers=response.headers, content=content)
+    
+    return CassetteTransport()
+
+# Shared HTTP session so Airia and Stack-AI calls reuse kept-alive connections
+upstream_session = requests.Session()
+upstream_adapter = CassetteAdapter if upstream_cassette else requests.adapters.HTTPAdapter
+upstream_session.mount('https://', upstream_adapter(pool_maxsize=16))
+upstream_session.mount('http://', upstream_adapter(pool_maxsize=16))
+
+def get_elevenlabs_client():
+    """The ElevenLabs client, importing the SDK on first call; None when no API key is set"""
+    global elevenlabs_client, elevenlabs_http
+    if elevenlabs_client is None and ELEVENLABS_API_KEY:
+        with elevenlabs_client_lock:
+            if elevenlabs_client is None:
+                import httpx
+                from elevenlabs import ElevenLabs
+                transport = cassette_httpx_transport(httpx) if upstream_cassette else None
+                elevenlabs_http = httpx.Client(timeout=240, follow_redirects=True, transport=transport)
+                elevenlabs_client = ElevenLabs(api_key=ELEVENLABS_API_KEY, base_url=ELEVENLABS_BASE_URL,
+                                               httpx_client=elevenlabs_http)
+    return elevenlabs_client
+
+def airia_output(response_data):
+    """The generated text from an Airia pipeline response"""
+    # Extract the actual text response from Airia's response structure
+    # Adjust this based on the actual response format from your agent
+    if isinstance(response_data, dict):
+        # Try common response fields
+        return response_data.get('output') or response_data.get('result') or response_data.get('response') or str(response_data)
+    return str(response_data)
+
+def airia_headers():
+    return {
+        "X-API-KEY": AIRIA_API_KEY,
+        "Content-Type": "application/json"
+    }
+
+class AiriaExecutionTracker:
+    """
+    Completion tracking for asyncOutput executions. Each pending execution is a
+    Future plus a poll deadline on one shared DeadlineScheduler; polls run on a
+    small executor, so thousands of in-flight generations cost a dict entry
+    each rather than a blocked thread and an open connection. Poll intervals
+    back off to AIRIA_POLL_MAX_INTERVAL_SECONDS; executions still running after
+    AIRIA_TIMEOUT_SECONDS resolve to None like a failed synchronous call.
+    """
+    PENDING_STATUSES = {'pending', 'queued', 'running', 'inprogress', 'in_progress', 'processing'}
+    FAILED_STATUSES = {'failed', 'error', 'cancelled', 'canceled', 'timedout'}
+    
+    def __init__(self, poll_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=poll_workers, thread_name_prefix='airia-poll')
+        self._scheduler = DeadlineScheduler(self._executor)
+        self._executions = {}  # {execution_id: (future, start, interval)}
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._executions)
+    
+    def track(self, execution_id, start):
+        """Future for execution_id's output text; start is the submit time for latency metrics"""
+        future = Future()
+        with self._lock:
+            self._executions[execution_id] = (future, start, AIRIA_POLL_INTERVAL_SECONDS)
+        self._scheduler.schedule(execution_id, AIRIA_POLL_INTERVAL_SECONDS, functools.partial(self._poll, execution_id))
+        return future
+    
+    def _finish(self, execution_id, text):
+        with self._lock:
+            future, start, _ = self._executions.pop(execution_id)
+        record_upstream('airia', start, text is not None)
+        future.set_result(text)
+    
+    def _poll(self, execution_id):
+        future, start, interval = self._executions[execution_id]
+        metrics.inc('dungeonforge_airia_polls_total')
+        try:
+            response = upstream_session.get(AIRIA_EXECUTION_URL.format(execution_id=execution_id),
+                                            headers=airia_headers(), timeout=10)
+            if response.status_code == 200:
+                data = response.json()
+                status = str(data.get('status') or data.get('executionStatus') or '').lower() if isinstance(data, dict) else ''
+                if status in self.FAILED_STATUSES:
+                    airia_log.warning("Airia execution %s ended with status %s", execution_id, status)
+                    return self._finish(execution_id, None)
+                if status not in self.PENDING_STATUSES:
+                    return self._finish(execution_id, airia_output(data))
+            elif response.status_code not in (202, 404):
+                airia_log.warning("Airia execution %s poll error %s: %s", execution_id, response.status_code, response.text)
+        except Exception as e:
+            airia_log.warning("Error polling Airia execution %s: %s", execution_id, e)
+        
+        if time.perf_counter() - start > AIRIA_TIMEOUT_SECONDS:
+            airia_log.error("Airia execution %s still running after %ss", execution_id, AIRIA_TIMEOUT_SECONDS)
+            return self._finish(execution_id, None)
+        interval = min(interval * 1.5, AIRIA_POLL_MAX_INTERVAL_SECONDS)
+        with self._lock:
+            self._executions[execution_id] = (future, start, interval)
+        self._scheduler.schedule(execution_id, interval, functools.partial(self._poll, execution_id))
+
+airia_executions = AiriaExecutionTracker()
+
+def submit_airia_agent(user_input):
+    """
+    Start an Airia generation and return a Future for its text (None on failure).
+    In asyncOutput mode the Future completes from the shared poller; otherwise
+    the call runs synchronously and the Future is already done.
+    """
+    start = time.perf_counter()
+    result = Future()
     try:
         payload = json.dumps({
             "userId": AIRIA_USER_ID,
             "request": user_input,
-            "asyncOutput": False
+            "asyncOutput": AIRIA_ASYNC_OUTPUT
         })
         
-        headers = {
-            "X-API-KEY": AIRIA_API_KEY,
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(AIRIA_PIPELINE_URL, headers=headers, data=payload, timeout=90)
-        
-        if response.status_code == 200:
+        response = upstream_session.post(AIRIA_PIPELINE_URL, headers=airia_headers(), data=payload,
+                                         timeout=10 if AIRIA_ASYNC_OUTPUT else AIRIA_TIMEOUT_SECONDS)
+        if response.status_code in (200, 202):
             response_data = response.json()
-            # Extract the actual text response from Airia's response structure
-            # Adjust this based on the actual response format from your agent
-            if isinstance(response_data, dict):
-                # Try common response fields
-                return response_data.get('output') or response_data.get('result') or response_data.get('response') or str(response_data)
-            return str(response_data)
+            execution_id = response_data.get('executionId') or response_data.get('id') if isinstance(response_data, dict) else None
+            output_ready = isinstance(response_data, dict) and any(response_data.get(k) for k in ('output', 'result', 'response'))
+            if AIRIA_ASYNC_OUTPUT and execution_id and not output_ready:
+                return airia_executions.track(execution_id, start)
+            record_upstream('airia', start, True)
+            result.set_result(airia_output(response_data))
         else:
-            print(f"Airia API error: {response.status_code} - {response.text}")
-            return None
+            record_upstream('airia', start, False)
+            airia_log.warning("Airia API error %s: %s", response.status_code, response.text)
+            result.set_result(None)
     except Exception as e:
-        print(f"Error calling Airia agent: {e}")
+        airia_log.error("Error calling Airia agent: %s", e)
+        record_upstream('airia', start, False)
+        result.set_result(None)
+    return result
+
+class CircuitBreaker:
+    """
+    Closed until `threshold` consecutive failures, then open for `cooldown`
+    seconds, during which calls are refused. After the cooldown one trial call
+    goes through (half-open): success closes the breaker, failure re-opens it.
+    """
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+    
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+    
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self._trial_in_flight and time.monotonic() - self.opened_at >= self.cooldown:
+                self._trial_in_flight = True
+                return True
+            return False
+    
+    def record(self, ok):
+        with self._lock:
+            self._trial_in_flight = False
+            if ok:
+                if self.opened_at is not None:
+                    log.info("%s circuit closed", self.name)
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    log.warning("%s circuit open after %s failures", self.name, self.failures)
+                    metrics.inc('dungeonforge_circuit_opened_total', service=self.name)
+                self.opened_at = time.monotonic()
+
+airia_breaker = CircuitBreaker('airia', AIRIA_BREAKER_FAILURES, AIRIA_BREAKER_COOLDOWN_SECONDS)
+
+def start_airia_agent(user_input):
+    """Future for the Airia agent's response; None when it fails or is bypassed"""
+    if STORY_ENGINE == 'procedural' or not airia_breaker.allow():
+        metrics.inc('dungeonforge_airia_skipped_total', reason='procedural' if STORY_ENGINE == 'procedural' else 'circuit_open')
+        skipped = Future()
+        skipped.set_result(None)
+        return skipped
+    generation = submit_airia_agent(user_input)
+    generation.add_done_callback(lambda done: airia_breaker.record(done.result() is not None))
+    return generation
+
+def call_airia_agent(user_input):
+    """Call Airia agent and return the response; None when it fails or is bypassed"""
+    with stage('airia_call'):
+        return start_airia_agent(user_input).result()
+
+def render_scene_image(summary_text, user_id):
+    """Start the full scene render in the background; returns a Future of its URL (None on failure)"""
+    def render():
+        try:
+            return proxy_scene_image(generate_scene_image(summary_text, user_id))
+        except Exception as e:
+            stackai_log.error("Background image generation failed: %s", e)
+            return None
+    return scene_render_executor.submit(render)
+
+# Placeholder palettes (sky, horizon, ground), picked by the summary words they match best
+SCENE_PREVIEW_PALETTES = (
+    (('fire', 'flame', 'forge', 'lava', 'ember', 'burn', 'dragon', 'blood'), ('#2b0f0e', '#b5401f', '#f2a65a')),
+    (('forest', 'grove', 'garden', 'marsh', 'swamp', 'thorn', 'druid', 'orchard'), ('#0f2418', '#2f6b3a', '#9fc07a')),
+    (('sea', 'cove', 'river', 'lake', 'drown', 'sunken', 'rain', 'water', 'ship'), ('#0b1d33', '#1f5f8b', '#7fb7d8')),
+    (('ice', 'frozen', 'snow', 'frost', 'winter'), ('#1b2838', '#6f8fb0', '#dfe9f3')),
+    (('crypt', 'tomb', 'wraith', 'bone', 'shadow', 'dark', 'cult', 'night', 'moon', 'ghost'), ('#120f1f', '#3b2d5c', '#8a76b8')),
+    (('desert', 'sand', 'sun', 'bazaar', 'gold', 'dawn'), ('#3a2410', '#c98a3a', '#f4d58d')),
+)
+SCENE_PREVIEW_DEFAULT_PALETTE = ('#1e1510', '#6b4423', '#d9a86c')  # tavern firelight
+
+def scene_preview(summary_text):
+    """
+    Placeholder for a scene until its render lands: a 16:9 SVG sky and ridge line
+    colored by the summary's mood, as a data URI (a few hundred bytes, no request).
+    """
+    if not summary_text:
         return None
+    text = summary_text.lower()
+    best = max(SCENE_PREVIEW_PALETTES, key=lambda entry: sum(word in text for word in entry[0]))
+    sky, horizon, ground = best[1] if any(word in text for word in best[0]) else SCENE_PREVIEW_DEFAULT_PALETTE
+    # The ridge line is seeded by the summary, so each scene gets its own silhouette
+    rng = random.Random(hashlib.sha1(summary_text.encode()).digest())
+    ridge = ' '.join(f"{x},{rng.randint(48, 70)}" for x in range(0, 161, 20))
+    svg = (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 160 90" preserveAspectRatio="none">'
+           f'<defs><linearGradient id="s" x1="0" y1="0" x2="0" y2="1"><stop offset="0" stop-color="{sky}"/>'
+           f'<stop offset="1" stop-color="{horizon}"/></linearGradient></defs>'
+           f'<rect width="160" height="90" fill="url(#s)"/>'
+           f'<circle cx="{rng.randint(20, 140)}" cy="{rng.randint(14, 30)}" r="7" fill="{ground}" opacity="0.6"/>'
+           f'<polygon points="0,90 {ridge} 160,90" fill="{ground}" opacity="0.35"/></svg>')
+    return 'data:image/svg+xml;base64,' + base64.b64encode(svg.encode()).decode()
 
-def generate_scene_image_async(summary_text, user_id, result_dict, key):
-    """Generate scene image in background thread"""
-    try:
-        image_url = generate_scene_image(summary_text, user_id)
-        result_dict[key] = image_url
-    except Exception as e:
-        print(f"[Stack-AI] Background image generation failed: {e}")
-        result_dict[key] = None
+def attach_scene_render(lobby, index, render, then=None):
+    """
+    Patch a lobby message's scene_image once its render lands, publishing only the
+    image to pollers that ask for patches. then() runs afterwards either way.
+    The lobby is not handed off to another node until both are done.
+    """
+    def landed(future):
+        try:
+            image_url = future.result()
+            if image_url and lobbies.get(lobby.id) is lobby:
+                lobby_broadcaster.publish_scene_image(lobby, index, image_url)
+            if then is not None:
+                then()
+        finally:
+            lobby.background.discard(future)
+    if render is None:
+        if then is not None:
+            then()
+        return
+    lobby.background.add(render)
+    render.add_done_callback(landed)
 
 def generate_scene_image(summary_text, user_id="default"):
     """Call Stack-AI image generation API with the scene summary"""
+    start = time.perf_counter()
     try:
         if not STACK_AI_API_URL or not STACK_AI_API_KEY:
-            print(f"[Stack-AI] API URL or KEY not configured")
+            stackai_log.warning("API URL or KEY not configured")
             return None
             
         headers = {
@@ -125,13 +1073,15 @@ def generate_scene_image(summary_text, user_id="default"):
             "in-0": summary_text
         }
         
-        print(f"[Stack-AI] Generating image for summary: {summary_text[:100]}...")
+        stackai_log.info("Generating image for summary: %s", summary_text[:100])
         
-        response = requests.post(STACK_AI_API_URL, headers=headers, json=payload, timeout=90)
+        with stage('image_generation'):
+            response = upstream_session.post(STACK_AI_API_URL, headers=headers, json=payload, timeout=90)
+        record_upstream('stackai', start, response.status_code == 200)
         
         if response.status_code == 200:
             response_data = response.json()
-            print(f"[Stack-AI] Raw response: {response_data}")
+            log_payload(stackai_log, "Raw response", response_data)
             
             # The Stack-AI API returns: {"outputs": {"out-0": "{'image_url': '...'}"}, ...}
             # We need to extract the image URL from this structure
@@ -143,7 +1093,7 @@ def generate_scene_image(summary_text, user_id="default"):
                     # outputs can be either a dict or a list
                     if isinstance(outputs, dict) and 'out-0' in outputs:
                         out_value = outputs['out-0']
-                        print(f"[Stack-AI] Found out-0: {out_value}")
+                        stackai_log.debug("Found out-0: %s", out_value)
                         
                         # The value might be a string representation of a dict
                         if isinstance(out_value, str):
@@ -153,10 +1103,10 @@ def generate_scene_image(summary_text, user_id="default"):
                                 parsed = ast.literal_eval(out_value)
                                 if isinstance(parsed, dict) and 'image_url' in parsed:
                                     image_url = parsed['image_url']
-                                    print(f"[Stack-AI] Extracted image URL: {image_url}")
+                                    stackai_log.debug("Extracted image URL: %s", image_url)
                                     return image_url
                             except (ValueError, SyntaxError) as e:
-                                print(f"[Stack-AI] Could not parse out-0 as dict: {e}")
+                                stackai_log.debug("Could not parse out-0 as dict: %s", e)
                                 # Maybe it's already a URL
                                 if out_value.startswith('http'):
                                     return out_value
@@ -171,10 +1121,10 @@ def generate_scene_image(summary_text, user_id="default"):
                         if isinstance(output, dict):
                             image_url = output.get('image_url') or output.get('url') or output.get('output') or output.get('value')
                             if image_url:
-                                print(f"[Stack-AI] Found image URL in outputs list: {image_url}")
+                                stackai_log.debug("Found image URL in outputs list: %s", image_url)
                                 return image_url
                         elif isinstance(output, str):
-                            print(f"[Stack-AI] Found image URL as string in outputs list: {output}")
+                            stackai_log.debug("Found image URL as string in outputs list: %s", output)
                             return output
                 
                 # Try common direct fields
@@ -185,30 +1135,167 @@ def generate_scene_image(summary_text, user_id="default"):
                            response_data.get('image'))
                 
                 if image_url:
-                    print(f"[Stack-AI] Found image URL in direct fields: {image_url}")
+                    stackai_log.debug("Found image URL in direct fields: %s", image_url)
                     return image_url
                 
-                print(f"[Stack-AI] Could not extract image URL from response")
+                stackai_log.warning("Could not extract image URL from response")
                 return None
             
             # If response is already a string (possibly a URL)
             if isinstance(response_data, str):
-                print(f"[Stack-AI] Response is string: {response_data}")
+                stackai_log.debug("Response is string: %s", response_data)
                 if response_data.startswith('http'):
                     return response_data
             
             return None
         else:
-            print(f"[Stack-AI] API error: {response.status_code} - {response.text}")
+            stackai_log.warning("API error %s: %s", response.status_code, response.text)
             return None
     except Exception as e:
-        print(f"[Stack-AI] Error calling image generation: {e}")
-        import traceback
-        traceback.print_exc()
+        stackai_log.exception("Error calling image generation: %s", e)
+        record_upstream('stackai', start, False)
         return None
 
+def build_round_options(user_ids, model_options, fallback_options):
+    """
+    Build the option list for a lobby round and each player's share of it.
+    Returns (options, player_options) where player_options maps user_id to
+    indexes into options, so the strings are stored and sent only once.
+    """
+    options = []
+    for opt in model_options or []:
+        opt = opt.strip()
+        if opt and opt not in options:
+            options.append(opt)
+    if not options:
+        options = list(fallback_options)
+    
+    # Model options are shared by everyone; the larger fallback pool is dealt
+    # out in consecutive slices so each player sees a different set.
+    per_player = min(OPTIONS_PER_PLAYER, len(options))
+    player_options = {}
+    for i, uid in enumerate(user_ids):
+        start = (i * per_player) % len(options)
+        player_options[uid] = [(start + k) % len(options) for k in range(per_player)]
+    return options, player_options
+
+def load_image_store():
+    """Index images already on disk so the store survives restarts"""
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    entries = []
+    for entry in os.scandir(IMAGE_CACHE_DIR):
+        if not entry.is_file():
+            continue
+        if entry.name.endswith('.tmp'):
+            os.remove(entry.path)
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, entry.name, stat.st_size))
+    with image_store_lock:
+        for _, name, size in sorted(entries):
+            image_store[name] = size
+            image_store_state['total_bytes'] += size
+    evict_images()
+
+def evict_images():
+    """Delete least-recently-used images until the store fits IMAGE_CACHE_MAX_BYTES"""
+    with image_store_lock:
+        while image_store and image_store_state['total_bytes'] > IMAGE_CACHE_MAX_BYTES:
+            name, size = image_store.popitem(last=False)
+            image_store_state['total_bytes'] -= size
+            try:
+                os.remove(os.path.join(IMAGE_CACHE_DIR, name))
+            except OSError:
+                pass
+
+def store_image_file(name, data):
+    """Write an image into the store atomically and account for its size"""
+    path = os.path.join(IMAGE_CACHE_DIR, name)
+    tmp_path = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    with image_store_lock:
+        image_store_state['total_bytes'] -= image_store.pop(name, 0)
+        image_store[name] = len(data)
+        image_store_state['total_bytes'] += len(data)
+    evict_images()
+
+def touch_image(name):
+    """Mark an image as recently used; False if it is not in the store"""
+    with image_store_lock:
+        if name not in image_store:
+            return False
+        image_store.move_to_end(name)
+        return True
+
+def proxy_scene_image(image_url):
+    """
+    Fetch a generated scene image into the local store and return its /images path.
+    Falls back to the remote URL if the image cannot be fetched.
+    """
+    if not image_url or not image_url.startswith('http'):
+        return image_url
+    
+    local_url = image_cache.get(image_url)
+    if local_url and touch_image(local_url.rsplit('/', 1)[-1]):
+        return local_url
+    
+    try:
+        with stage('image_fetch'):
+            response = upstream_session.get(image_url, timeout=30, stream=True)
+            data = bytearray()
+            if response.status_code == 200:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    data.extend(chunk)
+                    if len(data) > IMAGE_FETCH_MAX_BYTES:
+                        break
+        if response.status_code != 200:
+            images_log.warning("Fetch failed: %s for %s", response.status_code, image_url[:100])
+            return image_url
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        ext = IMAGE_CONTENT_TYPES.get(content_type)
+        if not ext:
+            images_log.warning("Unsupported content type %r, serving remote URL", content_type)
+            return image_url
+        if len(data) > IMAGE_FETCH_MAX_BYTES:
+            images_log.warning("Image over %s bytes, serving remote URL", IMAGE_FETCH_MAX_BYTES)
+            return image_url
+    except Exception as e:
+        images_log.error("Error fetching scene image: %s", e)
+        return image_url
+    
+    name = f"{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+    if not touch_image(name):
+        store_image_file(name, bytes(data))
+    local_url = f'/images/{name}'
+    image_cache.put(image_url, local_url)
+    return local_url
+
+def image_variant(name, width):
+    """Return the stored name of a downscaled JPEG variant, creating it on first use"""
+    variant = f"{name.rsplit('.', 1)[0]}_w{width}.jpg"
+    if touch_image(variant):
+        return variant
+    try:
+        from PIL import Image
+    except ImportError:
+        # Pillow is optional; without it every width gets the original
+        return name
+    with Image.open(os.path.join(IMAGE_CACHE_DIR, name)) as img:
+        if img.width <= width:
+            return name
+        height = max(1, round(img.height * width / img.width))
+        thumbnail = img.convert('RGB').resize((width, height), Image.LANCZOS)
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, 'JPEG', quality=82, optimize=True)
+    store_image_file(variant, buffer.getvalue())
+    return variant
+
+load_image_store()
+
 class Lobby:
-    def __init__(self, lobby_id, host_user_id, host_username):
+    def __init__(self, lobby_id, host_user_id, host_username, max_users=LOBBY_DEFAULT_PLAYERS):
         self.id = lobby_id
         self.host_user_id = host_user_id
         self.host_username = host_username
@@ -220,13 +1307,21 @@ class Lobby:
                 'choice': None
             }
         }
-        self.max_users = 3
+        self.max_users = max_users
+        self.spectators = {}  # {spectator_id: {'username', 'joined_at'}}
+        self.vote_counts = Counter()  # {choice: players who picked it this round}
+        self.choices_made = 0
+        self.version = 0  # bumped by lobby_broadcaster.publish on every change
         self.story_messages = []
         self.events_remaining = 10
         self.story_complete = False
         self.current_round = 0
         self.created_at = datetime.now()
         self.status = 'waiting'  # waiting, playing, completed
+        self.round_deadline = None  # epoch seconds when the open round auto-resolves
+        self.round_lock = threading.Lock()  # one round resolution at a time
+        self.background = set()  # round generations, scene renders and archive writes still to land on this copy
+        self.generation = None  # Future of the round being generated, if any
         
     def add_user(self, user_id, username):
         if len(self.users) >= self.max_users:
@@ -240,14 +1335,25 @@ class Lobby:
             'ready': False,
             'choice': None
         }
+        open_lobbies.update(self)
         return True, "User added successfully"
     
+    def add_spectator(self, spectator_id, username):
+        if len(self.spectators) >= LOBBY_MAX_SPECTATORS:
+            return False, "Lobby has no room for more spectators"
+        self.spectators[spectator_id] = {'username': username, 'joined_at': datetime.now()}
+        return True, "Spectator added successfully"
+    
     def remove_user(self, user_id):
+        if self.spectators.pop(user_id, None) is not None:
+            return True
         if user_id in self.users:
+            self.clear_user_choice(user_id)
             del self.users[user_id]
             # If host left, assign new host
             if user_id == self.host_user_id and self.users:
                 self.host_user_id = next(iter(self.users.keys()))
+            open_lobbies.update(self)
             return True
         return False
     
@@ -259,19 +1365,34 @@ class Lobby:
     
     def set_user_choice(self, user_id, choice):
         if user_id in self.users:
+            # Keep the vote tally current instead of recounting every player
+            self.clear_user_choice(user_id)
             self.users[user_id]['choice'] = choice
+            self.vote_counts[choice] += 1
+            self.choices_made += 1
             return True
         return False
     
+    def clear_user_choice(self, user_id):
+        previous = self.users[user_id]['choice']
+        if previous is not None:
+            self.users[user_id]['choice'] = None
+            self.vote_counts[previous] -= 1
+            if not self.vote_counts[previous]:
+                del self.vote_counts[previous]
+            self.choices_made -= 1
+    
     def all_users_ready(self):
         return len(self.users) >= 2 and all(user['ready'] for user in self.users.values())
     
     def all_users_chosen(self):
-        return all(user['choice'] is not None for user in self.users.values())
+        return self.choices_made >= len(self.users)
     
     def reset_choices(self):
         for user in self.users.values():
             user['choice'] = None
+        self.vote_counts.clear()
+        self.choices_made = 0
     
     def to_dict(self):
         # Serialize users so datetime fields are JSON-safe
@@ -289,44 +1410,1044 @@ class Lobby:
             'host_username': self.host_username,
             'users': users_serialized,
             'max_users': self.max_users,
+            'spectator_count': len(self.spectators),
+            'votes': dict(self.vote_counts),
+            'choices_submitted': self.choices_made,
+            'version': self.version,
             'story_messages': self.story_messages,
             'events_remaining': self.events_remaining,
             'story_complete': self.story_complete,
+            'round_generating': self.generation is not None,
             'current_round': self.current_round,
             'created_at': self.created_at.isoformat(),
-            'status': self.status
+            'status': self.status,
+            'round_deadline': self.round_deadline
         }
+    
+    def to_state(self):
+        """Everything needed to rebuild this lobby on another node"""
+        state = self.to_dict()
+        state['spectators'] = {sid: {'username': spectator['username'], 'joined_at': spectator['joined_at'].isoformat()}
+                               for sid, spectator in self.spectators.items()}
+        return state
+    
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a lobby handed off by another node (round deadline not yet scheduled)"""
+        lobby = cls(state['id'], state['host_user_id'], state['host_username'], state['max_users'])
+        lobby.users = {}
+        for uid, user in state['users'].items():
+            lobby.users[uid] = {'username': user['username'], 'joined_at': datetime.fromisoformat(user['joined_at']),
+                                'ready': user['ready'], 'choice': None}
+            if user['choice'] is not None:
+                lobby.set_user_choice(uid, user['choice'])
+        lobby.spectators = {sid: {'username': spectator['username'], 'joined_at': datetime.fromisoformat(spectator['joined_at'])}
+                            for sid, spectator in state['spectators'].items()}
+        lobby.story_messages = state['story_messages']
+        lobby.events_remaining = state['events_remaining']
+        lobby.story_complete = state['story_complete']
+        lobby.current_round = state['current_round']
+        lobby.created_at = datetime.fromisoformat(state['created_at'])
+        lobby.status = state['status']
+        lobby.round_deadline = state['round_deadline']
+        lobby.version = state['version']
+        return lobby
+
+class OpenLobbyIndex:
+    """
+    Joinable lobbies (waiting, with players and a free seat), kept current as
+    players come and go rather than found by scanning every lobby. Lobbies are
+    bucketed by free seats, so the fullest one is found by checking at most
+    LOBBY_MAX_PLAYERS buckets. Each lobby also gets a sequence number when it
+    opens; listings page through those in order with the last one seen as the
+    cursor. Retired sequence numbers are dropped from the order in batches.
+    """
+    def __init__(self):
+        self._buckets = {}  # {free seats: OrderedDict {lobby_id: None}}, oldest first
+        self._entries = {}  # {lobby_id: (free seats, sequence)}
+        self._order = []  # ascending sequence numbers, including retired ones
+        self._by_sequence = {}  # {sequence: lobby_id} for open lobbies
+        self._sequence = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def update(self, lobby):
+        """Re-file lobby after a change to its players or status"""
+        free = lobby.max_users - len(lobby.users)
+        joinable = lobby.status == 'waiting' and lobby.users and free > 0
+        with self._lock:
+            entry = self._entries.get(lobby.id)
+            if entry is not None and (not joinable or entry[0] != free):
+                self._unfile(lobby.id, entry[0])
+            if not joinable:
+                if entry is not None:
+                    self._retire(lobby.id, entry[1])
+                return
+            if entry is None:
+                self._sequence += 1
+                entry = (free, self._sequence)
+                self._order.append(self._sequence)
+                self._by_sequence[self._sequence] = lobby.id
+            elif entry[0] == free:
+                return
+            self._entries[lobby.id] = (free, entry[1])
+            self._buckets.setdefault(free, OrderedDict())[lobby.id] = None
+    
+    def discard(self, lobby_id):
+        with self._lock:
+            entry = self._entries.get(lobby_id)
+            if entry is not None:
+                self._unfile(lobby_id, entry[0])
+                self._retire(lobby_id, entry[1])
+    
+    def _unfile(self, lobby_id, free):
+        bucket = self._buckets[free]
+        del bucket[lobby_id]
+        if not bucket:
+            del self._buckets[free]
+    
+    def _retire(self, lobby_id, sequence):
+        del self._entries[lobby_id]
+        del self._by_sequence[sequence]
+        if len(self._order) > 1024 and len(self._by_sequence) < len(self._order) // 2:
+            self._order = [s for s in self._order if s in self._by_sequence]
+    
+    def fullest(self):
+        """The open lobby with the fewest free seats (longest waiting first), or None"""
+        with self._lock:
+            if not self._buckets:
+                return None
+            return next(iter(self._buckets[min(self._buckets)]))
+    
+    def page(self, cursor, limit):
+        """(up to limit lobby ids opened after cursor, next cursor or None)"""
+        ids = []
+        with self._lock:
+            index = bisect.bisect_right(self._order, cursor)
+            while index < len(self._order) and len(ids) < limit:
+                lobby_id = self._by_sequence.get(self._order[index])
+                if lobby_id is not None:
+                    ids.append(lobby_id)
+                    cursor = self._order[index]
+                index += 1
+        # A full page may be the last one; the next request then comes back empty
+        return ids, cursor if len(ids) == limit else None
+
+open_lobbies = OpenLobbyIndex()
+quickmatch_lock = threading.Lock()  # one quick-match placement at a time
+
+def forget_lobby(lobby):
+    """Drop a lobby from this node: state, sessions, open index, deadline and broadcast channel"""
+    lobbies.pop(lobby.id, None)
+    open_lobbies.discard(lobby.id)
+    for uid in list(lobby.users) + list(lobby.spectators):
+        user_sessions.pop(uid, None)
+    round_deadlines.cancel(lobby.id)
+    lobby_broadcaster.close(lobby.id)
+
+class CampaignArchive:
+    """
+    Append-only store of finished campaigns. Each campaign is one gzip member of
+    NDJSON (a header line, then a line per story message) appended to the current
+    segment; segments roll over at segment_max_bytes. A sidecar .idx per segment
+    lists (lobby id, offset, length), so the index is rebuilt at startup without
+    decompressing anything. Appends take a write lock (most come from
+    archive_executor); readers open their own handle and decompress as they go.
+    """
+    SEGMENT_RE = re.compile(r'campaigns-(\d{6})\.ndjson\.gz')
+    
+    def __init__(self, directory, segment_max_bytes):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._index = {}  # {lobby_id: (segment file, offset, length)}
+        self._segment_number = 1
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            match = self.SEGMENT_RE.fullmatch(name)
+            if not match:
+                continue
+            self._segment_number = int(match.group(1))
+            index_path = os.path.join(directory, name[:-len('.ndjson.gz')] + '.idx')
+            if os.path.exists(index_path):
+                with open(index_path) as index_file:
+                    for line in index_file:
+                        entry = json.loads(line)
+                        self._index[entry['id']] = (name, entry['offset'], entry['length'])
+    
+    def __contains__(self, lobby_id):
+        return lobby_id in self._index
+    
+    def __len__(self):
+        return len(self._index)
+    
+    def _segment_name(self):
+        return f'campaigns-{self._segment_number:06d}.ndjson.gz'
+    
+    def ids(self):
+        with self._lock:
+            return list(self._index)
+    
+    def append(self, lobby_id, lines):
+        """Compress and append one campaign; lines are NDJSON byte strings"""
+        self.append_member(lobby_id, gzip.compress(b''.join(lines), compresslevel=6))
+    
+    def append_member(self, lobby_id, data):
+        """Append one campaign already compressed as a gzip member"""
+        with self._write_lock:
+            path = os.path.join(self.directory, self._segment_name())
+            offset = os.path.getsize(path) if os.path.exists(path) else 0
+            if offset and offset + len(data) > self.segment_max_bytes:
+                self._segment_number += 1
+                path = os.path.join(self.directory, self._segment_name())
+                offset = 0
+            with open(path, 'ab') as segment:
+                segment.write(data)
+            with open(path[:-len('.ndjson.gz')] + '.idx', 'a') as index_file:
+                index_file.write(json.dumps({'id': lobby_id, 'offset': offset, 'length': len(data)}) + '\n')
+            with self._lock:
+                self._index[lobby_id] = (os.path.basename(path), offset, len(data))
+            metrics.inc('dungeonforge_archive_bytes_total', len(data))
+    
+    def member(self, lobby_id):
+        """A campaign's compressed gzip member, as stored"""
+        name, offset, length = self._index[lobby_id]
+        with open(os.path.join(self.directory, name), 'rb') as segment:
+            segment.seek(offset)
+            return segment.read(length)
+    
+    def stream(self, lobby_id, chunk_size=64 * 1024):
+        """Yield the campaign's NDJSON, reading and decompressing chunk_size bytes at a time"""
+        name, offset, remaining = self._index[lobby_id]
+        decompressor = zlib.decompressobj(wbits=31)  # gzip framing
+        with open(os.path.join(self.directory, name), 'rb') as segment:
+            segment.seek(offset)
+            while remaining > 0:
+                chunk = segment.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+campaign_archive = CampaignArchive(ARCHIVE_DIR, ARCHIVE_SEGMENT_MAX_BYTES)
+archive_evictions = DeadlineScheduler(archive_executor)
+
+def campaign_lines(lobby):
+    """A lobby's transcript as NDJSON lines: a header, then each story message"""
+    header = {
+        'type': 'campaign',
+        'id': lobby.id,
+        'host_username': lobby.host_username,
+        'players': {uid: user['username'] for uid, user in lobby.users.items()},
+        'max_users': lobby.max_users,
+        'created_at': lobby.created_at.isoformat(),
+        'events': len(lobby.story_messages),
+        'story_complete': lobby.story_complete
+    }
+    yield json.dumps(header, ensure_ascii=False).encode() + b'\n'
+    for message in list(lobby.story_messages):
+        yield json.dumps(dict(message, type='message'), ensure_ascii=False).encode() + b'\n'
+
+def archive_campaign(lobby):
+    """Write a finished campaign to the archive now and evict it from memory after the grace period"""
+    lines = list(campaign_lines(lobby))
+    
+    def write():
+        try:
+            campaign_archive.append(lobby.id, lines)
+        except OSError:
+            log.exception("Archiving campaign %s failed; keeping it in memory", lobby.id)
+            return
+        metrics.inc('dungeonforge_campaigns_archived_total')
+        archive_evictions.schedule(lobby.id, ARCHIVE_EVICT_AFTER_SECONDS, lambda: evict_campaign(lobby))
+    written = archive_executor.submit(write)
+    lobby.background.add(written)
+    written.add_done_callback(lobby.background.discard)
+
+def evict_campaign(lobby):
+    # A lobby handed to another node or already cleaned up is no longer ours to drop
+    if lobbies.get(lobby.id) is lobby:
+        forget_lobby(lobby)
+        log.info("Evicted archived campaign", extra={'fields': {'lobby_id': lobby.id, 'messages': len(lobby.story_messages)}})
 
 def pretty_json(data_obj, status=200):
     """Return pretty-printed JSON with stable key ordering."""
-    import json
-    body = json.dumps(data_obj, indent=2, sort_keys=True, ensure_ascii=False)
+    with stage('serialization'):
+        body = json.dumps(data_obj, indent=2, sort_keys=True, ensure_ascii=False)
     return Response(body + "\n", status=status, mimetype='application/json')
 
+class LobbyBroadcaster:
+    """
+    Encodes each lobby change once and serves the same bytes to every poller
+    and long-poll subscriber, so reads cost no serialization however many
+    players and spectators are watching. Each lobby gets its own condition
+    (sharing one lock), so a publish only wakes that lobby's subscribers.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channels = {}  # {lobby_id: {'condition', 'version', 'body', 'subscribers'}}
+        self.encodes = 0
+    
+    def _channel(self, lobby_id):
+        channel = self._channels.get(lobby_id)
+        if channel is None:
+            channel = {'condition': threading.Condition(self._lock), 'version': 0, 'body': None, 'subscribers': 0,
+                       'full_version': 0, 'scene_images': []}
+            self._channels[lobby_id] = channel
+        return channel
+    
+    def publish(self, lobby):
+        """Record a change to lobby: bump its version, encode it once and wake its subscribers"""
+        with self._lock:
+            lobby.version += 1
+            version = lobby.version
+        with stage('serialization'):
+            body = (json.dumps({'success': True, 'lobby': lobby.to_dict()}, indent=2, sort_keys=True,
+                               ensure_ascii=False) + "\n").encode()
+        self._store(lobby.id, version, body)
+    
+    def publish_scene_image(self, lobby, index, image_url):
+        """Set story message index's full scene image; readers asking for patches get just this change"""
+        with self._lock:
+            lobby.story_messages[index]['scene_image'] = image_url
+            lobby.version += 1
+            version = lobby.version
+        with stage('serialization'):
+            body = (json.dumps({'success': True, 'lobby': lobby.to_dict()}, indent=2, sort_keys=True,
+                               ensure_ascii=False) + "\n").encode()
+        self._store(lobby.id, version, body, (index, image_url))
+    
+    def _store(self, lobby_id, version, body, scene_image=None):
+        with self._lock:
+            self.encodes += 1
+            channel = self._channel(lobby_id)
+            # A slower encode of an older version must not replace a newer one
+            if version > channel['version']:
+                channel['version'] = version
+                channel['body'] = body
+                if scene_image is None:
+                    channel['full_version'] = version
+                    channel['scene_images'] = []
+                else:
+                    channel['scene_images'].append((version,) + scene_image)
+                channel['condition'].notify_all()
+    
+    def snapshot(self, lobby, since=None, wait=0, patches=False):
+        """
+        (version, body) for lobby. With since, wait up to wait seconds for a
+        version newer than since; the current one is returned on timeout.
+        With patches, a reader whose only missed changes are scene images gets
+        {"version", "scene_images": {message index: url}} instead of the lobby.
+        Returns (None, None) if the lobby is closed meanwhile.
+        """
+        with self._lock:
+            needs_encode = self._channel(lobby.id)['body'] is None
+        if needs_encode:
+            self.publish(lobby)
+        with self._lock:
+            channel = self._channels.get(lobby.id)
+            if channel is not None and since is not None and wait > 0 and channel['version'] <= since:
+                channel['subscribers'] += 1
+                try:
+                    channel['condition'].wait_for(
+                        lambda: channel['version'] > since or lobby.id not in self._channels, wait)
+                finally:
+                    channel['subscribers'] -= 1
+            if lobby.id not in self._channels:
+                return None, None
+            if not (patches and since is not None and channel['version'] > since >= channel['full_version']):
+                return channel['version'], channel['body']
+            version = channel['version']
+            scene_images = {index: image_url for changed, index, image_url in channel['scene_images'] if changed > since}
+        return version, (json.dumps({'success': True, 'version': version, 'scene_images': scene_images},
+                                    sort_keys=True, ensure_ascii=False) + "\n").encode()
+    
+    def close(self, lobby_id):
+        """Forget a deleted lobby and release anyone waiting on it"""
+        with self._lock:
+            channel = self._channels.pop(lobby_id, None)
+            if channel is not None:
+                channel['condition'].notify_all()
+    
+    def subscriber_count(self):
+        with self._lock:
+            return sum(channel['subscribers'] for channel in self._channels.values())
+
+lobby_broadcaster = LobbyBroadcaster()
+
+def idempotent(view):
+    """
+    Let clients retry a generating POST safely. Requests with an Idempotency-Key
+    header run once per (path, key); repeats within IDEMPOTENCY_TTL_SECONDS wait
+    for and replay that response. Only successes are kept: a retry after an
+    error (4xx or 5xx) runs again, since a rejection such as "not everyone is
+    ready" or a 429 may no longer hold.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return pretty_json({'error': 'Idempotency-Key must be at most 255 characters'}, 400)
+        
+        record_key = (request.path, key)
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        now = time.monotonic()
+        with idempotency_lock:
+            while idempotency_records:
+                oldest = next(iter(idempotency_records.values()))
+                if now - oldest.created < IDEMPOTENCY_TTL_SECONDS and len(idempotency_records) < IDEMPOTENCY_MAX_KEYS:
+                    break
+                idempotency_records.popitem(last=False)
+            record = idempotency_records.get(record_key)
+            is_original = record is None
+            if is_original:
+                record = IdempotencyRecord(fingerprint, Future(), now)
+                idempotency_records[record_key] = record
+        
+        if record.fingerprint != fingerprint:
+            return pretty_json({'error': 'Idempotency-Key was already used with a different request body'}, 422)
+        
+        if not is_original:
+            metrics.inc('dungeonforge_idempotent_replays_total', endpoint=request.url_rule.rule)
+            try:
+                with stage('idempotency_wait'):
+                    status, body, headers = record.future.result(timeout=IDEMPOTENCY_WAIT_SECONDS)
+            except FutureTimeoutError:
+                return pretty_json({'error': 'The original request is still in progress'}, 409)
+            response = Response(body, status=status, headers=headers)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception as e:
+            with idempotency_lock:
+                idempotency_records.pop(record_key, None)
+            record.future.set_exception(e)
+            raise
+        record.future.set_result((response.status_code, response.get_data(), list(response.headers)))
+        if response.status_code >= 400:
+            with idempotency_lock:
+                idempotency_records.pop(record_key, None)
+        return response
+    return wrapper
+
+class InFlightRequest:
+    """A request being served, for labelling profiler samples and capturing slow-request stacks"""
+    def __init__(self, thread_id, label, stages):
+        self.thread_id = thread_id
+        self.label = label
+        self.stages = stages
+        self.stacks = []
+
+in_flight_requests = {}  # {thread id: InFlightRequest}
+slow_requests = deque(maxlen=SLOW_REQUEST_MAX_ENTRIES)  # newest last
+slow_requests_lock = threading.Lock()
+slow_request_timers = DeadlineScheduler(ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-requests'))
+_frame_labels = {}  # {code object: "module.qualname"}
+
+def collapse_stack(frame, root):
+    """A frame's stack in collapsed (folded) form: root;outermost;...;innermost"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        name = _frame_labels.get(code)
+        if name is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            name = _frame_labels[code] = f"{module}.{getattr(code, 'co_qualname', code.co_name)}".replace(';', ':')
+        names.append(name)
+        frame = frame.f_back
+    names.append(root.replace(';', ':'))
+    return ';'.join(reversed(names))
+
+def thread_label(thread_id, thread_names):
+    """Root frame for a thread's samples: the route it is serving, else its pool name"""
+    in_flight = in_flight_requests.get(thread_id)
+    if in_flight is not None:
+        return in_flight.label
+    return re.sub(r'\d+', 'N', thread_names.get(thread_id, 'unknown'))
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval; one profile runs at a time"""
+    def __init__(self):
+        self._lock = threading.Lock()
+    
+    def run(self, seconds, interval):
+        """Counter of collapsed stacks and the number of sampling passes, or None if busy"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            counts = Counter()
+            passes = 0
+            me = threading.get_ident()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != me:
+                        counts[collapse_stack(frame, thread_label(thread_id, thread_names))] += 1
+                passes += 1
+                time.sleep(interval)
+            return counts, passes
+        finally:
+            self._lock.release()
+
+profiler = SamplingProfiler()
+
+def capture_slow_stack(in_flight):
+    """Snapshot a still-running slow request's stack, then check again one threshold later"""
+    frame = sys._current_frames().get(in_flight.thread_id)
+    if frame is None or in_flight_requests.get(in_flight.thread_id) is not in_flight:
+        return
+    in_flight.stacks.append(collapse_stack(frame, in_flight.label))
+    if len(in_flight.stacks) < SLOW_REQUEST_MAX_STACKS:
+        slow_request_timers.schedule(in_flight, SLOW_REQUEST_THRESHOLD_SECONDS, lambda: capture_slow_stack(in_flight))
+
+def watches_slow_requests():
+    # Long polls are slow by design, and admin calls profile for as long as asked
+    return SLOW_REQUEST_THRESHOLD_SECONDS > 0 and 'wait' not in request.args and not request.path.startswith('/admin/')
+
+class TokenBucketStore:
+    """
+    Token buckets by key, refilled lazily when touched, so a charge is O(1) per
+    bucket. Past max_keys the longest-untouched buckets are dropped; an idle
+    bucket has refilled anyway.
+    """
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # {key: (tokens, monotonic time of last update)}
+        self._lock = threading.Lock()
+    
+    def take(self, charges):
+        """
+        charges is [(key, cost, capacity, tokens per second)]. Spend every cost, or
+        none if any bucket is short. Returns (allowed, (key, capacity, remaining,
+        seconds until full, seconds until the charge would fit)) for the bucket
+        that limits the caller most, or (True, None) with no charges.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, cost, capacity, rate in charges:
+                entry = self._buckets.get(key)
+                tokens = capacity if entry is None else min(capacity, entry[0] + (now - entry[1]) * rate)
+                levels.append((key, cost, capacity, rate, tokens))
+            allowed = all(tokens >= cost for _, cost, _, _, tokens in levels)
+            limiting = None
+            for key, cost, capacity, rate, tokens in levels:
+                if allowed:
+                    tokens -= cost
+                self._buckets[key] = (tokens, now)
+                self._buckets.move_to_end(key)
+                state = (key, capacity, tokens, (capacity - tokens) / rate, max(0.0, cost - tokens) / rate if not allowed else 0.0)
+                # Rejected: the longest wait; allowed: the emptiest bucket
+                if limiting is None or (state[4] > limiting[4] if not allowed else state[2] / capacity < limiting[2] / limiting[1]):
+                    limiting = state
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, limiting
+    
+    def __len__(self):
+        return len(self._buckets)
+
+rate_limit_buckets = TokenBucketStore(RATE_LIMIT_MAX_KEYS)
+
+def forwarded_for_signature(address):
+    return hmac.new(CLUSTER_SECRET.encode(), address.encode(), hashlib.sha256).hexdigest()
+
+def client_ip():
+    """The caller's address; a peer node forwarding a request vouches for it by signing it with the cluster secret"""
+    forwarded = request.headers.get('X-Forwarded-For', '')
+    signature = request.headers.get('X-Forwarded-For-Signature', '')
+    if CLUSTER_SECRET and signature and hmac.compare_digest(signature, forwarded_for_signature(forwarded)):
+        return forwarded
+    return request.remote_addr
+
+def tts_cost(data):
+    """Narration is charged by length: one token per RATE_LIMIT_TTS_CHARS_PER_TOKEN characters"""
+    return max(1, math.ceil(len(str(data.get('text') or '')) / RATE_LIMIT_TTS_CHARS_PER_TOKEN))
+
+def rate_limited(cost):
+    """
+    Charge cost tokens (or cost(json body)) to the caller's IP, user_id and
+    lobby_id buckets before running the view. An empty bucket answers 429 with
+    Retry-After; every response carries RateLimit-Limit/-Remaining/-Reset for
+    the tightest bucket.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True)
+            data = data if isinstance(data, dict) else {}
+            tokens = cost(data) if callable(cost) else cost
+            charges = []
+            for scope, key in (('ip', client_ip()), ('user', data.get('user_id')), ('lobby', data.get('lobby_id'))):
+                per_minute, burst = RATE_LIMITS[scope]
+                if key and per_minute:
+                    # A charge bigger than the bucket could never fit, so it empties a full one instead
+                    charges.append((f"{scope}:{str(key).upper() if scope == 'lobby' else key}",
+                                    min(tokens, burst), burst, per_minute / 60))
+            allowed, limiting = rate_limit_buckets.take(charges)
+            if limiting is None:
+                return view(*args, **kwargs)
+            
+            key, capacity, remaining, reset, retry_after = limiting
+            if allowed:
+                response = app.make_response(view(*args, **kwargs))
+            else:
+                scope = key.split(':', 1)[0]
+                metrics.inc('dungeonforge_rate_limited_total', endpoint=request.url_rule.rule, scope=scope)
+                response = pretty_json({'error': f'Rate limit exceeded for this {scope}, please slow down',
+                                        'scope': scope, 'retry_after': math.ceil(retry_after)}, 429)
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+            response.headers['RateLimit-Limit'] = str(capacity)
+            response.headers['RateLimit-Remaining'] = str(int(remaining))
+            response.headers['RateLimit-Reset'] = str(math.ceil(reset))
+            return response
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_trace():
+    g.request_start = time.perf_counter()
+    g.stages = {}
+    route = request.url_rule.rule if request.url_rule else request.path
+    in_flight = g.in_flight = InFlightRequest(threading.get_ident(), f"{request.method} {route}", g.stages)
+    in_flight_requests[in_flight.thread_id] = in_flight
+    if watches_slow_requests():
+        slow_request_timers.schedule(in_flight, SLOW_REQUEST_THRESHOLD_SECONDS, lambda: capture_slow_stack(in_flight))
+
+def finish_slow_request_watch(status, elapsed):
+    """Stop watching this request and keep its record if it ran past the threshold"""
+    in_flight = g.get('in_flight')
+    if in_flight is None:
+        return
+    if in_flight_requests.get(in_flight.thread_id) is in_flight:
+        del in_flight_requests[in_flight.thread_id]
+    slow_request_timers.cancel(in_flight)
+    if elapsed < SLOW_REQUEST_THRESHOLD_SECONDS or not watches_slow_requests():
+        return
+    metrics.inc('dungeonforge_slow_requests_total', endpoint=in_flight.label.split(' ', 1)[1])
+    record = {
+        'request': in_flight.label,
+        'path': request.path,
+        'status': status,
+        'duration_ms': round(elapsed * 1000, 1),
+        'finished_at': datetime.now().isoformat(timespec='seconds'),
+        'stages_ms': {name: round(seconds * 1000, 1) for name, seconds in in_flight.stages.items()},
+        'stacks': in_flight.stacks,
+    }
+    with slow_requests_lock:
+        slow_requests.append(record)
+
+@app.after_request
+def finish_request_trace(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    # Route templates keep label cardinality bounded (/lobby/<lobby_id>, not every id)
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('dungeonforge_http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    metrics.observe('dungeonforge_http_request_seconds', elapsed, endpoint=endpoint)
+    
+    # Per-request stage breakdown, visible in browser devtools
+    timings = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in g.stages.items()]
+    timings.append(f"total;dur={elapsed * 1000:.1f}")
+    response.headers['Server-Timing'] = ', '.join(timings)
+    finish_slow_request_watch(response.status_code, elapsed)
+    return response
+
+def admin_authorized():
+    supplied = request.headers.get('Authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, f'Bearer {ADMIN_TOKEN}')
+
+@app.route('/admin/profile', methods=['GET'])
+def admin_profile():
+    """
+    Sample every thread for ?seconds= (default 10) at ?interval_ms= (default 10)
+    and return collapsed stacks, one "frame;frame;... count" line each, ready for
+    flamegraph.pl, inferno or speedscope. Request threads are rooted at their route.
+    """
+    if not admin_authorized():
+        return pretty_json({'error': 'Admin token required'}, 403)
+    seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), PROFILE_MAX_SECONDS)
+    interval = max(request.args.get('interval_ms', 10, type=float), 1) / 1000
+    result = profiler.run(seconds, interval)
+    if result is None:
+        return pretty_json({'error': 'A profile is already running'}, 409)
+    counts, passes = result
+    body = ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+    return Response(body, mimetype='text/plain', headers={'X-Profile-Samples': str(passes)})
+
+@app.route('/admin/slow-requests', methods=['GET'])
+def admin_slow_requests():
+    """Requests that ran past the slow threshold, newest first, with stage timings and stack snapshots"""
+    if not admin_authorized():
+        return pretty_json({'error': 'Admin token required'}, 403)
+    with slow_requests_lock:
+        records = list(reversed(slow_requests))
+    return pretty_json({'threshold_seconds': SLOW_REQUEST_THRESHOLD_SECONDS, 'requests': records})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    status_counts = {}
+    for lobby in list(lobbies.values()):
+        status_counts[lobby.status] = status_counts.get(lobby.status, 0) + 1
+    gauges = [('dungeonforge_active_lobbies', 'Lobbies held in memory by status', {'status': status}, count)
+              for status, count in sorted(status_counts.items())]
+    gauges.append(('dungeonforge_sessions', 'Users currently in a lobby', {}, len(user_sessions)))
+    gauges.append(('dungeonforge_rate_limit_buckets', 'Rate-limit token buckets held in memory', {}, len(rate_limit_buckets)))
+    gauges.append(('dungeonforge_round_deadlines_pending', 'Open lobby rounds waiting on a deadline', {}, len(round_deadlines)))
+    gauges.append(('dungeonforge_generations_in_flight', 'Story generations holding an admission slot', {}, generation_admission.in_flight))
+    gauges.append(('dungeonforge_generations_waiting', 'Story generations queued for an admission slot', {}, generation_admission.waiting))
+    gauges.append(('dungeonforge_airia_circuit_open', 'Whether Airia calls are being skipped after repeated failures', {}, int(airia_breaker.is_open)))
+    gauges.append(('dungeonforge_airia_executions_pending', 'asyncOutput Airia executions awaiting completion', {}, len(airia_executions)))
+    gauges.append(('dungeonforge_lobbies_open', 'Waiting lobbies with a free seat', {}, len(open_lobbies)))
+    gauges.append(('dungeonforge_campaigns_archived', 'Campaigns in the on-disk archive index', {}, len(campaign_archive)))
+    gauges.append(('dungeonforge_lobby_subscribers', 'Long-poll requests waiting on a lobby change', {}, lobby_broadcaster.subscriber_count()))
+    gauges.append(('dungeonforge_lobby_encodes', 'Lobby states encoded for broadcast since start', {}, lobby_broadcaster.encodes))
+    gauges.append(('dungeonforge_narration_jobs_in_flight', 'Background narration syntheses running', {}, len(narration_jobs)))
+    gauges.append(('dungeonforge_log_queue_depth', 'Log records waiting to be written', {}, log_queue.qsize()))
+    gauges.append(('dungeonforge_story_cache_keys', 'Solo story continuations cached', {}, len(story_cache)))
+    gauges.append(('dungeonforge_image_store_bytes', 'Bytes held in the scene image store', {}, image_store_state['total_bytes']))
+    for cache_name, cache in (('tts_segment', tts_segment_cache), ('narration_audio', narration_audio_cache), ('scene_image_url', image_cache)):
+        gauges.append(('dungeonforge_cache_hits', 'Cache hits since start', {'cache': cache_name}, cache.hits))
+        gauges.append(('dungeonforge_cache_misses', 'Cache misses since start', {'cache': cache_name}, cache.misses))
+        gauges.append(('dungeonforge_cache_entries', 'Entries held per cache', {'cache': cache_name}, len(cache)))
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+class HashRing:
+    """Consistent-hash ring: adding or removing a node moves only the lobbies on its arcs"""
+    def __init__(self, nodes, vnodes=CLUSTER_VNODES):
+        self.nodes = sorted(set(nodes))
+        points = sorted((self._hash(f"{node}#{index}"), node) for node in self.nodes for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+    
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big')
+    
+    def owner(self, lobby_id):
+        if not self._hashes:
+            return NODE_URL
+        index = bisect.bisect(self._hashes, self._hash(lobby_id)) % len(self._hashes)
+        return self._owners[index]
+
+cluster = {'ring': HashRing(CLUSTER_NODES), 'previous_ring': None}
+cluster_timers = DeadlineScheduler(round_executor)
+
+def lobby_node(lobby_id):
+    """
+    Node that should serve lobby_id, or None for this node. Lobbies held here are
+    served here even if the ring has moved on, until their handoff completes.
+    Lobbies (live or archived) the ring has just given to this node but not yet
+    received are looked up on their previous owner.
+    """
+    if not CLUSTER_NODES or lobby_id in lobbies:
+        return None
+    owner = cluster['ring'].owner(lobby_id)
+    if owner == NODE_URL and cluster['previous_ring'] is not None and lobby_id not in campaign_archive:
+        owner = cluster['previous_ring'].owner(lobby_id)
+    return owner if owner != NODE_URL else None
+
+def request_lobby_id():
+    """The lobby a request is about, from the URL or the JSON body"""
+    if request.view_args and 'lobby_id' in request.view_args:
+        return request.view_args['lobby_id'].upper()
+    if request.method == 'POST' and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and isinstance(data.get('lobby_id'), str):
+            return data['lobby_id'].upper()
+    return None
+
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'content-encoding', 'host'}
+
+def forward_to_node(node):
+    """Proxy the current request to node and stream its answer back"""
+    url = node + request.path + (f"?{request.query_string.decode()}" if request.query_string else '')
+    headers = {key: value for key, value in request.headers if key.lower() not in HOP_BY_HOP_HEADERS}
+    headers['X-Forwarded-By-Node'] = NODE_URL
+    if CLUSTER_SECRET:
+        # The owner node rate-limits by the original caller's address, signed so clients can't pick their own
+        headers['X-Forwarded-For'] = client_ip()
+        headers['X-Forwarded-For-Signature'] = forwarded_for_signature(headers['X-Forwarded-For'])
+    try:
+        upstream = upstream_session.request(request.method, url, data=request.get_data(), headers=headers,
+                                            stream=True, timeout=(5, LOBBY_LONG_POLL_MAX_SECONDS + 120))
+    except requests.RequestException as e:
+        log.warning("Forwarding to %s failed: %s", node, e)
+        response = pretty_json({'error': 'Lobby node unavailable, try again shortly'}, 503)
+        response.headers['Retry-After'] = '2'
+        return response
+    return Response(upstream.iter_content(64 * 1024), status=upstream.status_code,
+                    headers=[(key, value) for key, value in upstream.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS])
+
+@app.before_request
+def route_to_lobby_node():
+    """Send lobby requests to the node that owns the lobby"""
+    if not CLUSTER_NODES or request.method == 'OPTIONS':
+        return None
+    lobby_id = request_lobby_id()
+    if not lobby_id:
+        return None
+    if lobby_id in moving_lobbies:
+        response = pretty_json({'error': 'Lobby is moving to another server, try again shortly'}, 503)
+        response.headers['Retry-After'] = '1'
+        return response
+    # A forwarded request is served here even if membership views disagree, so requests never loop
+    node = lobby_node(lobby_id)
+    if node is None or request.headers.get('X-Forwarded-By-Node'):
+        return None
+    
+    metrics.inc('dungeonforge_cluster_routed_total', mode=CLUSTER_ROUTING)
+    if CLUSTER_ROUTING == 'redirect':
+        # 307 keeps the method and body; X-Lobby-Node lets clients go direct next time
+        response = Response(status=307)
+        response.headers['Location'] = node + request.full_path.rstrip('?')
+    else:
+        response = forward_to_node(node)
+    response.headers['X-Lobby-Node'] = node
+    return response
+
+def cluster_authorized():
+    supplied = request.headers.get('X-Cluster-Secret', '')
+    return bool(CLUSTER_SECRET) and hmac.compare_digest(supplied, CLUSTER_SECRET)
+
+def hand_off_lobby(lobby_id, node):
+    """
+    Move one lobby's state to node. Returns False to retry later when a round is
+    generating or a scene render or archive write has yet to land on this copy;
+    requests for the lobby get 503 + Retry-After while it moves.
+    """
+    lobby = lobbies.get(lobby_id)
+    if lobby is None:
+        return True
+    if not lobby.round_lock.acquire(blocking=False):
+        return False
+    if lobby.background:
+        lobby.round_lock.release()
+        return False
+    moving_lobbies.add(lobby_id)
+    try:
+        response = upstream_session.post(f"{node}/cluster/handoff", json={'lobby': lobby.to_state()},
+                                         headers={'X-Cluster-Secret': CLUSTER_SECRET}, timeout=10)
+        if response.status_code != 200:
+            log.warning("Handoff of lobby %s to %s failed: %s", lobby_id, node, response.status_code)
+            return False
+        forget_lobby(lobby)
+        metrics.inc('dungeonforge_lobby_handoffs_total', direction='out')
+        return True
+    except requests.RequestException as e:
+        log.warning("Handoff of lobby %s to %s failed: %s", lobby_id, node, e)
+        return False
+    finally:
+        moving_lobbies.discard(lobby_id)
+        lobby.round_lock.release()
+
+def rebalance_lobbies():
+    """Hand off every lobby the ring now assigns elsewhere; retries busy ones shortly"""
+    ring = cluster['ring']
+    deferred = []
+    moved = 0
+    for lobby_id in list(lobbies):
+        owner = ring.owner(lobby_id)
+        if owner == NODE_URL:
+            continue
+        if hand_off_lobby(lobby_id, owner):
+            moved += 1
+        else:
+            deferred.append(lobby_id)
+    if deferred:
+        cluster_timers.schedule('rebalance', 2, rebalance_lobbies)
+    log.info("Rebalanced lobbies", extra={'fields': {'moved': moved, 'deferred': len(deferred), 'kept': len(lobbies) - len(deferred)}})
+    archive_executor.submit(hand_off_archives)
+    return moved, deferred
+
+def hand_off_archives():
+    """
+    Copy archived campaigns (no longer in memory) to the nodes the ring now
+    assigns them to, so the owner can answer 410 and /export for them. Runs on
+    archive_executor; campaigns that fail to copy are retried shortly.
+    """
+    ring = cluster['ring']
+    failed = 0
+    for lobby_id in campaign_archive.ids():
+        owner = ring.owner(lobby_id)
+        if owner == NODE_URL or lobby_id in lobbies:
+            continue
+        try:
+            response = upstream_session.post(f"{owner}/cluster/archive/{lobby_id}", data=campaign_archive.member(lobby_id),
+                                             headers={'X-Cluster-Secret': CLUSTER_SECRET,
+                                                      'Content-Type': 'application/gzip'}, timeout=10)
+            response.raise_for_status()
+        except (requests.RequestException, OSError) as e:
+            log.warning("Copying archived campaign %s to %s failed: %s", lobby_id, owner, e)
+            failed += 1
+    if failed:
+        cluster_timers.schedule('archive-handoff', 5, lambda: archive_executor.submit(hand_off_archives))
+
+@app.route('/cluster', methods=['GET', 'PUT'])
+def cluster_membership():
+    """
+    GET: this node's view of the ring. PUT {"nodes": [...]}: change membership
+    and hand lobbies this node no longer owns to their new nodes. Send the PUT
+    to every node, joining nodes first so they can receive handoffs.
+    """
+    if not cluster_authorized():
+        return pretty_json({'error': 'Cluster secret required'}, 403)
+    if request.method == 'PUT':
+        nodes = [str(node).rstrip('/') for node in (request.get_json(silent=True) or {}).get('nodes', [])]
+        if not nodes:
+            return pretty_json({'error': 'nodes must list at least one node URL'}, 400)
+        CLUSTER_NODES[:] = nodes
+        cluster['previous_ring'] = cluster['ring']
+        cluster['ring'] = HashRing(nodes)
+        moved, deferred = rebalance_lobbies()
+        return pretty_json({'success': True, 'nodes': nodes, 'moved': moved, 'deferred': deferred})
+    return pretty_json({'node': NODE_URL, 'nodes': cluster['ring'].nodes, 'lobbies': len(lobbies),
+                        'routing': CLUSTER_ROUTING})
+
+@app.route('/cluster/handoff', methods=['POST'])
+def receive_lobby_handoff():
+    """Install a lobby handed off by its previous node"""
+    if not cluster_authorized():
+        return pretty_json({'error': 'Cluster secret required'}, 403)
+    lobby = Lobby.from_state(request.get_json()['lobby'])
+    lobbies[lobby.id] = lobby
+    open_lobbies.update(lobby)
+    for uid in list(lobby.users) + list(lobby.spectators):
+        user_sessions[uid] = lobby.id
+    if lobby.status == 'playing' and lobby.round_deadline is not None:
+        open_round_deadline(lobby, delay=max(0.0, lobby.round_deadline - time.time()))
+    lobby_broadcaster.publish(lobby)
+    if lobby.story_complete:
+        # Archived here too: this node now answers for the campaign once it is evicted
+        archive_campaign(lobby)
+    metrics.inc('dungeonforge_lobby_handoffs_total', direction='in')
+    return pretty_json({'success': True, 'lobby_id': lobby.id})
+
+@app.route('/cluster/archive/<campaign_id>', methods=['POST'])
+def receive_archive_handoff(campaign_id):
+    """Store an archived campaign (one gzip member) copied from its previous node"""
+    if not cluster_authorized():
+        return pretty_json({'error': 'Cluster secret required'}, 403)
+    campaign_id = campaign_id.upper()
+    if campaign_id not in campaign_archive:
+        campaign_archive.append_member(campaign_id, request.get_data())
+    return pretty_json({'success': True, 'lobby_id': campaign_id})
+
 # Lobby API endpoints
 @app.route('/lobby/create', methods=['POST'])
 def create_lobby():
     data = request.get_json()
     username = data.get('username', 'Anonymous')
+    max_players = data.get('max_players', LOBBY_DEFAULT_PLAYERS)
     
     if not username:
         return pretty_json({'error': 'Username is required'}, 400)
+    if not isinstance(max_players, int) or not 2 <= max_players <= LOBBY_MAX_PLAYERS:
+        return pretty_json({'error': f'max_players must be between 2 and {LOBBY_MAX_PLAYERS}'}, 400)
     
+    lobby, user_id = open_new_lobby(username, max_players)
+    return pretty_json({
+        'success': True,
+        'lobby_id': lobby.id,
+        'user_id': user_id,
+        'lobby': lobby.to_dict()
+    })
+
+def open_new_lobby(username, max_players):
+    """Create a lobby hosted by username; returns (lobby, host user_id)"""
     # Generate unique IDs
     user_id = str(uuid.uuid4())
     lobby_id = str(uuid.uuid4())[:8].upper()  # Short lobby code
+    # In a cluster, draw codes until one hashes to this node so the lobby starts where it lives
+    while CLUSTER_NODES and cluster['ring'].owner(lobby_id) != NODE_URL:
+        lobby_id = str(uuid.uuid4())[:8].upper()
     
     # Create lobby
-    lobby = Lobby(lobby_id, user_id, username)
+    lobby = Lobby(lobby_id, user_id, username, max_players)
     lobbies[lobby_id] = lobby
     user_sessions[user_id] = lobby_id
+    open_lobbies.update(lobby)
+    lobby_broadcaster.publish(lobby)
+    return lobby, user_id
+
+@app.route('/lobby/open', methods=['GET'])
+def list_open_lobbies():
+    """
+    Lobbies that can be joined, oldest first. ?limit= (up to 100) and
+    ?cursor=<next_cursor from the previous page> page through them.
+    """
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    cursor = request.args.get('cursor', 0, type=int)
+    lobby_ids, next_cursor = open_lobbies.page(cursor, limit)
+    listed = []
+    for lobby_id in lobby_ids:
+        lobby = lobbies.get(lobby_id)
+        if lobby is None:
+            continue
+        listed.append({
+            'id': lobby.id,
+            'host_username': lobby.host_username,
+            'players': len(lobby.users),
+            'max_users': lobby.max_users,
+            'open_slots': lobby.max_users - len(lobby.users),
+            'spectator_count': len(lobby.spectators),
+            'created_at': lobby.created_at.isoformat()
+        })
+    return pretty_json({'lobbies': listed, 'next_cursor': next_cursor, 'open_lobbies': len(open_lobbies)})
+
+@app.route('/lobby/quickmatch', methods=['POST'])
+def quickmatch():
+    """
+    Join the fullest waiting lobby so games fill up and start sooner; with none
+    open, host a new one (max_players as for /lobby/create).
+    """
+    data = request.get_json()
+    username = data.get('username', 'Anonymous')
+    max_players = data.get('max_players', LOBBY_DEFAULT_PLAYERS)
     
-    return pretty_json({
-        'success': True,
-        'lobby_id': lobby_id,
-        'user_id': user_id,
-        'lobby': lobby.to_dict()
-    })
+    if not username:
+        return pretty_json({'error': 'Username is required'}, 400)
+    if not isinstance(max_players, int) or not 2 <= max_players <= LOBBY_MAX_PLAYERS:
+        return pretty_json({'error': f'max_players must be between 2 and {LOBBY_MAX_PLAYERS}'}, 400)
+    
+    user_id = str(uuid.uuid4())
+    with quickmatch_lock:
+        lobby_id = open_lobbies.fullest()
+        while lobby_id is not None:
+            lobby = lobbies.get(lobby_id)
+            if lobby is not None and lobby.add_user(user_id, username)[0]:
+                user_sessions[user_id] = lobby_id
+                lobby_broadcaster.publish(lobby)
+                metrics.inc('dungeonforge_quickmatch_total', outcome='joined')
+                return pretty_json({'success': True, 'created': False, 'user_id': user_id,
+                                    'lobby_id': lobby_id, 'lobby': lobby.to_dict()})
+            # Filed under stale state (e.g. filled by a direct join); refile and look again
+            if lobby is None:
+                open_lobbies.discard(lobby_id)
+            else:
+                open_lobbies.update(lobby)
+            lobby_id = open_lobbies.fullest()
+    
+    lobby, user_id = open_new_lobby(username, max_players)
+    metrics.inc('dungeonforge_quickmatch_total', outcome='created')
+    return pretty_json({'success': True, 'created': True, 'user_id': user_id,
+                        'lobby_id': lobby.id, 'lobby': lobby.to_dict()})
 
 @app.route('/lobby/join', methods=['POST'])
 def join_lobby():
@@ -350,6 +2471,7 @@ def join_lobby():
     
     if success:
         user_sessions[user_id] = lobby_id
+        lobby_broadcaster.publish(lobby)
         return pretty_json({
             'success': True,
             'user_id': user_id,
@@ -359,17 +2481,86 @@ def join_lobby():
     else:
         return pretty_json({'error': message}, 400)
 
+@app.route('/lobby/spectate', methods=['POST'])
+def spectate_lobby():
+    """Follow a lobby read-only; the spectator_id works with /lobby/leave"""
+    data = request.get_json()
+    lobby_id = data.get('lobby_id', '').upper()
+    username = data.get('username', 'Anonymous')
+    
+    if not lobby_id:
+        return pretty_json({'error': 'Lobby ID is required'}, 400)
+    if lobby_id not in lobbies:
+        return pretty_json({'error': 'Lobby not found'}, 404)
+    
+    lobby = lobbies[lobby_id]
+    spectator_id = str(uuid.uuid4())
+    success, message = lobby.add_spectator(spectator_id, username)
+    if not success:
+        return pretty_json({'error': message}, 400)
+    
+    user_sessions[spectator_id] = lobby_id
+    lobby_broadcaster.publish(lobby)
+    return pretty_json({
+        'success': True,
+        'spectator_id': spectator_id,
+        'lobby_id': lobby_id,
+        'lobby': lobby.to_dict()
+    })
+
 @app.route('/lobby/<lobby_id>', methods=['GET'])
 def get_lobby(lobby_id):
+    """
+    Current lobby state, encoded once per change and shared by every reader.
+    ?since=<version>&wait=<seconds> long-polls until a newer version exists;
+    an unchanged lobby answers 304, as does If-None-Match with its ETag. With
+    &patch=1, a change that only landed scene images answers with just those.
+    """
     lobby_id = lobby_id.upper()
+    metrics.inc('dungeonforge_lobby_polls_total')
     
     if lobby_id not in lobbies:
-        return pretty_json({'error': 'Lobby not found'}, 404)
+        return lobby_gone(lobby_id)
     
-    return pretty_json({
-        'success': True,
-        'lobby': lobbies[lobby_id].to_dict()
-    })
+    since = request.args.get('since', type=int)
+    wait = min(request.args.get('wait', 0, type=float), LOBBY_LONG_POLL_MAX_SECONDS)
+    with stage('lobby_wait'):
+        version, body = lobby_broadcaster.snapshot(lobbies[lobby_id], since, wait, request.args.get('patch') == '1')
+    if body is None:
+        return lobby_gone(lobby_id)
+    
+    if version == since or request.if_none_match.contains(str(version)):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(str(version))
+    return response
+
+def lobby_gone(lobby_id):
+    """404 for an unknown lobby; 410 pointing at the transcript for an archived one"""
+    if lobby_id in campaign_archive:
+        return pretty_json({'error': 'This campaign has finished and been archived', 'archived': True,
+                            'export_url': f'/lobby/{lobby_id}/export'}, 410)
+    return pretty_json({'error': 'Lobby not found'}, 404)
+
+@app.route('/lobby/<lobby_id>/export', methods=['GET'])
+def export_lobby(lobby_id):
+    """
+    The campaign transcript as NDJSON (a header line, then one line per story
+    message), streamed from memory for live lobbies and from the archive for
+    finished ones without loading the whole segment.
+    """
+    lobby_id = lobby_id.upper()
+    lobby = lobbies.get(lobby_id)
+    if lobby is not None:
+        body = campaign_lines(lobby)
+    elif lobby_id in campaign_archive:
+        body = campaign_archive.stream(lobby_id)
+    else:
+        return pretty_json({'error': 'Lobby not found'}, 404)
+    response = Response(body, mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename="campaign-{lobby_id}.ndjson"'
+    return response
 
 @app.route('/lobby/leave', methods=['POST'])
 def leave_lobby():
@@ -385,6 +2576,9 @@ def leave_lobby():
         lobby_id = user_sessions[user_id]
     
     if lobby_id not in lobbies:
+        if lobby_id in campaign_archive:
+            # Evicted after finishing; there is nothing left to leave
+            return pretty_json({'success': True, 'lobby_deleted': True})
         return pretty_json({'error': 'Lobby not found'}, 404)
     
     lobby = lobbies[lobby_id]
@@ -396,9 +2590,10 @@ def leave_lobby():
         
         # Clean up empty lobbies
         if len(lobby.users) == 0:
-            del lobbies[lobby_id]
+            forget_lobby(lobby)
             return pretty_json({'success': True, 'lobby_deleted': True})
         
+        lobby_broadcaster.publish(lobby)
         return pretty_json({
             'success': True,
             'lobby': lobby.to_dict()
@@ -427,6 +2622,7 @@ def set_ready():
     success = lobby.set_user_ready(user_id, ready)
     
     if success:
+        lobby_broadcaster.publish(lobby)
         return pretty_json({
             'success': True,
             'lobby': lobby.to_dict(),
@@ -436,6 +2632,8 @@ def set_ready():
         return pretty_json({'error': 'User not in lobby'}, 400)
 
 @app.route('/lobby/start', methods=['POST'])
+@idempotent
+@rate_limited(10)
 def start_lobby():
     data = request.get_json()
     lobby_id = data.get('lobby_id', '').upper()
@@ -467,70 +2665,15 @@ def start_lobby():
     
     # Generate opening scene and options
     try:
-        user_input = (
-            f"You are a Dungeon Master starting a collaborative adventure for {len(lobby.users)} players. "
-            f"Begin the story with an evocative opening in 1-2 vivid paragraphs. "
-            f"This is event 1 of 10 total events. You have 9 events remaining after this one. "
-            f"THEN produce a concise 50-word summary of the new scene. "
-            f"THEN produce 3-4 distinct actionable next-step options for the players. "
-            f"Respond ONLY as strict JSON matching this schema: {{\n"
-            f"  \"story\": string,\n"
-            f"  \"summary50\": string,\n"
-            f"  \"options\": [string, string, string, string]\n"
-            f"}} without any extra text. Session start: create opening scene and choices."
-        )
-        
-        raw_text = call_airia_agent(user_input)
-        story = None
-        summary50 = None
-        options = []
-        if raw_text:
-            try:
-                parsed = extract_json_from_text(raw_text)
-                if parsed is None:
-                    raise ValueError('No JSON object could be decoded from model output')
-                story = parsed.get('story')
-                summary50 = parsed.get('summary50')
-                opts = parsed.get('options')
-                if isinstance(opts, list):
-                    options = [str(o) for o in opts if isinstance(o, str)]
-            except Exception as parse_err:
-                print(f"JSON parse failed, falling back to text: {parse_err}")
-                story = raw_text
+        with generation_admission.slot('lobby_start') as text_only:
+            story, summary50, options, render, audio_url = generate_opening(lobby, text_only)
         
-        # Fallback story if AI fails (rate limits, etc.)
-        if not story:
-            story = """The ancient tavern door creaks open as you and your companions step into the dimly lit common room. The air is thick with the scent of ale and mystery. A hooded figure in the corner gestures toward your table, and you notice a weathered map spread across its surface. Your adventure begins here, in this moment of anticipation."""
-            summary50 = "You enter a mysterious tavern where a hooded figure awaits with a map. The adventure begins."
-            options = [
-                "Approach the hooded figure and examine the map.",
-                "Order drinks and listen for rumors from other patrons.",
-                "Investigate the tavern's back rooms for secrets.",
-                "Leave the tavern and explore the surrounding town."
-            ]
-        
-        # Generate personalized options for each player
-        player_options = {}
-        option_templates = [
-            ["Approach the hooded figure and examine the map.", "Order drinks and listen for rumors.", "Investigate the tavern's back rooms.", "Leave and explore the town."],
-            ["Challenge the hooded figure to a game of dice.", "Search for hidden passages in the walls.", "Buy information from the bartender.", "Follow a suspicious patron outside."],
-            ["Cast a detection spell to reveal secrets.", "Use stealth to eavesdrop on conversations.", "Offer to help the tavern keeper.", "Examine the map for magical properties."]
-        ]
-        
-        for i, (uid, user_data) in enumerate(lobby.users.items()):
-            template_index = i % len(option_templates)
-            player_options[uid] = {
-                'username': user_data['username'],
-                'options': option_templates[template_index]
-            }
-        # Generate scene image from summary (wait for completion)
-        scene_image = None
-        if summary50:
-            print("[Stack-AI] Waiting for image generation to complete...")
-            scene_image = generate_scene_image(summary50, lobby_id)
+        # Options are stored once per round; each player gets indexes into them
+        options, player_options = build_round_options(lobby.users.keys(), options, OPENING_OPTION_TEMPLATES)
         
         # Update lobby state
         lobby.status = 'playing'
+        open_lobbies.update(lobby)
         lobby.current_round = 1
         lobby.events_remaining = 9
         lobby.story_complete = False
@@ -540,20 +2683,172 @@ def start_lobby():
             'timestamp': datetime.now().isoformat(),
             'user_choices': {},
             'summary50': summary50,
+            'options': options,
             'player_options': player_options,
-            'scene_image': scene_image
+            'scene_image': None,
+            'scene_preview': scene_preview(summary50),
+            'audio_url': audio_url
         })
         # Reset ready state for next rounds
         for u in lobby.users.values():
             u['ready'] = False
-            u['choice'] = None
-        return pretty_json({'success': True, 'lobby': lobby.to_dict(), 'story': story, 'player_options': player_options, 'summary50': summary50, 'scene_image': scene_image})
+        lobby.reset_choices()
+        open_round_deadline(lobby)
+        lobby_broadcaster.publish(lobby)
+        attach_scene_render(lobby, len(lobby.story_messages) - 1, render)
+        return pretty_json({'success': True, 'lobby': lobby.to_dict(), 'story': story, 'options': options, 'player_options': player_options, 'summary50': summary50, 'scene_image': None, 'scene_preview': scene_preview(summary50)})
+    except GenerationOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return pretty_json({'error': f'Failed to start lobby: {str(e)}'}, 500)
     finally:
         # Always remove from starting set
         starting_lobbies.discard(lobby_id)
 
+def generate_opening(lobby, text_only=False):
+    """Opening scene for a lobby: (story, summary50, options, scene render Future or None, audio_url)"""
+    with stage('prompt_build'):
+        user_input = build_opening_prompt(lobby)
+    
+    raw_text = call_airia_agent(user_input)
+    story, summary50, options = parse_story_response(raw_text)
+    
+    # Fallback story if AI fails (rate limits, etc.)
+    if not story:
+        metrics.inc('dungeonforge_story_fallbacks_total', endpoint='lobby_start')
+        story, summary50, options = procedural_event(f"{lobby.id}:opening", 10, opening=True)
+    
+    # The full scene image renders in the background; skipped under load
+    render = render_scene_image(summary50, lobby.id) if summary50 and not text_only else None
+    return story, summary50, options, render, None if text_only else schedule_narration_audio(story)
+
+def build_opening_prompt(lobby):
+    """Prompt for the opening scene of a collaborative lobby"""
+    return (
+        f"You are a Dungeon Master starting a collaborative adventure for {len(lobby.users)} players. "
+        f"Begin the story with an evocative opening in 1-2 vivid paragraphs. "
+        f"This is event 1 of 10 total events. You have 9 events remaining after this one. "
+        f"THEN produce a concise 50-word summary of the new scene. "
+        f"THEN produce 3-4 distinct actionable next-step options for the players. "
+        f"Respond ONLY as strict JSON matching this schema: {{\n"
+        f"  \"story\": string,\n"
+        f"  \"summary50\": string,\n"
+        f"  \"options\": [string, string, string, string]\n"
+        f"}} without any extra text. Session start: create opening scene and choices."
+    )
+
+def build_story_prompt(user_message, events_remaining):
+    """Prompt for the next event of a solo story"""
+    return (
+        f"You are a Dungeon Master. Continue the user's fantasy story in 1-2 vivid paragraphs. "
+        f"IMPORTANT: This is event {11 - events_remaining} of 10 total events. "
+        f"{'This is the FINAL event - conclude the story with a satisfying ending!' if events_remaining == 1 else f'You have {events_remaining - 1} events remaining after this one.'} "
+        f"THEN produce a concise 50-word summary of the new scene. "
+        f"THEN produce 3-4 distinct actionable next-step options the user can choose, terse but evocative. "
+        f"Respond ONLY as strict JSON matching this schema: {{\n"
+        f"  \"story\": string,\n"
+        f"  \"summary50\": string,\n"
+        f"  \"options\": [string, string, string, string]\n"
+        f"}} without any extra text.\n\n"
+        f"User's story continuation: {user_message}"
+    )
+
+# Changes whenever the solo prompt template does, so cached continuations from an
+# older prompt are never served
+STORY_PROMPT_VERSION = hashlib.sha1(build_story_prompt('', 10).encode()).hexdigest()[:12]
+
+def story_cache_key(user_message, events_remaining):
+    """Cache key for a solo continuation: case, spacing and end punctuation don't matter"""
+    normalized = ' '.join(user_message.lower().split()).rstrip('.!?')
+    return (STORY_PROMPT_VERSION, normalized, events_remaining)
+
+def fresh_story_variants(key):
+    """Cached variants for key that are within the TTL and whose scene image is still stored"""
+    variants = story_cache.get(key) or ()
+    now = time.time()
+    return tuple(variant for variant in variants
+                 if now - variant[0] < STORY_CACHE_TTL_SECONDS
+                 and (not (variant[4] or '').startswith('/images/') or touch_image(variant[4].rsplit('/', 1)[-1])))
+
+def cached_story(key):
+    """(story, summary50, options, scene_image) for key, or None while it has fewer than STORY_CACHE_VARIANTS variants"""
+    variants = fresh_story_variants(key)
+    if len(variants) < STORY_CACHE_VARIANTS:
+        metrics.inc('dungeonforge_story_cache_total', outcome='miss')
+        return None
+    metrics.inc('dungeonforge_story_cache_total', outcome='hit')
+    return random.choice(variants)[1:]
+
+def remember_story(key, story, summary50, options, scene_image):
+    with story_cache_lock:
+        variants = fresh_story_variants(key)
+        if len(variants) < STORY_CACHE_VARIANTS:
+            story_cache.put(key, variants + ((time.time(), story, summary50, options, scene_image),))
+
+def summarize_votes(vote_counts, total_players):
+    """Bounded description of a round's vote distribution for large lobbies"""
+    votes = Counter(vote_counts)
+    abstained = votes.pop(ROUND_DEFAULT_CHOICE, 0)
+    ranked = votes.most_common()
+    lines = [f"- {count} of {total_players} players ({count * 100 // total_players}%): {choice[:ROUND_PROMPT_CHOICE_CHARS]}"
+             for choice, count in ranked[:ROUND_PROMPT_TOP_VOTES]]
+    others = ranked[ROUND_PROMPT_TOP_VOTES:]
+    if others:
+        lines.append(f"- {sum(count for _, count in others)} players split across {len(others)} other actions")
+    if abstained:
+        lines.append(f"- {abstained} players did not choose and follow the party's lead")
+    return "\n".join(lines)
+
+def build_round_prompt(lobby):
+    """Prompt weaving the players' choices into the next collaborative event"""
+    if len(lobby.users) <= ROUND_PROMPT_VERBATIM_PLAYERS:
+        choices_text = "\n".join(f"{user_data['username']}: {user_data['choice']}" for user_data in lobby.users.values())
+    else:
+        # Weight the story by the vote rather than listing dozens of players
+        choices_text = ("The party voted; let the most popular actions drive the story:\n"
+                        + summarize_votes(lobby.vote_counts, len(lobby.users)))
+    
+    return (
+        f"You are a Dungeon Master managing a collaborative story with {len(lobby.users)} players. "
+        f"This is event {11 - lobby.events_remaining} of 10 total events. "
+        f"{'This is the FINAL event - conclude the story with a satisfying ending!' if lobby.events_remaining == 1 else f'You have {lobby.events_remaining - 1} events remaining after this one.'} "
+        f"Each player has made their choice. Weave their actions together into a cohesive story continuation. "
+        f"THEN produce a concise 50-word summary of the new scene. "
+        f"THEN produce 3-4 distinct actionable next-step options for the next round. "
+        f"Respond ONLY as strict JSON matching this schema: {{\n"
+        f"  \"story\": string,\n"
+        f"  \"summary50\": string,\n"
+        f"  \"options\": [string, string, string, string]\n"
+        f"}} without any extra text.\n\n"
+        f"Player choices:\n{choices_text}\n\n"
+        f"Previous story context: {lobby.story_messages[-1]['content'] if lobby.story_messages else 'Beginning of story'}"
+    )
+
+def parse_story_response(raw_text):
+    """
+    Parse the model's strict-JSON reply into (story, summary50, options).
+    Output that is not JSON is used as the story text as-is.
+    """
+    story = None
+    summary50 = None
+    options = []
+    if raw_text:
+        with stage('json_extract'):
+            try:
+                parsed = extract_json_from_text(raw_text)
+                if parsed is None:
+                    raise ValueError('No JSON object could be decoded from model output')
+                story = parsed.get('story')
+                summary50 = parsed.get('summary50')
+                opts = parsed.get('options')
+                if isinstance(opts, list):
+                    options = [str(o) for o in opts if isinstance(o, str)]
+            except Exception as parse_err:
+                airia_log.warning("JSON parse failed, falling back to text: %s", parse_err)
+                metrics.inc('dungeonforge_parse_failures_total')
+                story = raw_text
+    return story, summary50, options
+
 def extract_json_from_text(text):
     """Try to extract a JSON object from arbitrary text (handles code fences and extra text)."""
     import json
@@ -585,16 +2880,99 @@ def extract_json_from_text(text):
     except Exception:
         return None
 
+# Procedural story engine: a small grammar the fallback paths fill from a seed
+# (lobby, round and choices), so the same state always tells the same event
+# and different states tell different ones, in microseconds and with no network.
+PROCEDURAL_PLACES = (
+    'a drowned chapel', 'the ruined watchtower', 'a moonlit crossroads', 'the dwarven forge-halls',
+    'a fungus-lit cavern', 'the bone orchard', 'a smugglers\' cove', 'the frozen library',
+    'the whispering marsh', 'a collapsed mine', 'the sunken bazaar', 'the obsidian stair',
+)
+PROCEDURAL_FOES = (
+    ('a hooded cultist', 'chants in a tongue older than the kingdom'),
+    ('a wounded wyvern', 'thrashes against iron chains'),
+    ('a band of goblin raiders', 'argues over a stolen crown'),
+    ('a restless wraith', 'searches for a name it has forgotten'),
+    ('the troll of the old bridge', 'demands a toll no coin can pay'),
+    ('a mercenary captain', 'counts the hours until her reinforcements arrive'),
+    ('a clockwork sentinel', 'grinds through its ancient patrol'),
+    ('a plague-touched druid', 'tends a garden of thorns'),
+)
+PROCEDURAL_RELICS = (
+    'a cracked sunstone', 'a map inked in silver', 'a bell that makes no sound', 'a dragon-scale key',
+    'a journal sealed with wax', 'a crown of black iron', 'a lantern that burns cold', 'a shard of the old king\'s blade',
+)
+PROCEDURAL_OMENS = (
+    'Somewhere below, drums answer the silence.', 'The torches gutter as if something unseen has passed.',
+    'A raven watches from the rafters, too still to be natural.', 'The air tastes of ash and old rain.',
+    'Far off, a horn sounds three times and then stops.', 'The stones underfoot are warm, as though something breathes beneath them.',
+)
+PROCEDURAL_SPEAKERS = ('the old knight', 'Mira the scout', 'the innkeeper', 'Sir Roland', 'the hedge witch')
+PROCEDURAL_LINES = (
+    'We are not the first to come this way', 'Keep your blades close and your voices low',
+    'Whatever waits ahead already knows our names', 'There is still time to turn back',
+    'I have seen this sigil before, in darker days', 'Trust the map, not your eyes',
+)
+PROCEDURAL_ACTIONS = (
+    'Confront {foe} before it can act', 'Search the shadows around {place} for another way',
+    'Study {relic} for hidden meaning', 'Bargain with {foe} for safe passage',
+    'Set a trap and wait for {foe} to come closer', 'Send a scout ahead toward {place}',
+    'Use {relic} against {foe}', 'Retreat, regroup and tend to the wounded',
+)
+
+def procedural_event(seed, events_remaining, choices=(), opening=False):
+    """
+    (story, summary50, options) for one event, generated locally from seed.
+    choices are the players' actions to weave in, most popular first.
+    """
+    rng = random.Random(hashlib.sha256(str(seed).encode()).digest())
+    place = rng.choice(PROCEDURAL_PLACES)
+    foe, foe_deed = rng.choice(PROCEDURAL_FOES)
+    relic = rng.choice(PROCEDURAL_RELICS)
+    speaker = rng.choice(PROCEDURAL_SPEAKERS)
+    line = rng.choice(PROCEDURAL_LINES)
+    choice = next((c.strip().rstrip('.!?') for c in choices if c and c.strip()), '')
+    if len(choice) > 80:
+        choice = choice[:80].rsplit(' ', 1)[0]
+    
+    if opening:
+        first = (f"Your company gathers at the edge of {place} as dusk settles over the kingdom. "
+                 f"Rumor says {relic} lies somewhere within, and that {foe} {foe_deed}.")
+    elif choice:
+        first = (f"The choice is made: {choice}. Pressing on, the party soon reaches {place}. "
+                 f"There, {foe} {foe_deed}, and {relic} glints just beyond reach.")
+    else:
+        first = f"The path leads the party to {place}, where {foe} {foe_deed}. Among the debris lies {relic}."
+    second = f'"{line}," {speaker} warns, eyes fixed on the dark ahead. {rng.choice(PROCEDURAL_OMENS)}'
+    
+    if events_remaining <= 1:
+        story = (f"{first}\n\nIn a final clash of steel and will, the party overcomes {foe} and claims {relic}. "
+                 f'"It is done," {speaker} says at last, and the kingdom breathes again. Your legend ends here.')
+        summary50 = (f"At {place} the party faces {foe} one last time. With courage and cunning they prevail, "
+                     f"claim {relic}, and bring the adventure to its end. {speaker.capitalize()} declares the deed done "
+                     f"as the kingdom celebrates its heroes.")
+        return story, summary50, []
+    
+    story = f"{first}\n\n{second}"
+    summary50 = (f"The party arrives at {place}, where {foe} {foe_deed}. {relic.capitalize()} lies within reach, "
+                 f"but danger gathers. {speaker.capitalize()} urges caution as strange omens stir, and the companions "
+                 f"must decide how to face what waits in the dark.")
+    fills = {'foe': foe, 'place': place, 'relic': relic}
+    options = [action.format(**fills) for action in rng.sample(PROCEDURAL_ACTIONS, 4)]
+    return story, summary50, options
+
 
 @app.route('/', methods=['GET'])
 def index():
     return pretty_json({
         'status': 'ok',
         'message': 'D&D AI Backend API',
-        'endpoints': ['/health', '/story', '/lobby/create', '/lobby/join', '/lobby/start']
+        'endpoints': ['/health', '/metrics', '/story', '/lobby/create', '/lobby/join', '/lobby/start']
     })
 
 @app.route('/story', methods=['POST'])
+@idempotent
+@rate_limited(10)
 def get_story():
     data = request.get_json()
     user_message = data.get('message', '')
@@ -639,50 +3017,41 @@ def get_story():
                 'storyComplete': True
             })
         
-        # Ask Airia agent to return structured JSON: story, 50-word summary, and 3-4 next-step options
-        user_input = (
-            f"You are a Dungeon Master. Continue the user's fantasy story in 1-2 vivid paragraphs. "
-            f"IMPORTANT: This is event {11 - events_remaining} of 10 total events. "
-            f"{'This is the FINAL event - conclude the story with a satisfying ending!' if events_remaining == 1 else f'You have {events_remaining - 1} events remaining after this one.'} "
-            f"THEN produce a concise 50-word summary of the new scene. "
-            f"THEN produce 3-4 distinct actionable next-step options the user can choose, terse but evocative. "
-            f"Respond ONLY as strict JSON matching this schema: {{\n"
-            f"  \"story\": string,\n"
-            f"  \"summary50\": string,\n"
-            f"  \"options\": [string, string, string, string]\n"
-            f"}} without any extra text.\n\n"
-            f"User's story continuation: {user_message}"
-        )
+        # Solo continuations may be served from the cache, before any admission wait
+        cache_key = story_cache_key(user_message, events_remaining) if STORY_CACHE_ENABLED and not (lobby_id and user_id) else None
+        cached = cached_story(cache_key) if cache_key else None
+        render = None
+        if cached is not None:
+            story, summary50, options, scene_image = cached
+            audio_url = schedule_narration_audio(story)
+            text_only = False
+        else:
+            with generation_admission.slot('story') as text_only:
+                # Ask Airia agent to return structured JSON: story, 50-word summary, and 3-4 next-step options
+                with stage('prompt_build'):
+                    user_input = build_story_prompt(user_message, events_remaining)
 
-        raw_text = call_airia_agent(user_input)
+                raw_text = call_airia_agent(user_input)
 
-        # Parse JSON with safe fallback
-        import json
-        story = None
-        summary50 = None
-        options = []
-        if raw_text:
-            try:
-                parsed = extract_json_from_text(raw_text)
-                if parsed is None:
-                    raise ValueError('No JSON object could be decoded from model output')
-                story = parsed.get('story')
-                summary50 = parsed.get('summary50')
-                opts = parsed.get('options')
-                if isinstance(opts, list):
-                    options = [str(o) for o in opts if isinstance(o, str)]
-            except Exception as parse_err:
-                print(f"JSON parse failed, falling back to text: {parse_err}")
-                story = raw_text
+                # Parse JSON with safe fallback
+                story, summary50, options = parse_story_response(raw_text)
 
-        if not story:
-            story = "I'm having trouble generating the story right now. Please try again."
-        
-        # Generate scene image from summary (wait for completion)
-        scene_image = None
-        if summary50:
-            print("[Stack-AI] Waiting for image generation to complete...")
-            scene_image = generate_scene_image(summary50, user_id if user_id else "solo_player")
+                generated = bool(story)
+                if not story:
+                    metrics.inc('dungeonforge_story_fallbacks_total', endpoint='story')
+                    story, summary50, options = procedural_event(f"{user_message}:{events_remaining}", events_remaining,
+                                                                 choices=[user_message])
+                
+                # The full scene image renders in the background; skipped under load
+                scene_image = None
+                if summary50 and not text_only:
+                    render = render_scene_image(summary50, user_id if user_id else "solo_player")
+                audio_url = None if text_only else schedule_narration_audio(story)
+            
+            # Only complete generations are cached, once their image lands: no fallbacks, no text-only
+            if cache_key and generated and render is not None:
+                render.add_done_callback(
+                    lambda future: remember_story(cache_key, story, summary50, options, future.result()))
         
         # Calculate remaining events after this one
         new_events_remaining = max(0, events_remaining - 1)
@@ -702,25 +3071,48 @@ def get_story():
                 'content': story,
                 'timestamp': datetime.now().isoformat(),
                 'options': options,
-                'scene_image': scene_image
+                'scene_image': scene_image,
+                'scene_preview': scene_preview(summary50),
+                'audio_url': audio_url
             })
+            lobby_broadcaster.publish(lobby)
+            # The final message's image lands before the campaign is archived
+            attach_scene_render(lobby, len(lobby.story_messages) - 1, render,
+                                then=(lambda: archive_campaign(lobby)) if lobby.story_complete else None)
+            render = None
             
             lobby_data = lobby.to_dict()
         
+        # Solo players fetch the finished render from scene_image_pending
+        scene_image_pending = None
+        if render is not None:
+            render_id = uuid.uuid4().hex[:20]
+            scene_renders.put(render_id, render)
+            scene_image_pending = f'/scene-image/{render_id}'
+        
         return pretty_json({
             'story': story,
             'summary50': summary50,
             'options': options,
             'scene_image': scene_image,
+            'scene_preview': scene_preview(summary50),
+            'scene_image_pending': scene_image_pending,
+            'audio_url': audio_url,
             'eventsRemaining': new_events_remaining,
             'storyComplete': new_events_remaining == 0,
+            'degraded': text_only,
+            'cached': cached is not None,
             'lobby': lobby_data
         })
         
+    except GenerationOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return pretty_json({'error': str(e)}, 500)
 
 @app.route('/lobby/choice', methods=['POST'])
+@idempotent
+@rate_limited(1)  # a round's generation is shared by everyone who voted
 def submit_choice():
     data = request.get_json()
     user_id = data.get('user_id')
@@ -738,247 +3130,682 @@ def submit_choice():
         return pretty_json({'error': 'User not in lobby'}, 400)
     
     # Set user's choice
+    round_number = lobby.current_round
     lobby.set_user_choice(user_id, choice)
+    # The first choice in a parked round restarts its deadline (not while the round generates)
+    if (ROUND_DEADLINE_SECONDS and lobby.round_deadline is None and lobby.status == 'playing'
+            and lobby.generation is None):
+        with lobby.round_lock:
+            if lobby.round_deadline is None and lobby.current_round == round_number and lobby.generation is None:
+                open_round_deadline(lobby)
+    lobby_broadcaster.publish(lobby)
     
     # Check if all users have made choices
     if lobby.all_users_chosen():
         # Generate collaborative story progression
         try:
-            # Create collaborative prompt
-            user_choices = []
-            for uid, user_data in lobby.users.items():
-                user_choices.append(f"{user_data['username']}: {user_data['choice']}")
-            
-            choices_text = "\n".join(user_choices)
-            
-            user_input = (
-                f"You are a Dungeon Master managing a collaborative story with {len(lobby.users)} players. "
-                f"This is event {11 - lobby.events_remaining} of 10 total events. "
-                f"{'This is the FINAL event - conclude the story with a satisfying ending!' if lobby.events_remaining == 1 else f'You have {lobby.events_remaining - 1} events remaining after this one.'} "
-                f"Each player has made their choice. Weave their actions together into a cohesive story continuation. "
-                f"THEN produce a concise 50-word summary of the new scene. "
-                f"THEN produce 3-4 distinct actionable next-step options for the next round. "
-                f"Respond ONLY as strict JSON matching this schema: {{\n"
-                f"  \"story\": string,\n"
-                f"  \"summary50\": string,\n"
-                f"  \"options\": [string, string, string, string]\n"
-                f"}} without any extra text.\n\n"
-                f"Player choices:\n{choices_text}\n\n"
-                f"Previous story context: {lobby.story_messages[-1]['content'] if lobby.story_messages else 'Beginning of story'}"
-            )
-            
-            # Generate story using Airia agent
-            raw_text = call_airia_agent(user_input)
-            
-            # Parse response
-            story = None
-            summary50 = None
-            options = []
-            if raw_text:
-                try:
-                    parsed = extract_json_from_text(raw_text)
-                    if parsed is None:
-                        raise ValueError('No JSON object could be decoded from model output')
-                    story = parsed.get('story')
-                    summary50 = parsed.get('summary50')
-                    opts = parsed.get('options')
-                    if isinstance(opts, list):
-                        options = [str(o) for o in opts if isinstance(o, str)]
-                except Exception as parse_err:
-                    print(f"JSON parse failed, falling back to text: {parse_err}")
-                    story = raw_text
-            
-            if not story:
-                story = "The collaborative story continues with the players' combined actions..."
-            
-            # Update lobby state
-            lobby.events_remaining = max(0, lobby.events_remaining - 1)
-            lobby.story_complete = lobby.events_remaining == 0
-            lobby.current_round += 1
-            
-            # Generate personalized options for next round
-            player_options = {}
-            option_templates = [
-                ["Investigate the mysterious sounds coming from below.", "Search for hidden treasure in the room.", "Attempt to communicate with the spirits.", "Look for secret passages in the walls."],
-                ["Cast a protective spell around the group.", "Use magic to illuminate the dark corners.", "Try to dispel any curses in the area.", "Summon a familiar to scout ahead."],
-                ["Draw your weapon and prepare for combat.", "Use stealth to avoid detection.", "Set up traps for potential enemies.", "Call out to announce your presence."]
-            ]
-            
-            for i, (uid, user_data) in enumerate(lobby.users.items()):
-                template_index = i % len(option_templates)
-                player_options[uid] = {
-                    'username': user_data['username'],
-                    'options': option_templates[template_index]
-                }
-            
-            # Generate scene image from summary (wait for completion)
-            scene_image = None
-            if summary50:
-                print("[Stack-AI] Waiting for image generation to complete...")
-                scene_image = generate_scene_image(summary50, lobby_id)
-            
-            # Add collaborative story message
-            lobby.story_messages.append({
-                'type': 'collaborative',
-                'content': story,
-                'timestamp': datetime.now().isoformat(),
-                'user_choices': {uid: user_data['choice'] for uid, user_data in lobby.users.items()},
-                'summary50': summary50,
-                'player_options': player_options,
-                'scene_image': scene_image
+            generation = advance_lobby_round(lobby, round_number)
+        except GenerationOverloaded as e:
+            # The choice is kept; the round deadline retries generation once capacity frees up
+            response = pretty_json({
+                'success': True,
+                'waiting_for_others': True,
+                'round_deferred': True,
+                'choices_submitted': lobby.choices_made,
+                'total_users': len(lobby.users),
+                'lobby': lobby.to_dict()
             })
-            
-            # Reset choices for next round
-            lobby.reset_choices()
-            
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        except Exception as e:
+            return pretty_json({'error': f'Failed to generate collaborative story: {str(e)}'}, 500)
+        
+        # With AIRIA_ASYNC_OUTPUT the round commits from the execution poller and
+        # reaches every player through the lobby broadcast; answer right away
+        if generation is not None and generation.done():
+            try:
+                message = generation.result()
+            except Exception as e:
+                return pretty_json({'error': f'Failed to generate collaborative story: {str(e)}'}, 500)
             return pretty_json({
                 'success': True,
-                'story': story,
-                'summary50': summary50,
-                'player_options': player_options,
-                'scene_image': scene_image,
+                'story': message['content'],
+                'summary50': message['summary50'],
+                'options': message['options'],
+                'player_options': message['player_options'],
+                'scene_image': message['scene_image'],
+                'scene_preview': message['scene_preview'],
                 'eventsRemaining': lobby.events_remaining,
                 'storyComplete': lobby.story_complete,
                 'lobby': lobby.to_dict()
             })
+    
+    # Not all users have chosen yet, the round is still generating, or another
+    # request already resolved it
+    return pretty_json({
+        'success': True,
+        'waiting_for_others': True,
+        'choices_submitted': lobby.choices_made,
+        'total_users': len(lobby.users),
+        'lobby': lobby.to_dict()
+    })
+
+def advance_lobby_round(lobby, round_number, auto_resolve=False):
+    """
+    Start generating the next collaborative event from the players' choices.
+    Returns a Future of the new story message, already done unless Airia runs in
+    asyncOutput mode, or None if round_number is no longer open, is already
+    generating or someone has not chosen. With auto_resolve (the round deadline
+    passed), idle players take ROUND_DEFAULT_CHOICE instead, unless nobody
+    chose at all: then the round is parked until a choice arrives.
+    """
+    with lobby.round_lock:
+        if (lobby.current_round != round_number or lobby.status != 'playing' or lobby.story_complete
+                or lobby.generation is not None):
+            return None
+        idle_users = [uid for uid, user_data in lobby.users.items() if user_data['choice'] is None]
+        if idle_users and not auto_resolve:
+            return None
+        if not lobby.choices_made:
+            lobby.round_deadline = None
+            round_deadlines.cancel(lobby.id)
+            metrics.inc('dungeonforge_rounds_parked_total')
+            log.info("Round deadline passed with no choices, parked round %s", round_number,
+                     extra={'fields': {'lobby_id': lobby.id}})
+            lobby_broadcaster.publish(lobby)
+            return None
+        for uid in idle_users:
+            lobby.set_user_choice(uid, ROUND_DEFAULT_CHOICE)
+        round_deadlines.cancel(lobby.id)
+        
+        # Create collaborative prompt
+        with stage('prompt_build'):
+            user_input = build_round_prompt(lobby)
+        
+        # Choices as they stood when the round closed, for the message and the fallback
+        choices = {
+            'user_choices': ({uid: user_data['choice'] for uid, user_data in lobby.users.items()}
+                             if len(lobby.users) <= ROUND_PROMPT_VERBATIM_PLAYERS else None),
+            'votes': dict(lobby.vote_counts),
+            'fallback_seed': f"{lobby.id}:{lobby.current_round}:{sorted(lobby.vote_counts.items())}",
+            'ranked': [choice for choice, _ in lobby.vote_counts.most_common()]
+        }
+        
+        # Claim the round, then wait for a slot and Airia without the lock so
+        # players can still change their votes and read the lobby meanwhile
+        generation = lobby.generation = Future()
+        lobby.background.add(generation)
+        lobby_broadcaster.publish(lobby)
+    
+    # The admission slot is held until the round commits, on whichever thread that is
+    admission = ExitStack()
+    try:
+        text_only = admission.enter_context(generation_admission.slot('lobby_round'))
+        # Generate story using Airia agent
+        submitted = time.perf_counter()
+        raw_text = start_airia_agent(user_input)
+    except Exception as e:
+        admission.close()
+        with lobby.round_lock:
+            lobby.generation = None
+            reopen_failed_round(lobby, idle_users, e)
+            lobby_broadcaster.publish(lobby)
+        lobby.background.discard(generation)
+        raise
+    
+    raw_text.add_done_callback(functools.partial(commit_lobby_round, lobby, idle_users, choices, text_only,
+                                                 admission, generation, submitted))
+    return generation
+
+def commit_lobby_round(lobby, idle_users, choices, text_only, admission, generation, submitted, raw_text):
+    """
+    Second half of advance_lobby_round, run when Airia's text arrives: parse it,
+    start the scene render and narration, commit the round and publish it.
+    """
+    # In sync mode this runs on the request thread, so the call also lands in its Server-Timing
+    record_stage('airia_call', time.perf_counter() - submitted)
+    try:
+        with admission:
+            # Parse response
+            story, summary50, options = parse_story_response(raw_text.result())
+            
+            if not story:
+                metrics.inc('dungeonforge_story_fallbacks_total', endpoint='lobby_choice')
+                story, summary50, options = procedural_event(choices['fallback_seed'], lobby.events_remaining,
+                                                             choices=choices['ranked'])
+            
+            # Options for next round, stored once with per-player indexes
+            options, player_options = build_round_options(lobby.users.keys(), options, ROUND_OPTION_TEMPLATES)
             
+            # The full scene image renders in the background; skipped under load
+            render = render_scene_image(summary50, lobby.id) if summary50 and not text_only else None
+            audio_url = None if text_only else schedule_narration_audio(story)
+    except Exception as e:
+        with lobby.round_lock:
+            lobby.generation = None
+            reopen_failed_round(lobby, idle_users, e)
+            lobby_broadcaster.publish(lobby)
+        lobby.background.discard(generation)
+        generation.set_exception(e)
+        return
+    
+    with lobby.round_lock:
+        # Update lobby state
+        lobby.generation = None
+        lobby.events_remaining = max(0, lobby.events_remaining - 1)
+        lobby.story_complete = lobby.events_remaining == 0
+        lobby.current_round += 1
+        
+        # Add collaborative story message
+        message = {
+            'type': 'collaborative',
+            'content': story,
+            'timestamp': datetime.now().isoformat(),
+            # Large lobbies keep the tally rather than one entry per player
+            'user_choices': choices['user_choices'],
+            'votes': choices['votes'],
+            'auto_resolved': idle_users,
+            'summary50': summary50,
+            'options': options,
+            'player_options': player_options,
+            'scene_image': None,
+            'scene_preview': scene_preview(summary50),
+            'audio_url': audio_url
+        }
+        lobby.story_messages.append(message)
+        
+        # Reset choices for next round
+        lobby.reset_choices()
+        open_round_deadline(lobby)
+        lobby_broadcaster.publish(lobby)
+        # The final message's image lands before the campaign is archived
+        attach_scene_render(lobby, len(lobby.story_messages) - 1, render,
+                            then=(lambda: archive_campaign(lobby)) if lobby.story_complete else None)
+    lobby.background.discard(generation)
+    generation.set_result(message)
+
+def reopen_failed_round(lobby, idle_users, error):
+    """
+    Undo a round that failed to generate (call with round_lock held): idle players
+    lose their default choice and the round gets a fresh deadline so it is retried;
+    when turned away for load, as soon as a slot should be free.
+    """
+    for uid in idle_users:
+        lobby.clear_user_choice(uid)
+    open_round_deadline(lobby, delay=error.retry_after if isinstance(error, GenerationOverloaded) else None)
+
+def open_round_deadline(lobby, delay=None):
+    """
+    Start the clock on the lobby's current round (no-op when deadlines are off or
+    the story is over). delay overrides the full deadline, e.g. after a handoff.
+    """
+    if not ROUND_DEADLINE_SECONDS or lobby.story_complete:
+        lobby.round_deadline = None
+        round_deadlines.cancel(lobby.id)
+        return
+    if delay is None:
+        delay = ROUND_DEADLINE_SECONDS
+    lobby_id, round_number = lobby.id, lobby.current_round
+    lobby.round_deadline = time.time() + delay
+    round_deadlines.schedule(lobby_id, delay, lambda: resolve_round_deadline(lobby_id, round_number))
+
+def resolve_round_deadline(lobby_id, round_number):
+    """Deadline callback: resolve a round that players left open too long"""
+    lobby = lobbies.get(lobby_id)
+    if lobby is None:
+        return
+    try:
+        generation = advance_lobby_round(lobby, round_number, auto_resolve=True)
+    except GenerationOverloaded as e:
+        log.warning("No generation capacity for round %s, retrying in %ss", round_number, e.retry_after,
+                    extra={'fields': {'lobby_id': lobby_id}})
+        return
+    except Exception:
+        log.exception("Auto-resolving round %s of lobby %s failed", round_number, lobby_id)
+        return
+    if generation is not None:
+        generation.add_done_callback(functools.partial(log_auto_resolved_round, lobby_id, round_number))
+
+def log_auto_resolved_round(lobby_id, round_number, generation):
+    error = generation.exception()
+    if error is not None:
+        log.error("Auto-resolving round %s of lobby %s failed: %s", round_number, lobby_id, error)
+        return
+    metrics.inc('dungeonforge_rounds_auto_resolved_total')
+    log.info("Round deadline passed, resolved round %s", round_number,
+             extra={'fields': {'lobby_id': lobby_id, 'idle_players': len(generation.result()['auto_resolved'])}})
+
+@app.route('/scene-image/<render_id>', methods=['GET'])
+def get_scene_render(render_id):
+    """Wait for a solo story's background scene render and return its image URL"""
+    render = scene_renders.get(render_id)
+    if render is None:
+        return pretty_json({'error': 'Scene render not found'}, 404)
+    try:
+        with stage('image_generation_wait'):
+            scene_image = render.result(timeout=SCENE_RENDER_WAIT_SECONDS)
+    except FutureTimeoutError:
+        return pretty_json({'error': 'Scene image is still rendering'}, 504)
+    if not scene_image:
+        return pretty_json({'error': 'Scene image could not be generated'}, 502)
+    return pretty_json({'scene_image': scene_image})
+
+@app.route('/images/<name>', methods=['GET'])
+def get_scene_image(name):
+    """Serve a stored scene image, or a downscaled variant with ?w=<width>"""
+    if not IMAGE_NAME_RE.fullmatch(name) or not touch_image(name):
+        return pretty_json({'error': 'Image not found'}, 404)
+    
+    width = request.args.get('w', type=int)
+    if width:
+        if width not in IMAGE_VARIANT_WIDTHS:
+            return pretty_json({'error': f'Unsupported width, use one of {list(IMAGE_VARIANT_WIDTHS)}'}, 400)
+        try:
+            name = image_variant(name, width)
         except Exception as e:
-            return pretty_json({'error': f'Failed to generate collaborative story: {str(e)}'}, 500)
+            images_log.error("Could not resize %s: %s", name, e)
     
-    else:
-        # Not all users have chosen yet
-        return pretty_json({
-            'success': True,
-            'waiting_for_others': True,
-            'choices_submitted': sum(1 for user in lobby.users.values() if user['choice'] is not None),
-            'total_users': len(lobby.users),
-            'lobby': lobby.to_dict()
-        })
+    # Names are content hashes, so a stored file never changes
+    response = send_file(os.path.join(IMAGE_CACHE_DIR, name), conditional=True, etag=name, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/health', methods=['GET'])
 def health():
     return pretty_json({'status': 'ok'})
 
+# Dialogue tokenizer, compiled once. Each alternative is a negated character
+# class, so a scan is linear: an apostrophe only opens a quote when it is not
+# inside a word (the dragon's lair), and single-quoted spans are length-capped
+# so an unmatched opener cannot rescan the rest of the text.
+DIALOGUE_QUOTE_RE = re.compile(
+    r'"([^"]+)"'
+    r'|“([^”]+)”'
+    r"|(?<![\w'])'((?:[^'\n]|'(?=\w)){1,400})'(?!\w)"
+)
+SPEECH_VERBS = r'(?:said|says|asked|asks|replied|replies|shouted|shouts|whispered|whispers|exclaimed|exclaims|growled|growls|roared|roars|hissed|hisses|called|calls|cried|cries|muttered|mutters|snarled|snarls|bellowed|bellows)'
+# Attribution right after a quote: "...," the old knight said / "...," said Mira
+ATTRIBUTION_AFTER_RE = re.compile(
+    r'[ \t]*,?[ \t]*(?:([A-Za-z][\w\' -]{0,40}?)[ \t]+' + SPEECH_VERBS + r'\b|' + SPEECH_VERBS + r'[ \t]+([A-Za-z][\w\' -]{0,40}?))'
+    r'(?:[ \t]+[\w\']+){0,3}?[ \t]*(?=[.,!?;:]|$)'
+)
+# Attribution right before a quote: The dragon roared, "..."
+ATTRIBUTION_BEFORE_RE = re.compile(
+    r'([A-Za-z][\w\' -]{0,40}?)[ \t]+' + SPEECH_VERBS + r'[ \t]*[,:]?[ \t]*$'
+)
+LEAD_IN_RE = re.compile(r'[ \t]*[,:][ \t]*["“\']')
+MONSTER_WORDS = ('monster', 'dragon', 'beast', 'creature', 'demon', 'troll', 'ogre', 'goblin', 'orc', 'wraith')
+SPEAKER_STOPWORDS = {'the', 'a', 'an', 'old', 'young', 'his', 'her', 'their', 'its'}
+CHARACTER_ROLES = ('character1', 'character2', 'character3')
+
+DialogueSegment = namedtuple('DialogueSegment', ['text', 'role', 'voice_id'])
+
+def _normalize_speaker(phrase):
+    """Reduce an attribution phrase to a stable speaker key ('the old knight' -> 'knight')."""
+    words = [w for w in re.findall(r"[\w']+", phrase.lower()) if w not in SPEAKER_STOPWORDS]
+    return words[-1] if words else None
+
 def parse_text_for_dialogue(text):
     """
-    Parse text to identify dialogue and assign voices.
-    Returns list of DialogueInput objects for multivoice synthesis.
+    Split story text into narration and dialogue segments with assigned voices.
+    Returns a list of DialogueSegment(text, role, voice_id) in reading order;
+    adjacent segments sharing a voice are merged so each becomes one synthesis call.
+    Named speakers keep the same character voice for the whole text, in order of
+    first appearance; monsters get the monster voice.
     """
-    dialogue_inputs = []
-    
-    # Pattern to match quoted dialogue with optional speaker attribution
-    # Matches: "text", 'text', or "text," the knight said
-    pattern = r'([^"\']*?)(["\'])([^"\']+)\2(?:\s*[,.]?\s*([^.!?]+(?:said|asked|replied|shouted|whispered|exclaimed)[^.!?]*?))?'
-    
-    last_end = 0
-    matches = list(re.finditer(pattern, text))
+    segments = []
+    speaker_roles = {}
+    last_speaker = None
+    prev_speaker = None
+    last_attributed = False
+    pos = 0
     
-    if not matches:
-        # No dialogue found, use single narrator voice
-        return [DialogueInput(text=text.strip(), voice_id=VOICE_ROLES['narrator'])]
+    def add(segment_text, role):
+        segment_text = segment_text.strip(' \t\r\n,;:')
+        if not any(ch.isalnum() for ch in segment_text):
+            return
+        if segments and segments[-1].role == role:
+            separator = '' if segment_text[0] in '.!?' else ' '
+            merged = segments[-1].text + separator + segment_text
+            segments[-1] = DialogueSegment(merged, role, VOICE_ROLES[role])
+        else:
+            segments.append(DialogueSegment(segment_text, role, VOICE_ROLES[role]))
     
-    character_voice_map = {}
-    character_counter = 1
+    def role_for(speaker):
+        if any(word in speaker for word in MONSTER_WORDS):
+            return 'monster'
+        if speaker not in speaker_roles:
+            speaker_roles[speaker] = CHARACTER_ROLES[len(speaker_roles) % len(CHARACTER_ROLES)]
+        return speaker_roles[speaker]
     
-    for match in matches:
-        narrative_before = match.group(1).strip()
-        dialogue_text = match.group(3).strip()
-        speaker_attr = match.group(4).strip() if match.group(4) else None
-        
-        # Add narrative before dialogue
-        if narrative_before:
-            dialogue_inputs.append(
-                DialogueInput(text=narrative_before, voice_id=VOICE_ROLES['narrator'])
-            )
+    for match in DIALOGUE_QUOTE_RE.finditer(text):
+        narrative_before = text[pos:match.start()]
+        spoken = match.group(1) or match.group(2) or match.group(3)
+        pos = match.end()
         
-        # Determine voice for dialogue
-        voice_id = VOICE_ROLES['narrator']
-        
-        if speaker_attr:
-            # Try to identify speaker from attribution
-            speaker_lower = speaker_attr.lower()
-            
-            # Assign voices based on keywords
-            if any(word in speaker_lower for word in ['monster', 'dragon', 'beast', 'creature', 'demon']):
-                voice_id = VOICE_ROLES['monster']
-            elif speaker_attr not in character_voice_map:
-                # Assign a character voice in rotation
-                voice_key = f'character{((character_counter - 1) % 3) + 1}'
-                character_voice_map[speaker_attr] = VOICE_ROLES[voice_key]
-                character_counter += 1
-                voice_id = character_voice_map[speaker_attr]
-            else:
-                voice_id = character_voice_map[speaker_attr]
+        # Prefer attribution after the quote, then a lead-in just before it
+        speaker = None
+        attribution = None
+        if not spoken.rstrip().endswith('.'):
+            attribution = ATTRIBUTION_AFTER_RE.match(text, pos)
+            # "...!" The dragon roared, "..." introduces the next quote instead
+            if attribution and LEAD_IN_RE.match(text, attribution.end()):
+                attribution = None
+        if attribution:
+            speaker = _normalize_speaker(attribution.group(1) or attribution.group(2))
         else:
-            # No speaker attribution, alternate between character voices
-            voice_key = f'character{((len(dialogue_inputs) % 3) + 1)}'
-            voice_id = VOICE_ROLES[voice_key]
+            lead_in = ATTRIBUTION_BEFORE_RE.search(narrative_before[-80:])
+            if lead_in:
+                speaker = _normalize_speaker(lead_in.group(1))
         
-        # Add dialogue with assigned voice
-        dialogue_inputs.append(
-            DialogueInput(text=dialogue_text, voice_id=voice_id)
-        )
+        if speaker is None and last_speaker and not any(ch.isalnum() for ch in narrative_before):
+            # Back-to-back quotes: the same speaker continues after an attribution,
+            # otherwise it is a reply and alternates with the previous speaker
+            if last_attributed:
+                speaker = last_speaker
+            elif prev_speaker and prev_speaker != last_speaker:
+                speaker = prev_speaker
+            else:
+                speaker = '#other-' + last_speaker
+        if speaker is None:
+            speaker = '#unnamed'
         
-        last_end = match.end()
+        add(narrative_before, 'narrator')
+        add(spoken, role_for(speaker))
+        if attribution:
+            add(attribution.group(0), 'narrator')
+            pos = attribution.end()
+        if speaker != last_speaker:
+            prev_speaker, last_speaker = last_speaker, speaker
+        last_attributed = attribution is not None
     
-    # Add any remaining narrative after last dialogue
-    remaining = text[last_end:].strip()
-    if remaining:
-        dialogue_inputs.append(
-            DialogueInput(text=remaining, voice_id=VOICE_ROLES['narrator'])
-        )
+    add(text[pos:], 'narrator')
+    return segments
+
+def strip_id3(audio_bytes):
+    """Drop a leading ID3v2 tag so MP3 segments concatenate into one clean stream"""
+    if len(audio_bytes) >= 10 and audio_bytes[:3] == b'ID3':
+        size = (audio_bytes[6] << 21) | (audio_bytes[7] << 14) | (audio_bytes[8] << 7) | audio_bytes[9]
+        return audio_bytes[10 + size:]
+    return audio_bytes
+
+def speech_segments(text, tier=TTS_DEFAULT_TIER):
+    """
+    Segments to voice text with at a tier. MP3 tiers get a voice per speaker,
+    since MP3 frames concatenate; each Opus segment would be a complete Ogg
+    stream, and chained streams stop many players after the first, so the Opus
+    tier is a single narrator segment.
+    """
+    if TTS_TIERS[tier][1] == 'audio/mpeg':
+        return parse_text_for_dialogue(text)
+    text = text.strip()
+    return [DialogueSegment(text, 'narrator', VOICE_ROLES['narrator'])] if any(ch.isalnum() for ch in text) else []
+
+def synthesize_segment(segment, tier=TTS_DEFAULT_TIER):
+    """Synthesize one DialogueSegment with its voice at a quality tier and return the audio bytes, using the segment cache"""
+    output_format = TTS_TIERS[tier][0]
+    cache_key = (segment.voice_id, TTS_MODEL_ID, output_format, segment.text)
+    audio_bytes = tts_segment_cache.get(cache_key)
+    if audio_bytes is not None:
+        return audio_bytes
     
-    return dialogue_inputs
+    start = time.perf_counter()
+    try:
+        audio_generator = get_elevenlabs_client().text_to_speech.convert(
+            text=segment.text,
+            voice_id=segment.voice_id,
+            model_id=TTS_MODEL_ID,
+            output_format=output_format,
+        )
+        audio_bytes = strip_id3(b''.join(chunk for chunk in audio_generator if chunk))
+    except Exception:
+        record_upstream('elevenlabs', start, False)
+        raise
+    record_upstream('elevenlabs', start, True)
+    tts_segment_cache.put(cache_key, audio_bytes, len(audio_bytes))
+    return audio_bytes
+
+def synthesize_segments_parallel(segments, tier=TTS_DEFAULT_TIER):
+    """
+    Submit every segment to the TTS pool and return futures in reading order.
+    Identical segments within one text share a single synthesis.
+    """
+    futures_by_key = {}
+    ordered = []
+    for segment in segments:
+        key = (segment.voice_id, segment.text)
+        if key not in futures_by_key:
+            futures_by_key[key] = tts_executor.submit(synthesize_segment, segment, tier)
+        ordered.append(futures_by_key[key])
+    return ordered
+
+def stream_segment_audio(first_chunk, futures):
+    """Yield segment audio in order, each as soon as it and everything before it is ready"""
+    yield first_chunk
+    for future in futures:
+        try:
+            yield future.result()
+        except Exception as e:
+            # Headers are already sent; skip the failed segment rather than cut the stream
+            tts_log.error("Error generating speech segment: %s", e)
+
+def narration_audio_id(text, tier=TTS_DEFAULT_TIER):
+    """Stable id for a narration's audio, tied to the text and output settings"""
+    key = f"{TTS_MODEL_ID}|{TTS_TIERS[tier][0]}|{text}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+def consume_presynth_budget(chars):
+    """Reserve characters from the speculative synthesis budget; False once the window is spent"""
+    with narration_jobs_lock:
+        now = time.time()
+        if now - presynth_budget['window_start'] >= TTS_PRESYNTH_BUDGET_WINDOW:
+            presynth_budget['window_start'] = now
+            presynth_budget['chars_used'] = 0
+        if presynth_budget['chars_used'] + chars > TTS_PRESYNTH_CHAR_BUDGET:
+            return False
+        presynth_budget['chars_used'] += chars
+        return True
+
+def synthesize_narration(audio_id, text):
+    """Synthesize a whole narration into the audio cache; runs on narration_executor"""
+    try:
+        futures = synthesize_segments_parallel(speech_segments(text))
+        audio_bytes = b''.join(future.result() for future in futures)
+        narration_audio_cache.put(audio_id, audio_bytes, len(audio_bytes))
+        return audio_bytes
+    finally:
+        with narration_jobs_lock:
+            narration_jobs.pop(audio_id, None)
+
+def schedule_narration_audio(text):
+    """
+    Start background TTS for a newly committed story and return the URL it will be
+    served from, or None when pre-synthesis is off, unconfigured or over budget.
+    """
+    if not TTS_PRESYNTH_ENABLED or not ELEVENLABS_API_KEY or not text:
+        return None
+    audio_id = narration_audio_id(text)
+    audio_url = f'/audio/{audio_id}'
+    if narration_audio_cache.get(audio_id) is not None:
+        return audio_url
+    with narration_jobs_lock:
+        if audio_id in narration_jobs:
+            return audio_url
+    if not consume_presynth_budget(len(text)):
+        tts_log.info("Pre-synthesis budget spent, skipping %s chars", len(text))
+        return None
+    with narration_jobs_lock:
+        if audio_id not in narration_jobs:
+            narration_jobs[audio_id] = narration_executor.submit(synthesize_narration, audio_id, text)
+    return audio_url
+
+def get_narration_audio(audio_id):
+    """Return cached or in-flight narration audio bytes, or None if it was never made or got evicted"""
+    audio_bytes = narration_audio_cache.get(audio_id)
+    if audio_bytes is not None:
+        return audio_bytes
+    with narration_jobs_lock:
+        job = narration_jobs.get(audio_id)
+    if job is None:
+        # The job may have finished between the two lookups
+        return narration_audio_cache.get(audio_id)
+    return job.result(timeout=120)
+
+def negotiate_tts_tier(data=None):
+    """
+    Quality tier for this request: an explicit ?quality= (or JSON "quality"), then
+    Accept preferring Ogg/Opus, then the Save-Data and ECT client hints. None if
+    the explicit tier is unknown.
+    """
+    requested = request.args.get('quality') or (data or {}).get('quality')
+    if requested:
+        return requested if requested in TTS_TIERS else None
+    if request.accept_mimetypes.best_match(['audio/mpeg', 'audio/ogg', 'audio/opus']) in ('audio/ogg', 'audio/opus'):
+        return 'opus'
+    effective_type = request.headers.get('ECT', '').lower()
+    if request.headers.get('Save-Data', '').lower() == 'on' or effective_type in ('slow-2g', '2g'):
+        return 'low'
+    if effective_type == '3g':
+        return 'standard'
+    return TTS_DEFAULT_TIER
+
+def metered_audio(chunks, tier, start):
+    """Yield audio chunks, recording time to first byte and bytes sent per tier"""
+    sent = 0
+    try:
+        for chunk in chunks:
+            if not sent:
+                metrics.observe('dungeonforge_tts_first_byte_seconds', time.perf_counter() - start, tier=tier)
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.inc('dungeonforge_tts_responses_total', tier=tier)
+        metrics.inc('dungeonforge_tts_bytes_total', sent, tier=tier)
+
+def audio_response(chunks, tier, start, headers=None):
+    """Metered audio Response labelled with its tier's Content-Type"""
+    mimetype = TTS_TIERS[tier][1]
+    return Response(
+        metered_audio(chunks, tier, start),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f"inline; filename=speech.{'ogg' if mimetype == 'audio/ogg' else 'mp3'}",
+            'Content-Type': mimetype,
+            'X-Audio-Quality': tier,
+            'Vary': 'Accept, Save-Data, ECT',
+            **(headers or {}),
+        }
+    )
+
+def unknown_tier_response():
+    return pretty_json({'error': f"Unknown quality; expected one of: {', '.join(TTS_TIERS)}"}, 400)
+
+@app.route('/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """
+    Serve pre-synthesized narration audio. Only the default tier is pre-synthesized,
+    so another tier is a 404 and the client synthesizes the text at that tier.
+    """
+    start = time.perf_counter()
+    tier = negotiate_tts_tier()
+    if tier is None:
+        return unknown_tier_response()
+    if tier != TTS_DEFAULT_TIER:
+        return pretty_json({'error': 'Audio not found at this quality'}, 404)
+    try:
+        audio_bytes = get_narration_audio(audio_id)
+    except Exception as e:
+        tts_log.error("Error generating narration audio: %s", e)
+        return pretty_json({'error': f'Failed to generate speech: {str(e)}'}, 500)
+    if audio_bytes is None:
+        return pretty_json({'error': 'Audio not found'}, 404)
+    return audio_response([audio_bytes], tier, start, {'Cache-Control': 'public, max-age=86400'})
 
 @app.route('/text-to-speech', methods=['POST'])
+@rate_limited(tts_cost)
 def text_to_speech():
-    """Generate speech audio from text using ElevenLabs multivoice API"""
-    if not elevenlabs_client:
+    """Generate speech audio from text using ElevenLabs, one voice per dialogue segment"""
+    start = time.perf_counter()
+    if not get_elevenlabs_client():
         return pretty_json({'error': 'ElevenLabs API key not configured. Add ELEVENLABS_API_KEY to backend/.env'}, 500)
     
     data = request.get_json()
     text = data.get('text', '')
+    tier = negotiate_tts_tier(data)
     
     if not text:
         return pretty_json({'error': 'Text is required'}, 400)
+    if tier is None:
+        return unknown_tier_response()
     
+    # Narration that was pre-synthesized when its round was committed
     try:
-        # Parse text and create dialogue inputs with multiple voices
-        dialogue_inputs = parse_text_for_dialogue(text)
-        
-        # Generate audio using ElevenLabs
-        # Note: text-to-dialogue requires v3 models, so we'll use single voice with turbo model
-        # For now, use single narrator voice for simplicity and speed
-        audio_generator = elevenlabs_client.text_to_speech.convert(
-            text=text,
-            voice_id=VOICE_ROLES['narrator'],
-            model_id="eleven_turbo_v2_5",
-            output_format="mp3_44100_128",
-        )
+        audio_bytes = get_narration_audio(narration_audio_id(text, tier))
+    except Exception:
+        audio_bytes = None
+    if audio_bytes is not None:
+        return audio_response([audio_bytes], tier, start)
+    
+    # Split into narrator/character segments and voice them in parallel
+    segments = speech_segments(text, tier)
+    if not segments:
+        return pretty_json({'error': 'Text has nothing to speak'}, 400)
+    
+    futures = synthesize_segments_parallel(segments, tier)
+    try:
+        # Wait for the first segment so a failed upstream still yields a proper error;
+        # the rest streams in order as it completes
+        with stage('tts'):
+            first_chunk = futures[0].result()
         
-        # Collect the audio stream into bytes
-        audio_bytes = b''
-        for chunk in audio_generator:
-            if chunk:
-                audio_bytes += chunk
-        
-        # Return audio as response
-        return Response(
-            audio_bytes,
-            mimetype='audio/mpeg',
-            headers={
-                'Content-Disposition': 'inline; filename=speech.mp3',
-                'Content-Type': 'audio/mpeg'
-            }
-        )
+        return audio_response(stream_segment_audio(first_chunk, futures[1:]), tier, start)
         
     except Exception as e:
-        print(f"Error generating speech: {e}")
-        import traceback
-        traceback.print_exc()
+        tts_log.exception("Error generating speech: %s", e)
+        for future in futures:
+            future.cancel()
         return pretty_json({'error': f'Failed to generate speech: {str(e)}'}, 500)
 
+def origin_of(url):
+    """scheme://host[:port] of a URL, the unit connection pools are keyed by"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+def warm_up(port, timeout=30):
+    """
+    Wait until this server answers /health, then import the ElevenLabs SDK and
+    open kept-alive connections to each configured upstream so the first
+    player request skips the import, DNS and TLS handshakes.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/health', timeout=1).ok:
+                break
+        except requests.RequestException:
+            time.sleep(0.05)
+    else:
+        log.warning("Warm-up gave up waiting for /health after %ss", timeout)
+        return
+    
+    start = time.perf_counter()
+    client = get_elevenlabs_client()
+    targets = [(upstream_session, url) for url in (AIRIA_PIPELINE_URL, STACK_AI_API_URL) if url]
+    if client:
+        targets.append((elevenlabs_http, ELEVENLABS_BASE_URL or 'https://api.elevenlabs.io'))
+    for session, url in targets:
+        try:
+            # Any status will do; the point is the pooled connection left behind
+            session.head(origin_of(url), timeout=5)
+        except Exception as e:
+            log.info("Warm-up could not reach %s: %s", origin_of(url), e)
+    log.info("Warm-up finished in %.0f ms", (time.perf_counter() - start) * 1000,
+             extra={'fields': {'upstreams': len(targets)}})
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8001))
     debug = os.getenv('FLASK_ENV') == 'development'
+    # With the reloader, only the child process that serves requests warms up
+    if WARMUP_ON_START and (not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        threading.Thread(target=warm_up, args=(port,), name='warm-up', daemon=True).start()
     app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
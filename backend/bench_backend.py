@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+Offline load benchmark for the backend.
+Starts the mock upstreams from mock_upstreams.py, serves app.py in-process on
+a local port, and drives scripted lobby lifecycles concurrently: create, join,
+ready, start, N choice rounds with scene image downloads and narration TTS, and
+background lobby polling like the frontend does. Reports p50/p95/p99 latency,
+throughput, response size and allocated memory per endpoint.
+
+Usage:
+    python bench_backend.py --profile fast --lobbies 40 --concurrency 8
+    python bench_backend.py --profile realistic --latency-scale 0.05 --json out.json
+    python bench_backend.py --baseline out.json --max-regression 0.25
+    python bench_backend.py --cassette run.ndjson.gz   # records on the first run, replays after
+    python bench_backend.py --airia-async              # rounds commit from the asyncOutput poller
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mock_upstreams import MockUpstreams, PROFILES
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Recorder:
+    """Collects (endpoint, latency, status, bytes) for every request the clients make"""
+
+    def __init__(self):
+        self.samples = {}  # {endpoint: [(seconds, status, size)]}
+        self.lock = threading.Lock()
+
+    def request(self, session, method, endpoint, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=300, **kwargs)
+            size = len(response.content)
+            status = response.status_code
+        except requests.RequestException:
+            response, size, status = None, 0, 0
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append((elapsed, status, size))
+        return response
+
+
+class MemoryProbe:
+    """
+    WSGI middleware measuring peak traced allocation per request.
+    Only meaningful when requests run one at a time, so it is enabled for the
+    serial memory pass after the load phase.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.enabled = False
+        self.samples = {}  # {endpoint: [peak_bytes]}
+
+    def __call__(self, environ, start_response):
+        if not self.enabled:
+            return self.wsgi_app(environ, start_response)
+        endpoint = f"{environ['REQUEST_METHOD']} {environ.get('HTTP_X_BENCH_ENDPOINT', environ['PATH_INFO'])}"
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        iterable = self.wsgi_app(environ, start_response)
+        try:
+            body = b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        self.samples.setdefault(endpoint, []).append(peak)
+        return [body]
+
+
+def run_lifecycle(base, recorder, args, headers=None):
+    """One lobby from creation to leaving, with every player polling in the background"""
+    headers = headers or {}
+    host = requests.Session()
+    response = recorder.request(host, 'POST', 'POST /lobby/create', f'{base}/lobby/create',
+                                json={'username': 'Host'}, headers={**headers, 'X-Bench-Endpoint': '/lobby/create'})
+    if response is None or response.status_code != 200:
+        return False
+    data = response.json()
+    lobby_id = data['lobby_id']
+    players = [(host, data['user_id'])]
+
+    for i in range(1, args.players):
+        session = requests.Session()
+        response = recorder.request(session, 'POST', 'POST /lobby/join', f'{base}/lobby/join',
+                                    json={'lobby_id': lobby_id, 'username': f'Player{i}'},
+                                    headers={**headers, 'X-Bench-Endpoint': '/lobby/join'})
+        if response is not None and response.status_code == 200:
+            players.append((session, response.json()['user_id']))
+
+    stop_polling = threading.Event()
+
+    def poll(session):
+        while not stop_polling.wait(args.poll_interval):
+            recorder.request(session, 'GET', 'GET /lobby/<id>', f'{base}/lobby/{lobby_id}',
+                             headers={**headers, 'X-Bench-Endpoint': '/lobby/<id>'})
+
+    pollers = []
+    if args.poll_interval > 0:
+        for session, _ in players:
+            poller = threading.Thread(target=poll, args=(requests.Session(),), daemon=True)
+            poller.start()
+            pollers.append(poller)
+
+    try:
+        for session, user_id in players:
+            recorder.request(session, 'POST', 'POST /lobby/ready', f'{base}/lobby/ready',
+                             json={'lobby_id': lobby_id, 'user_id': user_id, 'ready': True},
+                             headers={**headers, 'X-Bench-Endpoint': '/lobby/ready'})
+        response = recorder.request(host, 'POST', 'POST /lobby/start', f'{base}/lobby/start',
+                                    json={'lobby_id': lobby_id, 'user_id': players[0][1]},
+                                    headers={**headers, 'X-Bench-Endpoint': '/lobby/start'})
+        if response is None or response.status_code != 200:
+            return False
+        round_data = response.json()
+
+        for _ in range(args.rounds):
+            consume_round_media(base, recorder, players, round_data, args, headers)
+            for session, user_id in players:
+                options = round_data.get('options') or ['Press onward.']
+                indexes = (round_data.get('player_options') or {}).get(user_id) or [0]
+                response = recorder.request(session, 'POST', 'POST /lobby/choice', f'{base}/lobby/choice',
+                                            json={'lobby_id': lobby_id, 'user_id': user_id,
+                                                  'choice': options[indexes[0] % len(options)]},
+                                            headers={**headers, 'X-Bench-Endpoint': '/lobby/choice'})
+            if response is None or response.status_code != 200:
+                return False
+            round_data = response.json()
+            if round_data.get('waiting_for_others'):
+                round_data = await_round(base, recorder, host, round_data, headers)
+                if round_data is None:
+                    return False
+            if round_data.get('storyComplete'):
+                break
+        return True
+    finally:
+        stop_polling.set()
+        for poller in pollers:
+            poller.join()
+        for session, user_id in players:
+            recorder.request(session, 'POST', 'POST /lobby/leave', f'{base}/lobby/leave',
+                             json={'lobby_id': lobby_id, 'user_id': user_id},
+                             headers={**headers, 'X-Bench-Endpoint': '/lobby/leave'})
+
+
+def await_round(base, recorder, session, round_data, headers, timeout=60):
+    """
+    The next round as a /lobby/choice response would carry it, long-polling the
+    lobby until it commits (asyncOutput rounds answer the last choice at once)
+    """
+    lobby = round_data['lobby']
+    round_number = lobby['current_round']
+    version = lobby['version']
+    deadline = time.monotonic() + timeout
+    while lobby['current_round'] == round_number:
+        if time.monotonic() > deadline:
+            return None
+        response = recorder.request(session, 'GET', 'GET /lobby/<id> wait', f"{base}/lobby/{lobby['id']}?since={version}&wait={timeout}",
+                                    headers={**headers, 'X-Bench-Endpoint': '/lobby/<id>'})
+        if response is None or response.status_code not in (200, 304):
+            return None
+        if response.status_code == 200:
+            lobby = response.json()['lobby']
+            version = lobby['version']
+    message = lobby['story_messages'][-1]
+    return {'story': message['content'], 'options': message['options'], 'player_options': message['player_options'],
+            'scene_image': message['scene_image'], 'storyComplete': lobby['story_complete'], 'lobby': lobby}
+
+
+def await_scene_image(base, recorder, session, round_data, headers, timeout=10):
+    """The round's scene image: from the response, or from the lobby patch that swaps it in for the preview"""
+    lobby = round_data.get('lobby')
+    if round_data.get('scene_image') or not lobby:
+        return round_data.get('scene_image')
+    index = len(lobby['story_messages']) - 1
+    version = lobby['version']
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = recorder.request(session, 'GET', 'GET /lobby/<id> patch',
+                                    f"{base}/lobby/{lobby['id']}?since={version}&wait={timeout}&patch=1",
+                                    headers={**headers, 'X-Bench-Endpoint': '/lobby/<id>'})
+        if response is None or response.status_code not in (200, 304):
+            return None
+        if response.status_code == 304:
+            continue
+        data = response.json()
+        if 'scene_images' in data:
+            scene_image = data['scene_images'].get(str(index))
+            version = data['version']
+        else:
+            scene_image = data['lobby']['story_messages'][index].get('scene_image')
+            version = data['lobby']['version']
+        if scene_image:
+            return scene_image
+    return None
+
+
+def consume_round_media(base, recorder, players, round_data, args, headers):
+    """Every player loads the scene image once it is rendered; one player listens to the narration"""
+    scene_image = await_scene_image(base, recorder, players[0][0], round_data, headers)
+    if scene_image and scene_image.startswith('/'):
+        for session, _ in players:
+            recorder.request(session, 'GET', 'GET /images/<name>', f'{base}{scene_image}',
+                             headers={**headers, 'X-Bench-Endpoint': '/images/<name>'})
+    story = round_data.get('story')
+    if story and args.tts:
+        session = players[0][0]
+        recorder.request(session, 'POST', 'POST /text-to-speech', f'{base}/text-to-speech',
+                         json={'text': story}, headers={**headers, 'X-Bench-Endpoint': '/text-to-speech'})
+
+
+def run_solo(base, recorder, args):
+    session = requests.Session()
+    for events_remaining in range(10, 10 - args.rounds, -1):
+        recorder.request(session, 'POST', 'POST /story', f'{base}/story',
+                         json={'message': 'I open the door.', 'eventsRemaining': events_remaining},
+                         headers={'X-Bench-Endpoint': '/story'})
+    return True
+
+
+def summarize(recorder, probe, wall_seconds):
+    report = {}
+    for endpoint, samples in sorted(recorder.samples.items()):
+        latencies = sorted(s[0] for s in samples)
+        errors = sum(1 for s in samples if s[1] == 0 or s[1] >= 500)
+        allocations = probe.samples.get(endpoint, [])
+        report[endpoint] = {
+            'count': len(samples),
+            'errors': errors,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'throughput_rps': len(samples) / wall_seconds if wall_seconds else 0.0,
+            'avg_bytes': sum(s[2] for s in samples) / len(samples),
+            'alloc_peak_kib': (sum(allocations) / len(allocations) / 1024) if allocations else None,
+        }
+    return report
+
+
+def print_report(report, totals):
+    print("=" * 118)
+    print(f"{'endpoint':<24}{'count':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'req/s':>9}{'avg KiB':>10}{'alloc KiB':>11}")
+    print("-" * 118)
+    for endpoint, row in report.items():
+        alloc = f"{row['alloc_peak_kib']:.1f}" if row['alloc_peak_kib'] is not None else '-'
+        print(f"{endpoint:<24}{row['count']:>7}{row['errors']:>5}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['throughput_rps']:>9.2f}{row['avg_bytes'] / 1024:>10.1f}{alloc:>11}")
+    print("-" * 118)
+    for key, value in totals.items():
+        print(f"{key}: {value}")
+    print("=" * 118)
+
+
+def compare_to_baseline(report, baseline_path, max_regression):
+    """Return endpoints whose p95 grew by more than max_regression (a fraction) over the baseline"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['endpoints']
+    regressions = []
+    for endpoint, row in report.items():
+        old = baseline.get(endpoint)
+        if not old or old['p95_ms'] <= 0:
+            continue
+        change = (row['p95_ms'] - old['p95_ms']) / old['p95_ms']
+        if change > max_regression:
+            regressions.append((endpoint, old['p95_ms'], row['p95_ms'], change))
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='fast')
+    parser.add_argument('--latency-scale', type=float, default=1.0)
+    parser.add_argument('--lobbies', type=int, default=20, help='lobby lifecycles to run')
+    parser.add_argument('--concurrency', type=int, default=5, help='lobbies in flight at once')
+    parser.add_argument('--players', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=3, help='choice rounds per lobby')
+    parser.add_argument('--solo', type=int, default=0, help='solo /story sessions to run alongside')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help='seconds between lobby polls, 0 to disable')
+    parser.add_argument('--no-tts', dest='tts', action='store_false')
+    parser.add_argument('--no-memory-pass', dest='memory_pass', action='store_false')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline', help='report from an earlier run to compare p95 against')
+    parser.add_argument('--max-regression', type=float, default=0.25)
+    parser.add_argument('--cassette', help='upstream cassette: recorded if the file is missing, replayed otherwise')
+    parser.add_argument('--replay-speed', type=float, default=1.0, help='replay timing scale, 0 for instant')
+    parser.add_argument('--story-engine', choices=['airia', 'procedural'], default='airia',
+                        help='procedural tells stories in-process, taking Airia out of the measurement')
+    parser.add_argument('--airia-async', action='store_true',
+                        help='run Airia in asyncOutput mode: rounds commit from the shared poller')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    mocks = MockUpstreams(args.profile, args.latency_scale).start()
+    os.environ.update(mocks.env())
+    os.environ.setdefault('IMAGE_CACHE_DIR', tempfile.mkdtemp(prefix='bench-images-'))
+    # Every simulated client shares one loopback address, so only the per-user and per-lobby limits apply
+    os.environ.setdefault('RATE_LIMIT_IP_PER_MINUTE', '0')
+    replaying = bool(args.cassette) and os.path.exists(args.cassette)
+    if args.cassette:
+        # Replays never reach the mocks, so A/B runs see byte-identical upstream answers and timing
+        os.environ['UPSTREAM_CASSETTE'] = args.cassette
+        os.environ['UPSTREAM_CASSETTE_MODE'] = 'replay' if replaying else 'record'
+        os.environ['UPSTREAM_REPLAY_SPEED'] = str(args.replay_speed)
+    os.environ['STORY_ENGINE'] = args.story_engine
+    if args.airia_async:
+        os.environ['AIRIA_ASYNC_OUTPUT'] = 'true'
+
+    # Configuration is read at import time, so import only after the env points at the mocks
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    probe = MemoryProbe(backend.app.wsgi_app)
+    backend.app.wsgi_app = probe
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    if replaying:
+        print(f"Benchmarking {base} replaying {args.cassette} (timing x{args.replay_speed})")
+    else:
+        print(f"Benchmarking {base} against mock upstreams (profile '{args.profile}', latency x{args.latency_scale})"
+              + (f", recording to {args.cassette}" if args.cassette else ''))
+    print(f"{args.lobbies} lobbies x {args.players} players x {args.rounds} rounds, concurrency {args.concurrency}, "
+          f"{args.solo} solo sessions")
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        jobs = [pool.submit(run_lifecycle, base, recorder, args) for _ in range(args.lobbies)]
+        jobs += [pool.submit(run_solo, base, recorder, args) for _ in range(args.solo)]
+        completed = sum(1 for job in jobs if job.result())
+    wall_seconds = time.perf_counter() - start
+    rss_after_load = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if args.memory_pass:
+        # One more lifecycle, serially, so each request's allocations can be attributed
+        tracemalloc.start()
+        probe.enabled = True
+        memory_args = argparse.Namespace(**{**vars(args), 'poll_interval': 0})
+        run_lifecycle(base, Recorder(), memory_args)
+        if args.solo:
+            run_solo(base, Recorder(), memory_args)
+        probe.enabled = False
+        tracemalloc.stop()
+
+    report = summarize(recorder, probe, wall_seconds)
+    totals = {
+        'completed lifecycles': f"{completed}/{len(jobs)}",
+        'wall time': f"{wall_seconds:.2f}s",
+        'total requests': sum(row['count'] for row in report.values()),
+        'overall throughput': f"{sum(row['count'] for row in report.values()) / wall_seconds:.2f} req/s",
+        'peak RSS (harness + server)': f"{rss_after_load / 1024:.1f} MiB",
+        'lobbies left in memory': len(backend.lobbies),
+        'upstream calls': mocks.counts,
+    }
+    print_report(report, totals)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'totals': {k: str(v) for k, v in totals.items()}, 'endpoints': report}, f, indent=2)
+        print(f"Report written to {args.json}")
+
+    server.shutdown()
+    mocks.stop()
+
+    if args.baseline:
+        regressions = compare_to_baseline(report, args.baseline, args.max_regression)
+        for endpoint, old, new, change in regressions:
+            print(f"REGRESSION {endpoint}: p95 {old:.1f}ms -> {new:.1f}ms (+{change * 100:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"No p95 regression over {args.max_regression * 100:.0f}% against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Fan-out check for large lobbies.
+Serves app.py in-process against the mock upstreams, fills one lobby with
+players, attaches hundreds of spectators that long-poll /lobby/<id>, then
+plays rounds with every player voting. Verifies each subscriber receives
+every committed round and reports delivery lag after each round commits,
+how many reads were served and how many times the lobby was encoded.
+Exits non-zero if any subscriber misses a round or errors.
+
+Usage: python bench_broadcast.py [--players 40] [--spectators 500] [--rounds 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mock_upstreams import MockUpstreams, PROFILES
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Subscriber(threading.Thread):
+    """One spectator long-polling the lobby, recording when each round first arrives"""
+
+    def __init__(self, base, lobby_id, username, stop):
+        super().__init__(daemon=True)
+        self.base = base
+        self.lobby_id = lobby_id
+        self.username = username
+        self.stop = stop
+        self.session = requests.Session()
+        self.round_seen_at = {}  # {round: perf_counter time}
+        self.reads = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.ready = threading.Event()
+
+    def run(self):
+        response = self.session.post(f'{self.base}/lobby/spectate',
+                                     json={'lobby_id': self.lobby_id, 'username': self.username})
+        if response.status_code != 200:
+            self.errors += 1
+            self.ready.set()
+            return
+        version = response.json()['lobby']['version']
+        self.ready.set()
+        while not self.stop.is_set():
+            try:
+                response = self.session.get(f'{self.base}/lobby/{self.lobby_id}',
+                                            params={'since': version, 'wait': 5}, timeout=30)
+            except requests.RequestException:
+                self.errors += 1
+                continue
+            if response.status_code == 304:
+                self.not_modified += 1
+                continue
+            if response.status_code != 200:
+                self.errors += 1
+                break
+            self.reads += 1
+            lobby = response.json()['lobby']
+            version = lobby['version']
+            self.round_seen_at.setdefault(lobby['current_round'], time.perf_counter())
+
+
+def fill_lobby(base, args):
+    """Create the lobby and join every player; returns (lobby_id, player ids)"""
+    session = requests.Session()
+    host = session.post(f'{base}/lobby/create', json={'username': 'host', 'max_players': args.players}).json()
+    lobby_id = host['lobby_id']
+    players = [host['user_id']]
+    for index in range(1, args.players):
+        joined = session.post(f'{base}/lobby/join', json={'lobby_id': lobby_id, 'username': f'player{index}'})
+        players.append(joined.json()['user_id'])
+    return lobby_id, players
+
+
+def run_rounds(base, lobby_id, players, args):
+    """Start the lobby and play rounds with every player voting; returns {round: commit time}"""
+    commits = {}
+    with ThreadPoolExecutor(max_workers=min(32, len(players))) as pool:
+        list(pool.map(lambda uid: requests.post(f'{base}/lobby/ready',
+                                                json={'lobby_id': lobby_id, 'user_id': uid, 'ready': True}), players))
+        started = requests.post(f'{base}/lobby/start', json={'lobby_id': lobby_id, 'user_id': players[0]})
+        commits[1] = time.perf_counter()
+        if started.status_code != 200:
+            raise RuntimeError(f"start failed: {started.text}")
+        for round_number in range(1, args.rounds + 1):
+            lobby = requests.get(f'{base}/lobby/{lobby_id}').json()['lobby']
+            message = lobby['story_messages'][-1]
+            options = message['options']
+
+            def vote(indexed):
+                index, uid = indexed
+                # Skew votes toward the first options like a real crowd
+                choice = options[min(index % 7, len(options) - 1)]
+                return requests.post(f'{base}/lobby/choice', json={'lobby_id': lobby_id, 'user_id': uid, 'choice': choice})
+
+            results = list(pool.map(vote, enumerate(players)))
+            commits[round_number + 1] = time.perf_counter()
+            if not any('story' in result.json() for result in results):
+                raise RuntimeError(f"round {round_number} did not advance")
+    return commits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='fast')
+    parser.add_argument('--latency-scale', type=float, default=1.0)
+    parser.add_argument('--players', type=int, default=40)
+    parser.add_argument('--spectators', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    mocks = MockUpstreams(args.profile, args.latency_scale).start()
+    os.environ.update(mocks.env())
+    os.environ.setdefault('IMAGE_CACHE_DIR', tempfile.mkdtemp(prefix='bench-images-'))
+    # Every simulated client shares one loopback address, so only the per-user and per-lobby limits apply
+    os.environ.setdefault('RATE_LIMIT_IP_PER_MINUTE', '0')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['LOBBY_MAX_PLAYERS'] = str(max(args.players, 64))
+
+    # Configuration is read at import time, so import only after the env points at the mocks
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep each subscriber on one connection
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True, request_handler=QuietHandler)
+    server.socket.listen(args.spectators + 64)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    print(f"Broadcast check: {args.players} players, {args.spectators} spectators, {args.rounds} rounds at {base}")
+    lobby_id, players = fill_lobby(base, args)
+
+    stop = threading.Event()
+    subscribers = [Subscriber(base, lobby_id, f'spectator{index}', stop) for index in range(args.spectators)]
+    for subscriber in subscribers:
+        subscriber.start()
+    for subscriber in subscribers:
+        subscriber.ready.wait(30)
+    encodes_before = backend.lobby_broadcaster.encodes
+
+    start = time.perf_counter()
+    commits = run_rounds(base, lobby_id, players, args)
+    final_round = max(commits)
+    deadline = time.perf_counter() + 30
+    while time.perf_counter() < deadline and any(final_round not in s.round_seen_at for s in subscribers if not s.errors):
+        time.sleep(0.05)
+    wall_seconds = time.perf_counter() - start
+    stop.set()
+
+    lags = []
+    missed = 0
+    for subscriber in subscribers:
+        for round_number, committed in commits.items():
+            seen = subscriber.round_seen_at.get(round_number)
+            if seen is None:
+                # Skipping straight past a round is fine as long as a later one arrived
+                if not any(r > round_number for r in subscriber.round_seen_at):
+                    missed += 1
+                continue
+            lags.append(max(0.0, seen - committed) * 1000)
+    lags.sort()
+    reads = sum(s.reads for s in subscribers)
+    errors = sum(s.errors for s in subscribers)
+    encodes = backend.lobby_broadcaster.encodes - encodes_before
+    final_prompt = backend.build_round_prompt(backend.lobbies[lobby_id])
+
+    print("=" * 80)
+    print(f"subscribers: {len(subscribers)}, errors: {errors}, missed rounds: {missed}")
+    print(f"rounds committed: {len(commits)} in {wall_seconds:.2f}s")
+    print(f"delivery lag after commit: p50 {percentile(lags, 50):.1f} ms, p95 {percentile(lags, 95):.1f} ms, "
+          f"p99 {percentile(lags, 99):.1f} ms, max {lags[-1] if lags else 0:.1f} ms")
+    print(f"lobby reads served: {reads} (+{sum(s.not_modified for s in subscribers)} not modified), "
+          f"encodes: {encodes} ({reads / max(encodes, 1):.1f} reads per encode)")
+    print(f"round prompt for {args.players} players: {len(final_prompt)} chars")
+    print(f"upstream calls: {mocks.counts}")
+    print("=" * 80)
+
+    server.shutdown()
+    mocks.stop()
+    if errors or missed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
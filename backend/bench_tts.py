@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Narration size and latency per quality tier.
+Serves app.py in-process against the mock upstreams and requests the same
+story paragraphs from /text-to-speech at every tier, first cold (synthesized
+from the mock) and then warm (from the segment cache). Reports bytes per
+response, time to first byte, full transfer time on this machine, and the
+estimated download time over a slow link.
+
+Usage: python bench_tts.py [--stories 5] [--link-kbps 400]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from mock_upstreams import MockUpstreams, PROFILES
+
+STORY = (
+    "The torches gutter as the party descends into the dragon's lair, chapter {index}. "
+    "\"Stay close,\" the old knight whispered, raising his shield. "
+    "Mira's lantern swings across walls carved with the kingdom's forgotten oaths. "
+    "From the dark, the dragon roared, \"Who dares disturb my hoard?\""
+)
+
+
+def fetch(base, text, tier):
+    """(bytes, seconds to first byte, seconds to last byte) for one narration"""
+    start = time.perf_counter()
+    response = requests.post(f'{base}/text-to-speech', params={'quality': tier}, json={'text': text}, stream=True)
+    response.raise_for_status()
+    if response.headers.get('X-Audio-Quality') != tier:
+        raise RuntimeError(f"asked for {tier}, got {response.headers.get('X-Audio-Quality')}")
+    first_byte = None
+    size = 0
+    for chunk in response.iter_content(chunk_size=None):
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    return size, first_byte, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='fast')
+    parser.add_argument('--latency-scale', type=float, default=1.0)
+    parser.add_argument('--stories', type=int, default=5, help='paragraphs per tier')
+    parser.add_argument('--link-kbps', type=int, default=400, help='slow link to estimate downloads for')
+    args = parser.parse_args()
+
+    mocks = MockUpstreams(args.profile, args.latency_scale).start()
+    os.environ.update(mocks.env())
+    os.environ.setdefault('IMAGE_CACHE_DIR', tempfile.mkdtemp(prefix='bench-images-'))
+    # Every simulated client shares one loopback address, so only the per-user and per-lobby limits apply
+    os.environ.setdefault('RATE_LIMIT_IP_PER_MINUTE', '0')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    # Configuration is read at import time, so import only after the env points at the mocks
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as backend
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    texts = [STORY.format(index=index) for index in range(args.stories)]
+    print("=" * 100)
+    print(f"{'tier':<10}{'format':<16}{'pass':<6}{'avg KiB':>10}{'TTFB p50 ms':>14}{'TTFB max ms':>14}"
+          f"{'total ms':>11}{f'@{args.link_kbps}kbps s':>17}")
+    print("-" * 100)
+    for tier, (output_format, _) in backend.TTS_TIERS.items():
+        for label in ('cold', 'warm'):
+            results = [fetch(base, text, tier) for text in texts]
+            sizes = [size for size, _, _ in results]
+            first_bytes = sorted(first_byte * 1000 for _, first_byte, _ in results)
+            totals = [total * 1000 for _, _, total in results]
+            avg_bytes = statistics.mean(sizes)
+            print(f"{tier:<10}{output_format:<16}{label:<6}{avg_bytes / 1024:>10.1f}{statistics.median(first_bytes):>14.1f}"
+                  f"{first_bytes[-1]:>14.1f}{statistics.mean(totals):>11.1f}{avg_bytes * 8 / 1000 / args.link_kbps:>17.2f}")
+    print("=" * 100)
+    print(f"upstream calls: {mocks.counts}")
+
+    server.shutdown()
+    mocks.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the Airia, Stack-AI and ElevenLabs APIs.
+Each mock answers the same request shapes the backend sends, with latency,
+error-rate and payload-size taken from a profile, so backend performance can
+be measured without network access or API keys.
+
+Usage: python mock_upstreams.py [--profile realistic] [--latency-scale 0.1]
+Prints the environment variables that point app.py at the mocks.
+"""
+
+import argparse
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# latency_ms/jitter_ms: response delay (time to first byte for ElevenLabs)
+# error_rate: fraction of calls answered with HTTP 503
+PROFILES = {
+    'fast': {
+        'airia': {'latency_ms': 50, 'jitter_ms': 10, 'error_rate': 0.0, 'story_chars': 700},
+        'stackai': {'latency_ms': 80, 'jitter_ms': 20, 'error_rate': 0.0, 'image_bytes': 150_000},
+        'elevenlabs': {'latency_ms': 40, 'jitter_ms': 10, 'error_rate': 0.0},
+    },
+    'realistic': {
+        'airia': {'latency_ms': 8000, 'jitter_ms': 3000, 'error_rate': 0.01, 'story_chars': 900},
+        'stackai': {'latency_ms': 12000, 'jitter_ms': 4000, 'error_rate': 0.02, 'image_bytes': 1_500_000},
+        'elevenlabs': {'latency_ms': 600, 'jitter_ms': 200, 'error_rate': 0.01},
+    },
+    'degraded': {
+        'airia': {'latency_ms': 20000, 'jitter_ms': 10000, 'error_rate': 0.2, 'story_chars': 900},
+        'stackai': {'latency_ms': 30000, 'jitter_ms': 10000, 'error_rate': 0.3, 'image_bytes': 1_500_000},
+        'elevenlabs': {'latency_ms': 2000, 'jitter_ms': 1000, 'error_rate': 0.1},
+    },
+    'large-payload': {
+        'airia': {'latency_ms': 200, 'jitter_ms': 50, 'error_rate': 0.0, 'story_chars': 4000},
+        'stackai': {'latency_ms': 300, 'jitter_ms': 100, 'error_rate': 0.0, 'image_bytes': 6_000_000},
+        'elevenlabs': {'latency_ms': 100, 'jitter_ms': 30, 'error_rate': 0.0},
+    },
+}
+
+WORDS = (
+    "the torchlight flickers across ancient stone as the party presses deeper into "
+    "the dragon's lair where shadows gather and forgotten runes glow with a cold "
+    "blue fire while distant drums echo through the kingdom's buried halls"
+).split()
+
+SPEAKERS = ('the old knight', 'Mira', 'the dragon', 'the innkeeper', 'Sir Roland')
+
+# Speech runs at roughly 15 characters per second
+CHARS_PER_SECOND = 15
+
+
+def make_png(width, height, seed=0):
+    """A valid PNG of random pixels; random data keeps compressed size near width*height*3"""
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(raw, 1)) + chunk(b'IEND', b'')
+
+
+def tag_png(png, text):
+    """Insert a tEXt chunk so each generated image has distinct bytes without re-encoding"""
+    data = b'Comment\x00' + text.encode()
+    chunk = struct.pack('>I', len(data)) + b'tEXt' + data + struct.pack('>I', zlib.crc32(b'tEXt' + data) & 0xffffffff)
+    return png[:-12] + chunk + png[-12:]
+
+
+class MockUpstreams:
+    """Runs the three mock APIs on ephemeral localhost ports in daemon threads"""
+
+    def __init__(self, profile='fast', latency_scale=1.0, seed=1234):
+        if isinstance(profile, str):
+            profile = PROFILES[profile]
+        self.profile = profile
+        self.latency_scale = latency_scale
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.counts = {'airia': 0, 'stackai': 0, 'stackai_image': 0, 'elevenlabs': 0, 'errors': 0}
+        self.counts_lock = threading.Lock()
+        self.servers = {}
+        self.image_counter = 0
+        self.executions = {}  # asyncOutput execution id -> monotonic time its output is ready
+        side = max(16, int((profile['stackai']['image_bytes'] / 3) ** 0.5))
+        self.base_png = make_png(side, side, seed)
+
+    # -- helpers used by the handlers --------------------------------------
+
+    def delay(self, service):
+        settings = self.profile[service]
+        with self.rng_lock:
+            ms = max(0.0, self.rng.gauss(settings['latency_ms'], settings['jitter_ms']))
+        time.sleep(ms * self.latency_scale / 1000)
+
+    def should_fail(self, service):
+        with self.rng_lock:
+            failed = self.rng.random() < self.profile[service]['error_rate']
+        if failed:
+            self.count('errors')
+        return failed
+
+    def count(self, key):
+        with self.counts_lock:
+            self.counts[key] += 1
+
+    def story_json(self):
+        """Model output in the strict JSON schema the backend prompts for"""
+        target = self.profile['airia']['story_chars']
+        with self.rng_lock:
+            sentences = []
+            length = 0
+            while length < target:
+                if self.rng.random() < 0.3:
+                    line = ' '.join(self.rng.choice(WORDS) for _ in range(6)).capitalize()
+                    sentence = f'"{line}!" {self.rng.choice(SPEAKERS)} said.'
+                else:
+                    sentence = ' '.join(self.rng.choice(WORDS) for _ in range(14)).capitalize() + '.'
+                sentences.append(sentence)
+                length += len(sentence) + 1
+            summary = ' '.join(self.rng.choice(WORDS) for _ in range(50)).capitalize() + '.'
+            options = [' '.join(self.rng.choice(WORDS) for _ in range(6)).capitalize() + '.' for _ in range(4)]
+        return json.dumps({'story': ' '.join(sentences), 'summary50': summary, 'options': options})
+
+    def start_execution(self):
+        """Register an asyncOutput execution that completes after the profile latency"""
+        settings = self.profile['airia']
+        with self.rng_lock:
+            ms = max(0.0, self.rng.gauss(settings['latency_ms'], settings['jitter_ms']))
+            execution_id = f'exec-{self.rng.getrandbits(64):016x}'
+        with self.counts_lock:
+            self.executions[execution_id] = time.monotonic() + ms * self.latency_scale / 1000
+        return {'executionId': execution_id, 'status': 'Pending'}
+
+    def poll_execution(self, execution_id):
+        with self.counts_lock:
+            ready_at = self.executions.get(execution_id)
+            if ready_at is not None and ready_at <= time.monotonic():
+                del self.executions[execution_id]
+        if ready_at is None:
+            return None
+        if ready_at > time.monotonic():
+            return {'executionId': execution_id, 'status': 'Running'}
+        if self.should_fail('airia'):
+            return {'executionId': execution_id, 'status': 'Failed'}
+        return {'executionId': execution_id, 'status': 'Completed', 'output': self.story_json()}
+
+    # -- servers -------------------------------------------------------------
+
+    def start(self):
+        for name, handler in (('airia', AiriaHandler), ('stackai', StackAIHandler), ('elevenlabs', ElevenLabsHandler)):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+            server.daemon_threads = True
+            server.mock = self
+            threading.Thread(target=server.serve_forever, name=f'mock-{name}', daemon=True).start()
+            self.servers[name] = server
+        return self
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def url(self, name):
+        return f'http://127.0.0.1:{self.servers[name].server_port}'
+
+    def env(self):
+        """Environment variables that point app.py at these mocks"""
+        return {
+            'AIRIA_API_KEY': 'mock-airia-key',
+            'AIRIA_PIPELINE_URL': self.url('airia') + '/v2/PipelineExecution/mock',
+            'AIRIA_EXECUTION_URL': self.url('airia') + '/v2/PipelineExecution/mock/executions/{execution_id}',
+            'STACK_AI_API_URL': self.url('stackai') + '/inference/v0/run/mock',
+            'STACK_AI_API_KEY': 'mock-stackai-key',
+            'ELEVENLABS_API_KEY': 'mock-elevenlabs-key',
+            'ELEVENLABS_BASE_URL': self.url('elevenlabs'),
+        }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body) if body else {}
+
+    def send_body(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self):
+        self.send_body(503, json.dumps({'error': 'mock upstream unavailable'}).encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AiriaHandler(MockHandler):
+    def do_POST(self):
+        request = self.read_json()
+        self.mock.count('airia')
+        if request.get('asyncOutput'):
+            # Answer at once with an execution id; the output is ready after the profile latency
+            return self.send_body(200, json.dumps(self.mock.start_execution()).encode())
+        self.mock.delay('airia')
+        if self.mock.should_fail('airia'):
+            return self.send_error_json()
+        self.send_body(200, json.dumps({'output': self.mock.story_json()}).encode())
+
+    def do_GET(self):
+        execution_id = urlparse(self.path).path.rsplit('/', 1)[-1]
+        execution = self.mock.poll_execution(execution_id)
+        if execution is None:
+            return self.send_body(404, json.dumps({'error': 'unknown execution'}).encode())
+        self.send_body(200, json.dumps(execution).encode())
+
+
+class StackAIHandler(MockHandler):
+    def do_POST(self):
+        self.read_json()
+        self.mock.count('stackai')
+        self.mock.delay('stackai')
+        if self.mock.should_fail('stackai'):
+            return self.send_error_json()
+        with self.mock.counts_lock:
+            self.mock.image_counter += 1
+            image_id = self.mock.image_counter
+        image_url = f'{self.mock.url("stackai")}/generated/{image_id}.png?signature=mock'
+        body = {'outputs': {'out-0': str({'image_url': image_url})}, 'run_id': str(image_id)}
+        self.send_body(200, json.dumps(body).encode())
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if not path.startswith('/generated/'):
+            return self.send_body(404, b'{}')
+        self.mock.count('stackai_image')
+        self.send_body(200, tag_png(self.mock.base_png, path), 'image/png')
+
+
+class ElevenLabsHandler(MockHandler):
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        body = self.read_json()
+        self.mock.count('elevenlabs')
+        self.mock.delay('elevenlabs')
+        if self.mock.should_fail('elevenlabs'):
+            return self.send_error_json()
+
+        # Size the audio like the requested format would: bitrate x spoken duration
+        output_format = parse_qs(parsed.query).get('output_format', ['mp3_44100_128'])[0]
+        try:
+            kbps = int(output_format.rsplit('_', 1)[-1])
+        except ValueError:
+            kbps = 128
+        seconds = max(1.0, len(body.get('text', '')) / CHARS_PER_SECOND)
+        size = int(seconds * kbps * 1000 / 8)
+        content_type = 'audio/ogg' if output_format.startswith('opus') else 'audio/mpeg'
+
+        # Stream in chunks like the real API does
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        frame = b'\xff\xfb\x90\x64' + b'\x00' * 4092
+        sent = 0
+        while sent < size:
+            piece = frame[:min(len(frame), size - sent)]
+            self.wfile.write(piece)
+            sent += len(piece)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='fast')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='multiply every profile latency')
+    args = parser.parse_args()
+
+    mocks = MockUpstreams(args.profile, args.latency_scale).start()
+    print(f"Mock upstreams running with profile '{args.profile}' (latency x{args.latency_scale})")
+    for key, value in mocks.env().items():
+        print(f"{key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mocks.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Cold-start profile for the backend.
+Reports the slowest imports of app.py (from python -X importtime) and the time
+from launching `python app.py` to the first successful /health, over several
+runs. Pass --app with another copy of app.py to compare before and after a
+change, e.g. `git show HEAD~1:backend/app.py > /tmp/app_before.py`.
+
+Usage: python profile_startup.py [--runs 5] [--top 15] [--app PATH]
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def child_env():
+    """Environment for the profiled process: keys set so every client would be built"""
+    env = dict(os.environ)
+    env.setdefault('ELEVENLABS_API_KEY', 'profile-dummy-key')
+    env.setdefault('AIRIA_API_KEY', 'profile-dummy-key')
+    env['FLASK_ENV'] = 'production'
+    env['LOG_LEVEL'] = 'WARNING'
+    return env
+
+
+def import_profile(app_path, top):
+    """(module, self ms, cumulative ms) rows for the slowest imports, plus the total"""
+    module = os.path.splitext(os.path.basename(app_path))[0]
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(app_path)), env=child_env(),
+        capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name[1:].rstrip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    total = next((cumulative for name, _, cumulative in rows if name == module), 0.0)
+    top_level = [row for row in rows if row[0].startswith('  ') and not row[0].startswith('   ')]
+    return total, sorted(top_level, key=lambda row: row[2], reverse=True)[:top]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_to_health(app_path, timeout=30):
+    """Seconds from spawning the server to its first 200 from /health"""
+    port = free_port()
+    env = child_env()
+    env['PORT'] = str(port)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.basename(app_path)],
+                               cwd=os.path.dirname(os.path.abspath(app_path)), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if requests.get(f'http://127.0.0.1:{port}/health', timeout=1).ok:
+                    return time.perf_counter() - start
+            except requests.RequestException:
+                time.sleep(0.005)
+        raise RuntimeError(f'{app_path} did not answer /health within {timeout}s')
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--app', default=os.path.join(HERE, 'app.py'), help='app module to profile')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='imports to list')
+    args = parser.parse_args()
+
+    total, rows = import_profile(args.app, args.top)
+    print("=" * 80)
+    print(f"Import profile for {args.app}: {total:.1f} ms total")
+    print("=" * 80)
+    print(f"{'module':<50}{'self ms':>12}{'cumulative ms':>16}")
+    for name, self_ms, cumulative_ms in rows:
+        print(f"{name.strip():<50}{self_ms:>12.1f}{cumulative_ms:>16.1f}")
+
+    timings = [time_to_health(args.app) for _ in range(args.runs)]
+    print()
+    print(f"Process start to first /health over {args.runs} runs: "
+          f"median {statistics.median(timings) * 1000:.0f} ms, "
+          f"min {min(timings) * 1000:.0f} ms, max {max(timings) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
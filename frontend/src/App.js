@@ -2,7 +2,8 @@ import React, { useState, useRef, useEffect } from 'react';
 import { IoArrowBack } from 'react-icons/io5';
 import Lobby from './Lobby';
 import LobbyRoom from './LobbyRoom';
-import { API_URL } from './config';
+import { API_URL, mediaUrl, newIdempotencyKey, postIdempotent } from './config';
+import { audioFromResponse, fetchStoryAudio } from './audio';
 
 function App() {
   const [messages, setMessages] = useState([]);
@@ -16,6 +17,8 @@ function App() {
   const [currentAudio, setCurrentAudio] = useState(null);
   const [isPlayingAudio, setIsPlayingAudio] = useState(false);
   const [latestStory, setLatestStory] = useState('');
+  const [latestAudioUrl, setLatestAudioUrl] = useState(null);
+  const pendingSceneRef = useRef(null);
   
   // Lobby state
   const [gameMode, setGameMode] = useState('menu'); // 'menu', 'solo', 'lobby'
@@ -48,6 +51,24 @@ function App() {
     scrollToBottom(rightPageRef);
   }, [messages]);
 
+  // The story arrives with a placeholder preview; swap in the full render when
+  // it is ready, unless a newer story has replaced the scene meanwhile
+  const swapInSceneImage = async (pendingPath) => {
+    pendingSceneRef.current = pendingPath;
+    try {
+      const response = await fetch(`${API_URL}${pendingPath}`);
+      if (!response.ok) {
+        return;
+      }
+      const data = await response.json();
+      if (pendingSceneRef.current === pendingPath) {
+        setSceneImage(data.scene_image);
+      }
+    } catch (err) {
+      // Keep showing the preview
+    }
+  };
+
   const sendMessage = async () => {
     if (!inputValue.trim() || isLoading) return;
 
@@ -63,16 +84,10 @@ function App() {
     setError('');
 
     try {
-      const response = await fetch(`${API_URL}/story`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ 
-          message: userMessage.content,
-          eventsRemaining: eventsRemaining
-        }),
-      });
+      const response = await postIdempotent('/story', {
+        message: userMessage.content,
+        eventsRemaining: eventsRemaining
+      }, newIdempotencyKey());
 
       const data = await response.json();
 
@@ -86,8 +101,13 @@ function App() {
         setOptions(Array.isArray(data.options) ? data.options : []);
         setEventsRemaining(data.eventsRemaining || 0);
         setStoryComplete(data.storyComplete || false);
-        setSceneImage(data.scene_image || null);
+        setSceneImage(data.scene_image || data.scene_preview || null);
+        pendingSceneRef.current = null;
+        if (data.scene_image_pending) {
+          swapInSceneImage(data.scene_image_pending);
+        }
         setLatestStory(data.story); // Save for audio playback
+        setLatestAudioUrl(data.audio_url || null);
       } else {
         setError(data.error || 'Something went wrong');
       }
@@ -130,18 +150,10 @@ function App() {
     setError('');
 
     try {
-      const response = await fetch(`${API_URL}/text-to-speech`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ text: latestStory }),
-      });
+      const response = await fetchStoryAudio(latestStory, latestAudioUrl);
 
       if (response.ok) {
-        const audioBlob = await response.blob();
-        const audioUrl = URL.createObjectURL(audioBlob);
-        const audio = new Audio(audioUrl);
+        const audio = await audioFromResponse(response);
         
         audio.onended = () => {
           setIsPlayingAudio(false);
@@ -332,9 +344,9 @@ function App() {
               <div className="scene-image-container">
                 <div className="scene-image-label">Current Scene</div>
                 <img 
-                  src={sceneImage} 
+                  src={mediaUrl(sceneImage)} 
                   alt="Scene visualization" 
-                  className="scene-image"
+                  className={sceneImage.startsWith('data:') ? 'scene-image preview' : 'scene-image'}
                   onError={(e) => {
                     e.target.style.display = 'none';
                   }}
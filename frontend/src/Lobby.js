@@ -6,6 +6,7 @@ function Lobby({ onJoinLobby, onCreateLobby }) {
   const [mode, setMode] = useState('menu'); // 'menu', 'create', 'join'
   const [username, setUsername] = useState('');
   const [lobbyCode, setLobbyCode] = useState('');
+  const [maxPlayers, setMaxPlayers] = useState(3);
   const [error, setError] = useState('');
 
   const handleCreateLobby = async () => {
@@ -20,7 +21,7 @@ function Lobby({ onJoinLobby, onCreateLobby }) {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ username: username.trim() }),
+        body: JSON.stringify({ username: username.trim(), max_players: maxPlayers }),
       });
 
       const data = await response.json();
@@ -65,6 +66,65 @@ function Lobby({ onJoinLobby, onCreateLobby }) {
     }
   };
 
+  // Quick match drops the player into the fullest open lobby, or hosts a new one
+  const handleQuickMatch = async () => {
+    if (!username.trim()) {
+      setError('Please enter a username');
+      return;
+    }
+
+    try {
+      const response = await fetch(`${API_URL}/lobby/quickmatch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ username: username.trim() }),
+      });
+
+      const data = await response.json();
+
+      if (response.ok) {
+        onJoinLobby(data.lobby_id, data.user_id, username.trim());
+      } else {
+        setError(data.error || 'Failed to find a lobby');
+      }
+    } catch (err) {
+      setError('Failed to connect to server');
+    }
+  };
+
+  // Spectators follow the story read-only; they get a spectator id in place of a user id
+  const handleSpectateLobby = async () => {
+    if (!username.trim() || !lobbyCode.trim()) {
+      setError('Please enter both username and lobby code');
+      return;
+    }
+
+    try {
+      const response = await fetch(`${API_URL}/lobby/spectate`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+          username: username.trim(),
+          lobby_id: lobbyCode.trim().toUpperCase()
+        }),
+      });
+
+      const data = await response.json();
+
+      if (response.ok) {
+        onJoinLobby(data.lobby_id, data.spectator_id, username.trim());
+      } else {
+        setError(data.error || 'Failed to spectate lobby');
+      }
+    } catch (err) {
+      setError('Failed to connect to server');
+    }
+  };
+
   return (
     <div className="book-container">
       <div className="open-book lobby-book">
@@ -85,7 +145,7 @@ function Lobby({ onJoinLobby, onCreateLobby }) {
 
               {mode === 'menu' && (
                 <div className="lobby-menu">
-                  <p className="lobby-description">Join up to 3 players in an epic collaborative storytelling adventure!</p>
+                  <p className="lobby-description">Gather a party for an epic collaborative storytelling adventure, or watch one unfold!</p>
                   
                   <div className="username-input">
                     <input
@@ -116,6 +176,13 @@ function Lobby({ onJoinLobby, onCreateLobby }) {
                     >
                       🚪 Join Existing Lobby
                     </button>
+                    <button 
+                      className="join-button"
+                      onClick={handleQuickMatch}
+                      disabled={!username.trim()}
+                    >
+                      ⚡ Quick Match
+                    </button>
                   </div>
                 </div>
               )}
@@ -124,6 +191,13 @@ function Lobby({ onJoinLobby, onCreateLobby }) {
                 <div className="create-lobby">
                   <h3>Create New Lobby</h3>
                   <p>You'll be the host and can invite others with your lobby code.</p>
+                  <div className="lobby-code-input">
+                    <select value={maxPlayers} onChange={(e) => setMaxPlayers(Number(e.target.value))}>
+                      {[3, 6, 12, 24, 48].map((size) => (
+                        <option key={size} value={size}>Up to {size} players</option>
+                      ))}
+                    </select>
+                  </div>
                   <button 
                     className="confirm-button"
                     onClick={handleCreateLobby}
@@ -161,6 +235,12 @@ function Lobby({ onJoinLobby, onCreateLobby }) {
                   >
                     Join Lobby
                   </button>
+                  <button 
+                    className="confirm-button"
+                    onClick={handleSpectateLobby}
+                  >
+                    Watch as Spectator
+                  </button>
                   <button 
                     className="back-button"
                     onClick={() => setMode('menu')}
@@ -1,6 +1,21 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { IoArrowBack } from 'react-icons/io5';
-import { API_URL } from './config';
+import { API_URL, mediaUrl, newIdempotencyKey, postIdempotent } from './config';
+import { audioFromResponse, fetchStoryAudio } from './audio';
+
+// Responses can arrive out of order; never replace lobby state with an older version
+const newerLobby = (next) => (prev) => (prev && next.version < prev.version ? prev : next);
+
+// A poll that only landed scene renders carries {message index: image url}
+const withSceneImages = (version, sceneImages) => (prev) => {
+  if (!prev || version <= prev.version) {
+    return prev;
+  }
+  const story_messages = prev.story_messages.map((msg, index) => (
+    sceneImages[index] ? { ...msg, scene_image: sceneImages[index] } : msg
+  ));
+  return { ...prev, version, story_messages };
+};
 
 function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
   const [lobby, setLobby] = useState(null);
@@ -11,30 +26,62 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
   const [error, setError] = useState('');
   const [currentAudio, setCurrentAudio] = useState(null);
   const [isPlayingAudio, setIsPlayingAudio] = useState(false);
+  const choiceKey = useRef({ attempt: null, key: null });
 
-  // Poll lobby state
+  const [now, setNow] = useState(Date.now());
+
+  // Follow lobby state by long-polling: the server answers as soon as the
+  // lobby changes past the version we hold, or with 304 after the wait.
+  // Finished scene renders arrive as patches rather than the whole lobby.
   useEffect(() => {
-    const pollLobby = async () => {
-      try {
-        const response = await fetch(`${API_URL}/lobby/${lobbyId}`);
-        const data = await response.json();
-        
-        if (response.ok) {
-          setLobby(data.lobby);
-        } else {
-          setError(data.error || 'Failed to fetch lobby state');
+    const controller = new AbortController();
+    const pause = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+    const followLobby = async () => {
+      let version = null;
+      while (!controller.signal.aborted) {
+        try {
+          const query = version === null ? '' : `?since=${version}&wait=20&patch=1`;
+          const response = await fetch(`${API_URL}/lobby/${lobbyId}${query}`, { signal: controller.signal });
+          if (response.status === 304) {
+            continue;
+          }
+          if (response.status === 410) {
+            // Finished and archived: keep showing the last state we have
+            return;
+          }
+          const data = await response.json();
+
+          if (response.ok && data.scene_images) {
+            version = data.version;
+            setLobby(withSceneImages(data.version, data.scene_images));
+          } else if (response.ok) {
+            version = data.lobby.version;
+            setLobby(newerLobby(data.lobby));
+          } else {
+            setError(data.error || 'Failed to fetch lobby state');
+            await pause(2000);
+          }
+        } catch (err) {
+          if (controller.signal.aborted) {
+            return;
+          }
+          setError('Failed to connect to server');
+          await pause(2000);
         }
-      } catch (err) {
-        setError('Failed to connect to server');
       }
     };
 
-    pollLobby();
-    const interval = setInterval(pollLobby, 2000); // Poll every 2 seconds
-    
-    return () => clearInterval(interval);
+    followLobby();
+    return () => controller.abort();
   }, [lobbyId]);
 
+  // Tick the round countdown between lobby updates
+  useEffect(() => {
+    const interval = setInterval(() => setNow(Date.now()), 1000);
+    return () => clearInterval(interval);
+  }, []);
+
   // Handle mobile viewport
   useEffect(() => {
     const viewport = document.querySelector('meta[name="viewport"]');
@@ -61,7 +108,7 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
 
       if (response.ok) {
         setIsReady(!isReady);
-        setLobby(data.lobby);
+        setLobby(newerLobby(data.lobby));
       } else {
         setError(data.error || 'Failed to update ready status');
       }
@@ -80,27 +127,26 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
     setError('');
 
     try {
-      const response = await fetch(`${API_URL}/lobby/choice`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({
-          user_id: userId,
-          lobby_id: lobbyId,
-          choice: selectedChoice
-        }),
-      });
+      // Resubmitting the same choice in the same round reuses its key
+      const attempt = `${lobby && lobby.current_round}:${selectedChoice}`;
+      if (choiceKey.current.attempt !== attempt) {
+        choiceKey.current = { attempt, key: newIdempotencyKey() };
+      }
+      const response = await postIdempotent('/lobby/choice', {
+        user_id: userId,
+        lobby_id: lobbyId,
+        choice: selectedChoice
+      }, choiceKey.current.key);
 
       const data = await response.json();
 
       if (response.ok) {
         if (data.waiting_for_others) {
           // Still waiting for other players
-          setLobby(data.lobby);
+          setLobby(newerLobby(data.lobby));
         } else {
           // Story progressed
-          setLobby(data.lobby);
+          setLobby(newerLobby(data.lobby));
           setSelectedChoice('');
         }
       } else {
@@ -133,7 +179,7 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
     }
   };
 
-  const playStoryAudio = async (storyText) => {
+  const playStoryAudio = async (storyText, audioUrl) => {
     if (!storyText) {
       setError('No story to read');
       return;
@@ -151,18 +197,10 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
     setError('');
 
     try {
-      const response = await fetch(`${API_URL}/text-to-speech`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ text: storyText }),
-      });
+      const response = await fetchStoryAudio(storyText, audioUrl, { user_id: userId, lobby_id: lobbyId });
 
       if (response.ok) {
-        const audioBlob = await response.blob();
-        const audioUrl = URL.createObjectURL(audioBlob);
-        const audio = new Audio(audioUrl);
+        const audio = await audioFromResponse(response);
         
         audio.onended = () => {
           setIsPlayingAudio(false);
@@ -198,11 +236,14 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
 
   const isHost = userId === lobby.host_user_id;
   const currentUser = lobby.users[userId];
+  const isSpectator = !currentUser;
   const otherUsers = Object.entries(lobby.users).filter(([uid]) => uid !== userId);
   const allReady = Object.values(lobby.users).every(user => user.ready);
   const playerCount = Object.keys(lobby.users).length;
   const canStart = playerCount >= 2 && allReady;
   const allChosen = Object.values(lobby.users).every(user => user.choice !== null);
+  // Round options are stored once per message; player_options holds indexes into them
+  const latestMessage = lobby.story_messages[lobby.story_messages.length - 1];
 
   return (
     <div className="book-container">
@@ -212,9 +253,13 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
         </button>
         <h3>Lobby: {lobbyId}</h3>
         <div className="lobby-stats-header">
-          <span>Players: {playerCount}/3</span>
+          <span>Players: {playerCount}/{lobby.max_users}</span>
+          {lobby.spectator_count > 0 && <span>Watching: {lobby.spectator_count}</span>}
           <span>Events: {lobby.events_remaining}/10</span>
           <span>Round: {lobby.current_round}</span>
+          {lobby.round_deadline && (
+            <span>Time left: {Math.max(0, Math.round(lobby.round_deadline - now / 1000))}s</span>
+          )}
         </div>
       </div>
 
@@ -234,13 +279,19 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
             <div className="players-section">
               <h3>Players</h3>
               <div className="players-list">
-                <div className={`player ${isHost ? 'host' : ''}`}>
-                  <span className="player-name">{currentUser.username} (You)</span>
-                  <span className="player-status">
-                    {isHost ? 'Host' : 'Player'}
-                    {currentUser.ready ? ' ✓ Ready' : ' ○ Not Ready'}
-                  </span>
-                </div>
+                {isSpectator ? (
+                  <div className="player">
+                    <span className="player-name">You are spectating</span>
+                  </div>
+                ) : (
+                  <div className={`player ${isHost ? 'host' : ''}`}>
+                    <span className="player-name">{currentUser.username} (You)</span>
+                    <span className="player-status">
+                      {isHost ? 'Host' : 'Player'}
+                      {currentUser.ready ? ' ✓ Ready' : ' ○ Not Ready'}
+                    </span>
+                  </div>
+                )}
                 {otherUsers.map(([uid, user]) => (
                   <div key={uid} className="player">
                     <span className="player-name">{user.username}</span>
@@ -254,7 +305,7 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
             </div>
 
             {/* Ready Section */}
-            {lobby.status === 'waiting' && (
+            {lobby.status === 'waiting' && !isSpectator && (
               <div className="ready-section">
                 <h3>Ready Up!</h3>
                 <p>All players must be ready to start the adventure.</p>
@@ -276,14 +327,12 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
                         setIsStarting(true);
                         setError('');
                         try {
-                          const response = await fetch(`${API_URL}/lobby/start`, {
-                            method: 'POST',
-                            headers: { 'Content-Type': 'application/json' },
-                            body: JSON.stringify({ lobby_id: lobbyId, user_id: userId })
-                          });
+                          const response = await postIdempotent('/lobby/start',
+                            { lobby_id: lobbyId, user_id: userId },
+                            newIdempotencyKey());
                           const data = await response.json();
                           if (response.ok) {
-                            setLobby(data.lobby);
+                            setLobby(newerLobby(data.lobby));
                           } else {
                             setError(data.error || 'Failed to start lobby');
                           }
@@ -320,25 +369,35 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
                           <div className="audio-controls">
                             <button 
                               className="audio-button-small"
-                              onClick={() => playStoryAudio(msg.content)}
+                              onClick={() => playStoryAudio(msg.content, msg.audio_url)}
                               disabled={isPlayingAudio && !currentAudio}
                             >
                               {isPlayingAudio ? 'Stop' : 'Listen'}
                             </button>
                           </div>
-                          {msg.scene_image && (
+                          {(msg.scene_image || msg.scene_preview) && (
                             <div className="scene-image-container">
                               <div className="scene-image-label">Scene Visualization</div>
                               <img 
-                                src={msg.scene_image} 
+                                src={msg.scene_image ? mediaUrl(msg.scene_image, index < lobby.story_messages.length - 1 ? 512 : null) : msg.scene_preview} 
                                 alt="Scene visualization" 
-                                className="scene-image"
+                                className={msg.scene_image ? 'scene-image' : 'scene-image preview'}
                                 onError={(e) => {
                                   e.target.style.display = 'none';
                                 }}
                               />
                             </div>
                           )}
+                          {!msg.user_choices && msg.votes && (
+                            <div className="user-choices">
+                              <h4>Party Vote:</h4>
+                              {Object.entries(msg.votes).sort((a, b) => b[1] - a[1]).map(([choice, count]) => (
+                                <div key={choice} className="choice-item">
+                                  <strong>{count}:</strong> {choice}
+                                </div>
+                              ))}
+                            </div>
+                          )}
                           {msg.user_choices && (
                             <div className="user-choices">
                               <h4>Player Choices:</h4>
@@ -354,13 +413,13 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
                         <div>
                           <div className="message-header">{msg.username}</div>
                           <div className="message-content">{msg.content}</div>
-                          {msg.scene_image && (
+                          {(msg.scene_image || msg.scene_preview) && (
                             <div className="scene-image-container">
                               <div className="scene-image-label">Scene Visualization</div>
                               <img 
-                                src={msg.scene_image} 
+                                src={msg.scene_image ? mediaUrl(msg.scene_image, index < lobby.story_messages.length - 1 ? 512 : null) : msg.scene_preview} 
                                 alt="Scene visualization" 
-                                className="scene-image"
+                                className={msg.scene_image ? 'scene-image' : 'scene-image preview'}
                                 onError={(e) => {
                                   e.target.style.display = 'none';
                                 }}
@@ -374,12 +433,14 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
                 </div>
 
                 {/* Choice Selection */}
-                {!lobby.story_complete && !allChosen && (
+                {!lobby.story_complete && !allChosen && !isSpectator && (
                   <div className="choice-section">
                     <h4>Choose Your Action:</h4>
                     <div className="choice-options">
-                      {lobby.story_messages.length > 0 && 
-                       lobby.story_messages[lobby.story_messages.length - 1].player_options?.[userId]?.options?.map((option, index) => (
+                      {(latestMessage?.player_options?.[userId] || [])
+                        .map((optionIndex) => latestMessage.options?.[optionIndex])
+                        .filter(Boolean)
+                        .map((option, index) => (
                         <button
                           key={index}
                           className={`choice-button ${selectedChoice === option ? 'selected' : ''}`}
@@ -403,10 +464,17 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
                   </div>
                 )}
 
+                {/* Vote progress for spectators */}
+                {!lobby.story_complete && !allChosen && isSpectator && (
+                  <div className="waiting-section">
+                    <h4>Votes in: {lobby.choices_submitted}/{playerCount}</h4>
+                  </div>
+                )}
+
                 {/* Waiting for Others */}
                 {!lobby.story_complete && allChosen && (
                   <div className="waiting-section">
-                    <h4>Waiting for other players to choose...</h4>
+                    <h4>{lobby.round_generating ? 'The story is being written...' : 'Waiting for other players to choose...'}</h4>
                     <div className="waiting-status">
                       {Object.entries(lobby.users).map(([uid, user]) => (
                         <div key={uid} className="waiting-player">
@@ -423,6 +491,9 @@ function LobbyRoom({ lobbyId, userId, username, onLeaveLobby }) {
                   <div className="story-complete">
                     <h3>🎉 Story Complete!</h3>
                     <p>Your collaborative adventure has reached its conclusion!</p>
+                    <a className="export-link" href={`${API_URL}/lobby/${lobbyId}/export`} download>
+                      Download transcript
+                    </a>
                     <button className="new-adventure-button" onClick={leaveLobby}>
                       Start New Adventure
                     </button>
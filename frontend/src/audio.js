@@ -0,0 +1,80 @@
+import { API_URL, mediaUrl } from './config';
+
+// Build an Audio element from a streamed text-to-speech response.
+// Where MediaSource can play the stream's type, audio starts with the first
+// segment the backend sends; otherwise the whole body is buffered first.
+export async function audioFromResponse(response) {
+  const mimeType = response.headers.get('Content-Type') || 'audio/mpeg';
+  const canStream = response.body && window.MediaSource && window.MediaSource.isTypeSupported(mimeType);
+
+  if (!canStream) {
+    const audioBlob = await response.blob();
+    return new Audio(URL.createObjectURL(audioBlob));
+  }
+
+  const mediaSource = new MediaSource();
+  const audio = new Audio(URL.createObjectURL(mediaSource));
+
+  mediaSource.addEventListener('sourceopen', async () => {
+    const sourceBuffer = mediaSource.addSourceBuffer(mimeType);
+    const reader = response.body.getReader();
+    const append = (chunk) => new Promise((resolve, reject) => {
+      sourceBuffer.addEventListener('updateend', resolve, { once: true });
+      sourceBuffer.addEventListener('error', reject, { once: true });
+      sourceBuffer.appendBuffer(chunk);
+    });
+
+    try {
+      for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        await append(value);
+      }
+      mediaSource.endOfStream();
+    } catch (err) {
+      if (mediaSource.readyState === 'open') {
+        mediaSource.endOfStream('decode');
+      }
+    }
+  }, { once: true });
+
+  return audio;
+}
+
+// Narration quality for this connection: a lower-bitrate tier when the browser
+// reports Data Saver or a slow network, otherwise the server default.
+export function narrationQuality() {
+  const connection = navigator.connection;
+  if (!connection) {
+    return null;
+  }
+  if (connection.saveData || ['slow-2g', '2g'].includes(connection.effectiveType)) {
+    return 'low';
+  }
+  return connection.effectiveType === '3g' ? 'standard' : null;
+}
+
+// Fetch narration audio, preferring the pre-synthesized copy at audioUrl and
+// falling back to synthesizing the text when it is missing, was evicted or was
+// not made at this quality. Lobby players pass { user_id, lobby_id } so the
+// synthesis counts against their own rate limits rather than only their IP's.
+export async function fetchStoryAudio(text, audioUrl, player = {}) {
+  const quality = narrationQuality();
+  if (audioUrl) {
+    try {
+      const response = await fetch(quality ? `${mediaUrl(audioUrl)}?quality=${quality}` : mediaUrl(audioUrl));
+      if (response.ok) {
+        return response;
+      }
+    } catch (err) {
+      // Fall through to on-demand synthesis
+    }
+  }
+  return fetch(`${API_URL}/text-to-speech`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+    },
+    body: JSON.stringify(quality ? { ...player, text, quality } : { ...player, text }),
+  });
+}
@@ -3,3 +3,56 @@ const apiUrl = process.env.REACT_APP_API_URL || 'http://localhost:8001';
 // Remove trailing slashes and dots
 export const API_URL = apiUrl.replace(/[/.]+$/, '');
 
+
+// Backend-served media (scene images, narration audio) arrives as a path on the
+// API; remote fallbacks are already absolute. Stored images accept ?w= for a
+// downscaled variant.
+export function mediaUrl(path, width) {
+  if (!path || !path.startsWith('/')) {
+    return path;
+  }
+  const url = `${API_URL}${path}`;
+  return width && path.startsWith('/images/') ? `${url}?w=${width}` : url;
+}
+
+// Generating POSTs (/story, /lobby/start, /lobby/choice) send an
+// Idempotency-Key. A retry after a dropped connection or gateway timeout then
+// attaches to the original request instead of generating the round twice.
+// A 503 while the server sheds load, or a 429 from its rate limits, carries
+// Retry-After, which is honored (up to MAX_RETRY_AFTER_SECONDS) before the retry.
+const MAX_RETRY_AFTER_SECONDS = 10;
+
+export function newIdempotencyKey() {
+  if (window.crypto && window.crypto.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+export async function postIdempotent(path, body, idempotencyKey, retries = 1) {
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(`${API_URL}${path}`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey,
+        },
+        body: JSON.stringify(body),
+      });
+      if ((response.status === 502 || response.status === 504) && attempt < retries) {
+        continue;
+      }
+      const retryAfter = Number(response.headers.get('Retry-After'));
+      if ((response.status === 503 || response.status === 429) && retryAfter && retryAfter <= MAX_RETRY_AFTER_SECONDS && attempt < retries) {
+        await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+        continue;
+      }
+      return response;
+    } catch (err) {
+      if (attempt >= retries) {
+        throw err;
+      }
+    }
+  }
+}